@@ -0,0 +1,239 @@
+from click import group, option, argument, echo, IntRange, FloatRange
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, asdict
+from faker import Faker
+from loguru import logger
+from pathlib import Path
+from statistics import median
+from typing import Any, Callable, Generator
+import datetime
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from radium226.variables import (
+    Backend,
+    ExportTarget,
+    Variable,
+    Variables,
+    VariableType,
+    VariableVisibility,
+    decrypt_variables,
+    dump_variables,
+    encrypt_variables,
+    export_variables,
+    load_variables,
+)
+from radium226.variables.backends import age, dummy
+from radium226.variables.backends.age import native as age_native
+from radium226.variables.variables import _interpolate_command
+
+
+
+DEFAULT_SIZES = [10, 100, 1_000, 10_000, 100_000]
+
+
+# Spawning `age` for each value is slow, so the age backends only get the smallest corpora by default
+DEFAULT_AGE_MAX_SIZE = 1_000
+
+
+DEFAULT_REPEAT = 5
+
+
+# How much slower than the baseline (as a fraction of it) a benchmark can get before it is reported
+DEFAULT_THRESHOLD = 0.2
+
+
+KEY_PAIR_FILE_PATH = Path(__file__).parent.parent / "tests" / "samples" / "age.key"
+
+
+# The config of the export targets which cannot export the corpus with their default one (docker cannot
+# read the line breaks of the certificates)
+EXPORT_CONFIGS: dict[ExportTarget, dict[str, str]] = {
+    ExportTarget.ENV_FILE: {"quoting": "dotenv"},
+}
+
+
+# Runs `variables -b dummy exec -v <file> -- true` in a fresh interpreter
+COLD_START_SCRIPT = "from radium226.variables import app; app()"
+
+
+
+@dataclass(frozen=True)
+class Result():
+    min: float
+    median: float
+    repeat: int
+
+
+
+def generate_variables(size: int, *, seed: int = 0) -> Variables:
+    """
+    Generate `size` variables, mostly small texts but also some large texts and files (like certificates).
+    """
+    faker = Faker()
+    faker.seed_instance(seed)
+
+    def generate_variable(index: int) -> Variable:
+        name = f"{faker.word().upper()}_{index}"
+        visibility = VariableVisibility.SECRET if faker.boolean(chance_of_getting_true=40) else VariableVisibility.PLAIN
+        match faker.random_int(0, 99):
+            case kind if kind < 80:
+                return Variable(name=name, value=faker.sentence(), visibility=visibility, type=VariableType.TEXT)
+
+            case kind if kind < 95:
+                return Variable(name=name, value=faker.text(max_nb_chars=2_000), visibility=visibility, type=VariableType.TEXT)
+
+            case _:
+                lines = [faker.pystr(min_chars=64, max_chars=64) for _ in range(faker.random_int(10, 40))]
+                value = "\n".join(["-----BEGIN CERTIFICATE-----", *lines, "-----END CERTIFICATE-----", ""])
+                return Variable(name=name, value=value, visibility=visibility, type=VariableType.FILE)
+
+    return Variables(generate_variable(index) for index in range(size))
+
+
+def measure(function: Callable[[], Any], *, repeat: int) -> Result:
+    durations: list[float] = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started_at)
+    return Result(min=min(durations), median=median(durations), repeat=repeat)
+
+
+@contextmanager
+def create_backends(age_max_size: int) -> Generator[dict[str, tuple[Backend, int | None]], None, None]:
+    # Each backend, with the largest corpus it should be measured with
+    with ExitStack() as exit_stack:
+        backends: dict[str, tuple[Backend, int | None]] = {
+            "dummy": (exit_stack.enter_context(dummy.create_backend(dummy.parse_config({}))), None),
+            "age-native": (exit_stack.enter_context(age_native.create_backend(age_native.parse_config({"key_pair": str(KEY_PAIR_FILE_PATH)}))), age_max_size),
+        }
+        if shutil.which("age") is not None:
+            backends["age"] = (exit_stack.enter_context(age.create_backend(age.parse_config({"key_pair": str(KEY_PAIR_FILE_PATH)}))), age_max_size)
+        else:
+            echo("The age executable is not available, skipping the age backend", err=True)
+        yield backends
+
+
+def run_benchmarks(sizes: list[int], *, repeat: int, age_max_size: int) -> dict[str, Result]:
+    results: dict[str, Result] = {}
+
+    def record(name: str, function: Callable[[], Any]) -> None:
+        result = results[name] = measure(function, repeat=repeat)
+        echo(f"{name}: {result.median * 1000:.3f} ms (min {result.min * 1000:.3f} ms)", err=True)
+
+    with tempfile.TemporaryDirectory() as temp_folder_path_str, create_backends(age_max_size) as backends:
+        temp_folder_path = Path(temp_folder_path_str)
+        for size in sizes:
+            variables = generate_variables(size)
+            file_path = temp_folder_path / f"variables-{size}.yaml"
+            dump_variables(variables, file_path)
+
+            record(f"load_variables[n={size}]", lambda: load_variables(file_path, no_override=True))
+            record(f"dump_variables[n={size}]", lambda: dump_variables(variables))
+
+            for backend_name, (backend, max_size) in backends.items():
+                if max_size is not None and size > max_size:
+                    continue
+
+                encrypted_variables = encrypt_variables(backend, variables)
+                record(f"encrypt_variables[backend={backend_name},n={size}]", lambda: encrypt_variables(backend, variables))
+                record(f"decrypt_variables[backend={backend_name},n={size}]", lambda: decrypt_variables(backend, encrypted_variables))
+
+            for target in ExportTarget:
+                config = EXPORT_CONFIGS.get(target, {})
+                try:
+                    export_variables(Variables(variables[:1]), target, config)
+                except NotImplementedError:
+                    continue
+                record(f"export_variables[target={target.value},n={size}]", lambda: export_variables(variables, target, config))
+
+            variable_values_by_name = variables.to_dict()
+            command = ["cat", *(f"{{{{ {variable.name} }}}}" for variable in variables[:20]), "--verbose"]
+            record(f"_interpolate_command[n={size}]", lambda: _interpolate_command(command, variable_values_by_name))
+
+        # Only the smallest corpus, as it is about the imports and the startup
+        file_path = temp_folder_path / f"variables-{sizes[0]}.yaml"
+        record("cli_cold_start", lambda: subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, "-b", "dummy", "exec", "-v", str(file_path), "--", "true"],
+            check=True,
+            capture_output=True,
+        ))
+
+    return results
+
+
+def load_report(report_file_path: Path) -> dict[str, Result]:
+    report = json.loads(report_file_path.read_text(encoding="utf-8"))
+    return {name: Result(**result) for name, result in report["results"].items()}
+
+
+def dump_report(results: dict[str, Result], report_file_path: Path) -> None:
+    report = {
+        "metadata": {
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": {name: asdict(result) for name, result in results.items()},
+    }
+    report_file_path.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+
+
+def compare_results(baseline_results: dict[str, Result], results: dict[str, Result], *, threshold: float) -> list[str]:
+    """
+    Give the names of the benchmarks whose median got slower than the baseline by more than the threshold.
+    """
+    regressions: list[str] = []
+    for name, result in results.items():
+        if (baseline_result := baseline_results.get(name)) is None:
+            continue
+
+        ratio = result.median / baseline_result.median
+        echo(f"{name}: {ratio:.2f}x the baseline", err=True)
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+
+@group()
+def benchmark() -> None:
+    # The logs would be measured along with the rest
+    logger.disable("radium226.variables")
+
+
+@benchmark.command()
+@option("--size", "-n", "sizes", type=IntRange(min=1), multiple=True, help="Number of variables of a corpus (can be repeated)")
+@option("--repeat", "-r", "repeat", type=IntRange(min=1), default=DEFAULT_REPEAT)
+@option("--age-max-size", "age_max_size", type=IntRange(min=0), default=DEFAULT_AGE_MAX_SIZE, help="Largest corpus to measure the age backends with")
+@option("--output", "-o", "output_file_path", type=Path, required=False, help="Where to write the results, as JSON")
+@option("--baseline", "-b", "baseline_file_path", type=Path, required=False, help="Results to compare with")
+@option("--threshold", "-t", "threshold", type=FloatRange(min=0), default=DEFAULT_THRESHOLD, help="Slowdown (as a fraction of the baseline) above which a benchmark is a regression")
+def run(sizes: tuple[int, ...], repeat: int, age_max_size: int, output_file_path: Path | None, baseline_file_path: Path | None, threshold: float) -> None:
+    results = run_benchmarks(sorted(sizes) or DEFAULT_SIZES, repeat=repeat, age_max_size=age_max_size)
+
+    if output_file_path is not None:
+        dump_report(results, output_file_path)
+
+    if baseline_file_path is not None and (regressions := compare_results(load_report(baseline_file_path), results, threshold=threshold)):
+        raise SystemExit(f"{len(regressions)} benchmarks regressed: {', '.join(regressions)}")
+
+
+@benchmark.command()
+@option("--threshold", "-t", "threshold", type=FloatRange(min=0), default=DEFAULT_THRESHOLD, help="Slowdown (as a fraction of the baseline) above which a benchmark is a regression")
+@argument("baseline_file_path", type=Path)
+@argument("report_file_path", type=Path)
+def compare(baseline_file_path: Path, report_file_path: Path, threshold: float) -> None:
+    if regressions := compare_results(load_report(baseline_file_path), load_report(report_file_path), threshold=threshold):
+        raise SystemExit(f"{len(regressions)} benchmarks regressed: {', '.join(regressions)}")
+
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -5,9 +5,16 @@ from .types import (
     Variables,
     Command,
     ExportTarget,
+    BashExportMode,
+    EnvFileQuoting,
+    KubectlExportFormat,
+    VariableAssignment,
+    AssignmentFormat,
+    FileStorage,
     VariableVisibility,
     VariableType,
     VariableNotEncryptedError,
+    VariablesNotStreamableError,
 )
 from .variables import (
     load_variables,
@@ -17,11 +24,30 @@ from .variables import (
     encrypt_variables,
     decrypt_variables,
     execute_with_variables,
+    replace_with_variables,
+    watch_and_execute_with_variables,
     set_variable,
+    set_variables,
+    parse_assignments,
     merge_variables,
+    update_variables_file,
+    iter_variables,
+    iter_decrypted_variables,
+    export_variables,
+    write_variables,
 )
 
-from .spi import Backend
+from typing import Any, TYPE_CHECKING
+
+from .spi import Backend, AsyncBackend
+
+if TYPE_CHECKING:
+    from .aio import (
+        aload_variables,
+        aencrypt_variables,
+        adecrypt_variables,
+        aexecute_with_variables,
+    )
 
 
 __all__ = [
@@ -31,6 +57,12 @@ __all__ = [
     "Variables",
     "Command",
     "ExportTarget",
+    "BashExportMode",
+    "EnvFileQuoting",
+    "KubectlExportFormat",
+    "VariableAssignment",
+    "AssignmentFormat",
+    "FileStorage",
     "load_variables",
     "dump_variables",
     "encrypt_variable",
@@ -38,10 +70,45 @@ __all__ = [
     "VariableVisibility",
     "VariableType",
     "VariableNotEncryptedError",
+    "VariablesNotStreamableError",
     "encrypt_variables",
     "decrypt_variables",
     "execute_with_variables",
+    "replace_with_variables",
+    "watch_and_execute_with_variables",
     "set_variable",
+    "set_variables",
+    "parse_assignments",
     "merge_variables",
+    "update_variables_file",
+    "iter_variables",
+    "iter_decrypted_variables",
+    "export_variables",
+    "write_variables",
     "Backend",
-]
\ No newline at end of file
+    "AsyncBackend",
+    "aload_variables",
+    "aencrypt_variables",
+    "adecrypt_variables",
+    "aexecute_with_variables",
+]
+
+
+# The asyncio API is only imported when it is used, so that it does not slow down the CLI
+_LAZY_NAMES = {
+    "aload_variables": ".aio",
+    "aencrypt_variables": ".aio",
+    "adecrypt_variables": ".aio",
+    "aexecute_with_variables": ".aio",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if (module_name := _LAZY_NAMES.get(name)) is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    from importlib import import_module
+
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
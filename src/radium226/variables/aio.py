@@ -0,0 +1,186 @@
+from typing import Any, Awaitable, Callable, TypeVar, cast
+from pathlib import Path
+from asyncio import Semaphore, gather, get_running_loop, create_subprocess_exec, to_thread
+from concurrent.futures import Executor
+from contextlib import ExitStack
+from inspect import iscoroutinefunction
+from subprocess import CompletedProcess, CalledProcessError, PIPE
+
+from .types import Variables, Command, FileStorage, DataKeyId
+from .spi import Backend, AsyncBackend, BatchBackend
+from .variables import (
+    load_variables,
+    select_variables_to_encrypt,
+    select_variables_to_decrypt,
+    encode_encrypted_values,
+    find_wrapped_data_key,
+    generate_data_key,
+    add_wrapped_data_key,
+    seal_variables,
+    get_backend_encrypted_values,
+    open_variables,
+    with_encrypted_values,
+    with_decrypted_values,
+    prepare_execution,
+)
+
+
+
+# How many values are handed to the backend at the same time, by default
+DEFAULT_LIMIT = 64
+
+
+T = TypeVar("T")
+
+
+R = TypeVar("R")
+
+
+
+class SyncBackendAdapter():
+    """
+    Makes a sync backend usable where an async one is expected by running its calls in an executor
+    (the default executor of the event loop, which is bounded, if none is given).
+    """
+
+    backend: Backend
+    executor: Executor | None
+
+    def __init__(self, backend: Backend, executor: Executor | None = None) -> None:
+        self.backend = backend
+        self.executor = executor
+
+    async def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        return await self._run_in_executor(self.backend.encrypt_value, decrypted_value)
+
+    async def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        return await self._run_in_executor(self.backend.decrypt_value, encrypted_value)
+
+    async def _run_in_executor(self, function: Callable[[T], R], argument: T) -> R:
+        return await get_running_loop().run_in_executor(self.executor, function, argument)
+
+
+class SyncBatchBackendAdapter(SyncBackendAdapter):
+    """
+    Same as SyncBackendAdapter, for the sync backends which handle all the values in one call.
+    """
+
+    backend: BatchBackend
+
+    def __init__(self, backend: BatchBackend, executor: Executor | None = None) -> None:
+        super().__init__(backend, executor)
+
+    async def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
+        return await self._run_in_executor(self.backend.encrypt_values, decrypted_values)
+
+    async def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
+        return await self._run_in_executor(self.backend.decrypt_values, encrypted_values)
+
+
+def to_async_backend(backend: Backend | AsyncBackend, *, executor: Executor | None = None) -> AsyncBackend:
+    if iscoroutinefunction(backend.decrypt_value):
+        return cast(AsyncBackend, backend)
+
+    if isinstance(backend, BatchBackend):
+        return SyncBatchBackendAdapter(backend, executor)
+
+    return SyncBackendAdapter(cast(Backend, backend), executor)
+
+
+async def _gather_in_order(function: Callable[[bytes], Awaitable[bytes]], values: list[bytes], *, limit: int) -> list[bytes]:
+    semaphore = Semaphore(limit)
+
+    async def call(value: bytes) -> bytes:
+        async with semaphore:
+            return await function(value)
+
+    # Every call is awaited before raising the first error in the order of the values, like the sync API
+    results = await gather(*(call(value) for value in values), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return cast(list[bytes], results)
+
+
+async def _encrypt_values(backend: AsyncBackend, decrypted_values: list[bytes], *, limit: int) -> list[bytes]:
+    if not decrypted_values:
+        return []
+
+    if iscoroutinefunction(batch_encrypt_values := getattr(backend, "encrypt_values", None)):
+        return cast(list[bytes], await batch_encrypt_values(decrypted_values))
+
+    return await _gather_in_order(backend.encrypt_value, decrypted_values, limit=limit)
+
+
+async def _decrypt_values(backend: AsyncBackend, encrypted_values: list[bytes], *, limit: int) -> list[bytes]:
+    if not encrypted_values:
+        return []
+
+    if iscoroutinefunction(batch_decrypt_values := getattr(backend, "decrypt_values", None)):
+        return cast(list[bytes], await batch_decrypt_values(encrypted_values))
+
+    return await _gather_in_order(backend.decrypt_value, encrypted_values, limit=limit)
+
+
+async def aload_variables(file_path: Path, /, *, no_override: bool = False, override_suffix: str = "local") -> Variables:
+    return await to_thread(load_variables, file_path, no_override=no_override, override_suffix=override_suffix)
+
+
+async def _afind_or_create_data_key(backend: AsyncBackend, data_keys: dict[DataKeyId, bytes], *, limit: int) -> tuple[DataKeyId, bytes]:
+    if (data_key_id_and_wrapped_data_key := find_wrapped_data_key(data_keys)) is not None:
+        data_key_id, wrapped_data_key = data_key_id_and_wrapped_data_key
+        [data_key] = await _decrypt_values(backend, [wrapped_data_key], limit=limit)
+        return data_key_id, data_key
+
+    data_key = generate_data_key()
+    [wrapped_data_key] = await _encrypt_values(backend, [data_key], limit=limit)
+    return add_wrapped_data_key(data_keys, wrapped_data_key), data_key
+
+
+async def aencrypt_variables(backend: Backend | AsyncBackend, variables: Variables, *, limit: int = DEFAULT_LIMIT, envelope: bool | None = None) -> Variables:
+    indices = select_variables_to_encrypt(variables)
+    if envelope is None:
+        envelope = bool(variables.data_keys)
+
+    data_keys = dict(variables.data_keys)
+    if envelope and indices:
+        data_key_id, data_key = await _afind_or_create_data_key(to_async_backend(backend), data_keys, limit=limit)
+        encrypted_variable_values = seal_variables(data_key_id, data_key, [variables[index] for index in indices])
+    else:
+        encrypted_variable_values = encode_encrypted_values(await _encrypt_values(
+            to_async_backend(backend),
+            [variables[index].value.encode("utf-8") for index in indices],
+            limit=limit,
+        ))
+
+    return with_encrypted_values(variables, indices, encrypted_variable_values, data_keys)
+
+
+async def adecrypt_variables(backend: Backend | AsyncBackend, variables: Variables, *, raise_when_not_encrypted: bool = False, limit: int = DEFAULT_LIMIT) -> Variables:
+    indices = select_variables_to_decrypt(variables, raise_when_not_encrypted=raise_when_not_encrypted)
+    unwrapped_data_keys: dict[DataKeyId, bytes] = {}
+    encrypted_values, data_key_ids = get_backend_encrypted_values(variables, indices, unwrapped_data_keys)
+    decrypted_values = open_variables(
+        variables,
+        indices,
+        await _decrypt_values(to_async_backend(backend), encrypted_values, limit=limit),
+        data_key_ids,
+        unwrapped_data_keys,
+    )
+    return with_decrypted_values(variables, indices, decrypted_values)
+
+
+async def aexecute_with_variables(command: Command, variables: Variables, *, capture_output: bool = False, check: bool = True, file_storage: FileStorage = FileStorage.DISK, **kwargs: Any) -> CompletedProcess:
+    if capture_output:
+        kwargs.setdefault("stdout", PIPE)
+        kwargs.setdefault("stderr", PIPE)
+
+    with ExitStack() as exit_stack:
+        # The files are written in a thread, like everything else which blocks
+        command, env, execution_files = await to_thread(prepare_execution, command, variables, exit_stack, file_storage=file_storage)
+        process = await create_subprocess_exec(*command, env=env, pass_fds=(*kwargs.pop("pass_fds", ()), *execution_files.fds), **kwargs)
+        stdout, stderr = await process.communicate()
+        returncode = cast(int, process.returncode)
+        if check and returncode != 0:
+            raise CalledProcessError(returncode, command, stdout, stderr)
+        return CompletedProcess(command, returncode, stdout, stderr)
@@ -1,14 +1,20 @@
-from click import option, Context, pass_context, argument, UNPROCESSED, group
+from click import option, Context, pass_context, pass_obj, argument, UNPROCESSED, group, IntRange, FloatRange, Choice, echo, UsageError
 from loguru import logger
-from typing import Generator, cast
+from typing import Any, Generator, Iterable, TextIO, cast, TYPE_CHECKING
+from contextlib import contextmanager
+from io import StringIO
+from functools import partial
 from types import SimpleNamespace
 from pathlib import Path
+import os
+import signal
 import sys
 
-from .types import OptionalPrefixAndFilePath, Variable, Variables, Command, ExportTarget, VariableVisibility, VariableType, VariableNotEncryptedError
+from .types import OptionalPrefixAndFilePath, Variable, Variables, DataKeyId, Command, ExportTarget, ExportSpec, VariableAssignment, AssignmentFormat, FileStorage, VariableVisibility, VariableType, VariableNotEncryptedError, VariablesNotStreamableError
 from .click import (
     OPTIONAL_PREFIX_AND_FILE_PATH,
     KEY_VALUE,
+    EXPORT_SPEC,
     to_list,
     to_dict,
 )
@@ -18,15 +24,39 @@ from .variables import (
     encrypt_variables,
     decrypt_variables,
     execute_with_variables,
-    export_variables,
-    set_variable,
-    encrypt_variable,
+    replace_with_variables,
+    watch_and_execute_with_variables,
+    get_override_file_path,
+    iter_variables,
+    iter_decrypted_variables,
+    write_variables,
+    set_variables,
+    parse_assignments,
+    update_variables_file,
 )
 
 from .spi import (
-    list_factories,
+    find_factory,
+    list_factory_names,
     Backend,
 )
+from .cache import (
+    DEFAULT_TTL,
+    Cache,
+    CachingBackend,
+    create_identity,
+)
+from .fingerprints import Fingerprints
+from .files import write_file_atomically, open_file_atomically
+from .tracing import Tracer, set_tracer, span, profiling
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+
+
+# How many of the files given to `exec` are loaded and decrypted at the same time
+MAX_FILE_JOBS = 16
+
 
 
 @group()
@@ -46,21 +76,83 @@ from .spi import (
     type=KEY_VALUE,
     callback=to_dict,
 )
+@option(
+    "--cache/--no-cache",
+    "use_cache",
+    envvar="VARIABLES_CACHE",
+    default=False,
+    help="Keep the decrypted values in an encrypted cache in the runtime folder",
+)
+@option(
+    "--cache-ttl",
+    "cache_ttl",
+    envvar="VARIABLES_CACHE_TTL",
+    type=FloatRange(min=0),
+    default=DEFAULT_TTL,
+    help="Number of seconds a decrypted value stays in the cache",
+)
+@option(
+    "--trace",
+    "trace_file_path",
+    envvar="VARIABLES_TRACE",
+    type=Path,
+    required=False,
+    help="Write the time spent in each phase and backend call to this file, in the Chrome trace event format",
+)
+@option(
+    "--profile",
+    "profile",
+    is_flag=True,
+    default=False,
+    help="Print where the time and the memory went (cProfile and tracemalloc) to stderr",
+)
 @pass_context
 def app(
     context: Context, 
     backend_name: str, 
     backend_config: dict[str, str],
+    use_cache: bool,
+    cache_ttl: float,
+    trace_file_path: Path | None,
+    profile: bool,
     # optional_prefixes_and_variables_file_paths: list[OptionalPrefixAndVariableFilePath],
 ) -> None:
     logger.debug("App started! ")
+
+    # The context is closed in reverse order, so the trace is written once everything else is done
+    other_data: dict[str, Any] = {"argv": sys.argv, "command": context.invoked_subcommand}
+    if trace_file_path is not None:
+        tracer = Tracer()
+        set_tracer(tracer)
+
+        def dump_trace() -> None:
+            set_tracer(None)
+            tracer.dump(trace_file_path, other_data)
+
+        context.call_on_close(dump_trace)
+    if profile:
+        other_data["profile"] = context.with_resource(profiling())
+    context.with_resource(span("command", command=context.invoked_subcommand))
+
     context.obj = SimpleNamespace()
+    context.obj.cache = Cache(ttl=cache_ttl)
+    context.obj.use_cache = use_cache
+
+    # Managing the cache does not need any key
+    if context.invoked_subcommand == "cache":
+        return
     
-    factories = list_factories()
-    factory = next((f for f in factories if f.name == backend_name), None)
-    assert factory is not None, f"Backend '{backend_name}' not found. Available backends: {[f.name for f in factories]}"
-    config = factory.parse_config(backend_config)
-    context.obj.backend = context.with_resource(factory.create_backend(config))
+    with span("find_factory", backend=backend_name):
+        factory = find_factory(backend_name)
+    assert factory is not None, f"Backend '{backend_name}' not found. Available backends: {list_factory_names()}"
+    with span("parse_config", backend=backend_name):
+        config = factory.parse_config(backend_config)
+    with span("create_backend", backend=backend_name):
+        backend = context.with_resource(factory.create_backend(config))
+    context.obj.uncached_backend = backend
+    context.obj.identity = create_identity(backend_name, config)
+    # Identical ciphertexts are decrypted only once per process, and once per TTL with the cache
+    context.obj.backend = CachingBackend(backend, context.obj.identity, context.obj.cache if use_cache else None)
     
         
 
@@ -68,28 +160,62 @@ def app(
 @app.command()
 @option("--override-suffix", "-s", "override_suffix", type=str, default="local")
 @option("--no-override", "no_override", is_flag=True, default=False)
+@option("--jobs", "-j", "jobs", type=IntRange(min=1), default=1, help="Number of concurrent backend calls")
+@option(
+    "--incremental/--no-incremental",
+    "incremental",
+    default=False,
+    help="Keep the ciphertexts of the unchanged secrets and only write the values which changed",
+)
+@option(
+    "--envelope/--no-envelope",
+    "envelope",
+    default=None,
+    help="Encrypt the secrets in-process under a data key kept in the file, so that the backend only encrypts that key (by default, when the file already has one)",
+)
 @argument("file_path", type=Path, required=True)
 @pass_context
-def encrypt(context: Context, file_path: Path, override_suffix: str, no_override: bool) -> None:
+def encrypt(context: Context, file_path: Path, override_suffix: str, no_override: bool, jobs: int, incremental: bool, envelope: bool | None) -> None:
     backend = cast(Backend, context.obj.backend)
 
     variables = load_variables(file_path, no_override=no_override, override_suffix=override_suffix)
-    variables = encrypt_variables(backend, variables)
-    dump_variables(variables, file_path)
+    if not incremental:
+        variables = encrypt_variables(backend, variables, jobs=jobs, envelope=envelope)
+        dump_variables(variables, file_path)
+        return
+
+    fingerprints = Fingerprints(file_path, context.obj.identity)
+    variables = encrypt_variables(backend, variables, jobs=jobs, fingerprints=fingerprints, envelope=envelope)
+    update_variables_file(file_path, variables)
+    fingerprints.save()
 
 
 
 @app.command()
 @option("--override-suffix", "-s", "override_suffix", type=str, default="local")
 @option("--no-override", "no_override", is_flag=True, default=False)
+@option("--jobs", "-j", "jobs", type=IntRange(min=1), default=1, help="Number of concurrent backend calls")
+@option(
+    "--incremental/--no-incremental",
+    "incremental",
+    default=False,
+    help="Remember the ciphertexts for `encrypt --incremental` and only write the values which changed",
+)
 @argument("file_path", type=Path, required=True)
 @pass_context
-def decrypt(context: Context, file_path: Path, override_suffix: str, no_override: bool) -> None:
+def decrypt(context: Context, file_path: Path, override_suffix: str, no_override: bool, jobs: int, incremental: bool) -> None:
     backend = cast(Backend, context.obj.backend)
 
     variables = load_variables(file_path, no_override=no_override, override_suffix=override_suffix)
-    variables = decrypt_variables(backend, variables)
-    dump_variables(variables, file_path)
+    if not incremental:
+        variables = decrypt_variables(backend, variables, jobs=jobs)
+        dump_variables(variables, file_path)
+        return
+
+    fingerprints = Fingerprints(file_path, context.obj.identity)
+    variables = decrypt_variables(backend, variables, jobs=jobs, fingerprints=fingerprints)
+    update_variables_file(file_path, variables)
+    fingerprints.save()
 
 
 
@@ -111,6 +237,36 @@ def decrypt(context: Context, file_path: Path, override_suffix: str, no_override
 )
 @option("--override-suffix", "-s", "override_suffix", type=str, default="local")
 @option("--no-override", "no_override", is_flag=True, default=False)
+@option("--jobs", "-j", "jobs", type=IntRange(min=1), default=None, help="Number of concurrent backend calls (1 per file by default)")
+@option(
+    "--file-storage",
+    "file_storage",
+    envvar="VARIABLES_FILE_STORAGE",
+    type=FileStorage,
+    default=None,
+    help="Where the file variables are written: temporary files on the disk (by default), or in-memory files passed as /dev/fd/N (by default with --replace)",
+)
+@option(
+    "--replace",
+    "replace",
+    is_flag=True,
+    default=False,
+    help="Replace this process by the command (execve) instead of running it as a child",
+)
+@option(
+    "--watch",
+    "watch",
+    is_flag=True,
+    default=False,
+    help="Restart the command when the variables files (or their override files) change its variables",
+)
+@option(
+    "--reload-signal",
+    "reload_signal_name",
+    type=Choice([signal_.name.removeprefix("SIG") for signal_ in signal.Signals], case_sensitive=False),
+    required=False,
+    help="With --watch, rewrite the file variables and send this signal (e.g. HUP) instead of restarting the command when only their content changed",
+)
 @argument(
     "command",
     type=UNPROCESSED,
@@ -126,22 +282,75 @@ def exec(
     auto_prefixes: bool,
     override_suffix: str,
     no_override: bool,
+    jobs: int | None,
+    file_storage: FileStorage | None,
+    replace: bool,
+    watch: bool,
+    reload_signal_name: str | None,
 ) -> None:
     backend = cast(Backend, context.obj.backend)
 
-    def yield_variables() -> Generator[Variable, None, None]:
-        for optional_prefix, file_path in optional_prefixes_and_file_paths:
-            if optional_prefix is None and auto_prefixes:
-                optional_prefix = file_path.stem.upper()
+    if watch and replace:
+        raise UsageError("--watch and --replace cannot be used together")
+
+    if reload_signal_name is not None and not watch:
+        raise UsageError("--reload-signal only makes sense with --watch")
 
-            variables = load_variables(file_path, no_override=no_override, override_suffix=override_suffix)
-            variables = variables.with_prefix(prefix) if (prefix := optional_prefix) is not None else variables
-            variables = decrypt_variables(backend, variables)
-            yield from variables
+    def load_and_decrypt_variables(optional_prefix_and_file_path: OptionalPrefixAndFilePath, backend_executor: "Executor | None" = None) -> Variables:
+        optional_prefix, file_path = optional_prefix_and_file_path
+        if optional_prefix is None and auto_prefixes:
+            optional_prefix = file_path.stem.upper()
+
+        variables = load_variables(file_path, no_override=no_override, override_suffix=override_suffix)
+        variables = variables.with_prefix(prefix) if (prefix := optional_prefix) is not None else variables
+        return decrypt_variables(backend, variables, jobs=jobs or 1, executor=backend_executor)
+
+    def yield_variables() -> Generator[Variable, None, None]:
+        if len(optional_prefixes_and_file_paths) <= 1:
+            for optional_prefix_and_file_path in optional_prefixes_and_file_paths:
+                yield from load_and_decrypt_variables(optional_prefix_and_file_path)
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        # The files are loaded and decrypted at the same time, and map() gives them back in the order
+        # of the options, so the last one still wins. The backend calls of all the files share the same
+        # workers, so that there are never more than --jobs of them at once (or one per file)
+        file_jobs = min(len(optional_prefixes_and_file_paths), MAX_FILE_JOBS)
+        with (
+            ThreadPoolExecutor(max_workers=jobs or file_jobs, thread_name_prefix="variables") as backend_executor,
+            ThreadPoolExecutor(max_workers=file_jobs, thread_name_prefix="variables-file") as executor,
+        ):
+            for variables in executor.map(partial(load_and_decrypt_variables, backend_executor=backend_executor), optional_prefixes_and_file_paths):
+                yield from variables
+
+    if watch:
+        file_paths = [file_path for _, file_path in optional_prefixes_and_file_paths]
+        if not no_override:
+            file_paths += [get_override_file_path(file_path, override_suffix) for file_path in file_paths]
+
+        # So that the command is stopped and its files removed
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+
+        # Only the ciphertexts which changed are decrypted again, as the backend keeps the other ones
+        returncode = watch_and_execute_with_variables(
+            command,
+            lambda: Variables(yield_variables()),
+            file_paths,
+            file_storage=file_storage or FileStorage.DISK,
+            reload_signal=signal.Signals[f"SIG{reload_signal_name.upper()}"] if reload_signal_name is not None else None,
+        )
+        context.exit(returncode)
 
     variables = Variables(yield_variables())
 
-    execute_with_variables(command, variables)
+    if not replace:
+        execute_with_variables(command, variables, file_storage=file_storage or FileStorage.DISK)
+        return
+
+    # The backend (and the files it may have written) are released first, as nothing runs after execve
+    context.find_root().close()
+    replace_with_variables(command, variables, file_storage=file_storage or FileStorage.MEMORY)
 
 
 
@@ -151,7 +360,7 @@ def exec(
     "-t",
     "target",
     type=ExportTarget,
-    required=True,
+    required=False,
 )
 @option(
     "--config",
@@ -163,15 +372,115 @@ def exec(
 )
 @option("--override-suffix", "-s", "override_suffix", type=str, default="local")
 @option("--no-override", "no_override", is_flag=True, default=False)
+@option("--jobs", "-j", "jobs", type=IntRange(min=1), default=1, help="Number of concurrent backend calls")
+@option(
+    "--output",
+    "-o",
+    "output_file_path",
+    type=Path,
+    required=False,
+    help="Write to this file (which can be a FIFO or /dev/fd/N) instead of stdout",
+)
+@option(
+    "--output-fd",
+    "output_fd",
+    type=IntRange(min=0),
+    required=False,
+    help="Write to this (already open) file descriptor instead of stdout",
+)
+@option(
+    "--to",
+    "export_specs",
+    type=EXPORT_SPEC,
+    multiple=True,
+    callback=to_list,
+    metavar="TARGET[,KEY=VALUE...][:PATH]",
+    help="Also export to this target, with this config and to this file (stdout by default), from the same decryption (can be repeated)",
+)
 @argument("file_path", type=Path, required=True)
 @pass_context
-def export(context: Context, file_path: Path, target: ExportTarget, config: dict[str, str], override_suffix: str, no_override: bool) -> None:
+def export(
+    context: Context,
+    file_path: Path,
+    target: ExportTarget | None,
+    config: dict[str, str],
+    override_suffix: str,
+    no_override: bool,
+    jobs: int,
+    output_file_path: Path | None,
+    output_fd: int | None,
+    export_specs: list[ExportSpec],
+) -> None:
     backend = cast(Backend, context.obj.backend)
 
-    variables = load_variables(file_path, no_override=no_override, override_suffix=override_suffix)
-    variables = decrypt_variables(backend, variables)
-    output = export_variables(variables, target, config)
-    print(output)
+    if target is None and not export_specs:
+        raise UsageError("Missing option '--target' / '-t' (or '--to')")
+
+    if output_file_path is not None and output_fd is not None:
+        raise UsageError("--output and --output-fd cannot be used together")
+
+    # The files are only opened when they are written to (one after the other), as opening a FIFO
+    # waits for its reader
+    outputs = [
+        *([(target, config, partial(_open_output, output_file_path, output_fd))] if target is not None else []),
+        *[(export_spec.target, export_spec.config, partial(_open_output, export_spec.file_path, None)) for export_spec in export_specs],
+    ]
+
+    # The decrypted values are not kept for the whole run, unless they have to go to the cache anyway
+    if not context.obj.use_cache and len(outputs) == 1:
+        backend = cast(Backend, context.obj.uncached_backend)
+
+    def write_outputs(variables: Iterable[Variable]) -> None:
+        if len(outputs) > 1:
+            variables = Variables(variables)
+
+        for output_target, output_config, open_output in outputs:
+            with open_output() as file:
+                try:
+                    write_variables(variables, output_target, output_config, file)
+                except VariablesNotStreamableError:
+                    raise
+                except ValueError as e:
+                    # e.g. a value which the target cannot represent
+                    raise SystemExit(f"Export failed: {e}") from e
+                print(file=file)
+
+    # Each variable is parsed, decrypted and written out before the next ones are read, unless the
+    # variables are exported more than once, which only decrypts them once
+    data_keys: dict[DataKeyId, bytes] = {}
+    try:
+        write_outputs(iter_decrypted_variables(
+            backend,
+            iter_variables(file_path, no_override=no_override, override_suffix=override_suffix, data_keys=data_keys),
+            jobs=jobs,
+            data_keys=data_keys,
+        ))
+    except VariablesNotStreamableError:
+        # Nothing was written to the outputs yet (see _open_output()), so the export starts again from the
+        # variables loaded at once
+        logger.debug("The variables of {file_path} cannot be streamed, loading them at once", file_path=file_path)
+        write_outputs(decrypt_variables(backend, load_variables(file_path, no_override=no_override, override_suffix=override_suffix), jobs=jobs))
+
+
+@contextmanager
+def _open_output(output_file_path: Path | None, output_fd: int | None) -> Generator[TextIO, None, None]:
+    # Nothing reaches the output unless the whole export succeeds: the regular files are written aside
+    # and renamed over, and the rest (which cannot be, like stdout or a FIFO) gets everything at once
+    if output_fd is None and output_file_path is not None and str(output_file_path) != "-" and (output_file_path.is_file() or not output_file_path.exists()):
+        with open_file_atomically(output_file_path) as file:
+            yield file
+        return
+
+    buffer = StringIO()
+    yield buffer
+    if output_fd is not None:
+        # Flushed but left open, as it belongs to the caller
+        with open(output_fd, "w", encoding="utf-8", closefd=False) as file:
+            file.write(buffer.getvalue())
+    elif output_file_path is not None and str(output_file_path) != "-":
+        output_file_path.write_text(buffer.getvalue(), encoding="utf-8")
+    else:
+        sys.stdout.write(buffer.getvalue())
 
 
 @app.command()
@@ -195,46 +504,63 @@ def export(context: Context, file_path: Path, target: ExportTarget, config: dict
 )
 @option("--override-suffix", "-s", "override_suffix", type=str, default="local")
 @option("--no-override", "no_override", is_flag=True, default=False)
-@argument("variable_name", type=str, required=True)
-@argument("variable_value", type=str, required=True)
+@option("--jobs", "-j", "jobs", type=IntRange(min=1), default=1, help="Number of concurrent backend calls")
+@option(
+    "--stdin",
+    "assignment_format",
+    type=AssignmentFormat,
+    required=False,
+    help="Also read the variables to set from stdin, as NAME=VALUE lines (env) or JSON Lines (jsonl)",
+)
+@argument("names_and_values", metavar="[NAME VALUE]...", type=str, nargs=-1)
 @pass_context
 def set(
     context: Context,
     file_path: Path,
-    variable_name: str,
-    variable_value: str,
+    names_and_values: tuple[str, ...],
     visibility: VariableVisibility | None,
     variable_type: VariableType | None,
     override_suffix: str,
     no_override: bool,
+    jobs: int,
+    assignment_format: AssignmentFormat | None,
 ) -> None:
     backend = cast(Backend, context.obj.backend)
-    # Read from stdin if value is "-"
-    if variable_value == "-":
-        variable_value = sys.stdin.read()
 
-    # Load existing variables
-    variables = load_variables(file_path, no_override=no_override, override_suffix=override_suffix)
-
-    # Set the variable
-    variables = set_variable(
-        variables,
-        name=variable_name,
-        value=variable_value,
-        visibility=visibility,
-        type=variable_type,
+    if len(names_and_values) % 2 != 0:
+        raise UsageError("Expected NAME VALUE pairs")
+
+    assignments: list[VariableAssignment] = []
+    for variable_name, variable_value in zip(names_and_values[0::2], names_and_values[1::2]):
+        # Read from stdin if value is "-"
+        if variable_value == "-":
+            if assignment_format is not None:
+                raise UsageError("The value of a variable cannot be read from stdin with --stdin")
+            variable_value = sys.stdin.read()
+        assignments.append(VariableAssignment(variable_name, variable_value, visibility, variable_type))
+
+    if assignment_format is not None:
+        try:
+            assignments += parse_assignments(sys.stdin, assignment_format, visibility=visibility, type=variable_type)
+        except ValueError as e:
+            raise UsageError(f"Unable to read the variables from stdin: {e}")
+
+    if not assignments:
+        raise UsageError("Expected NAME VALUE pairs (or --stdin)")
+
+    # The file is loaded, the new secrets are encrypted in one batch, and the file is written once
+    variables = set_variables(
+        load_variables(file_path, no_override=no_override, override_suffix=override_suffix),
+        assignments,
     )
+    assigned_variables = Variables((variables[cast(int, variables.index_by_name(name))] for name in dict.fromkeys(assignment.name for assignment in assignments)), variables.data_keys)
+    encrypted_variables = encrypt_variables(backend, assigned_variables, jobs=jobs)
+    for encrypted_variable in encrypted_variables:
+        variables.put(encrypted_variable)
+    # Along with the data key, if the secrets got a new one
+    variables.data_keys.update(encrypted_variables.data_keys)
 
-    # Encrypt if visibility is secret
-    final_var = variables.by_name(variable_name)
-    if final_var and final_var.visibility == VariableVisibility.SECRET:
-        # Encrypt just this variable
-        encrypted_var = encrypt_variable(backend, final_var)
-        # Replace in list
-        variables = Variables([encrypted_var if v.name == variable_name else v for v in variables])
-
-    # Write back to file
-    dump_variables(variables, file_path)
+    write_file_atomically(file_path, dump_variables(variables))
 
 
 @app.command()
@@ -256,6 +582,13 @@ def set(
 )
 @option("--override-suffix", "-s", "override_suffix", type=str, default="local")
 @option("--no-override", "no_override", is_flag=True, default=False)
+@option("--jobs", "-j", "jobs", type=IntRange(min=1), default=1, help="Number of concurrent backend calls")
+@option(
+    "--envelope/--no-envelope",
+    "envelope",
+    default=None,
+    help="Encrypt the secrets with a new data key of the file (by default, when the file already has one)",
+)
 @argument("file_path", type=Path, required=True)
 @pass_context
 def migrate(
@@ -265,19 +598,24 @@ def migrate(
     to_backend_config: dict[str, str],
     override_suffix: str,
     no_override: bool,
+    jobs: int,
+    envelope: bool | None,
 ) -> None:
     from_backend = cast(Backend, context.obj.backend)
 
-    factories = list_factories()
-    to_factory = next((f for f in factories if f.name == to_backend_name), None)
-    assert to_factory is not None, f"Destination backend '{to_backend_name}' not found. Available backends: {[f.name for f in factories]}"
+    to_factory = find_factory(to_backend_name)
+    assert to_factory is not None, f"Destination backend '{to_backend_name}' not found. Available backends: {list_factory_names()}"
     to_config = to_factory.parse_config(to_backend_config)
 
     variables = load_variables(file_path, no_override=no_override, override_suffix=override_suffix)
-    variables = decrypt_variables(from_backend, variables)
+    if envelope is None:
+        envelope = bool(variables.data_keys)
+    variables = decrypt_variables(from_backend, variables, jobs=jobs)
+    # They are wrapped by the source backend
+    variables.data_keys.clear()
 
     with to_factory.create_backend(to_config) as to_backend:
-        variables = encrypt_variables(to_backend, variables)
+        variables = encrypt_variables(to_backend, variables, jobs=jobs, envelope=envelope)
 
     dump_variables(variables, file_path)
 
@@ -294,4 +632,66 @@ def check(context: Context, file_path: Path, override_suffix: str, no_override:
     try:
         decrypt_variables(backend, variables, raise_when_not_encrypted=True)
     except VariableNotEncryptedError as e:
-        raise SystemExit(f"Check failed: {e}") from e
\ No newline at end of file
+        raise SystemExit(f"Check failed: {e}") from e
+
+
+@app.command()
+@option("--socket", "-a", "socket_path", type=Path, required=False, help="Path of the Unix socket to listen on")
+@option("--foreground", "-D", "foreground", is_flag=True, default=False, help="Stay in the foreground instead of detaching once listening")
+@pass_context
+def agent(context: Context, socket_path: Path | None, foreground: bool) -> None:
+    from .backends.agent import get_default_socket_path, create_server, format_environment
+
+    # The agent lives for long, so it does not keep every decrypted value in memory
+    backend = cast(Backend, context.obj.uncached_backend)
+    socket_path = socket_path or get_default_socket_path()
+    with create_server(backend, socket_path) as server:
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+        # Like ssh-agent, the agent detaches once it listens, so that its output can be evaluated by the
+        # shell with `eval "$( variables agent )"`, which waits for stdout to be closed
+        if foreground:
+            echo(format_environment(socket_path, os.getpid()))
+            sys.stdout.flush()
+        elif (pid := os.fork()) != 0:
+            echo(format_environment(socket_path, pid))
+            sys.stdout.flush()
+            # The child owns the socket and the backend from now on, so nothing is cleaned up here
+            os._exit(0)
+        else:
+            os.setsid()
+            null_fd = os.open(os.devnull, os.O_RDWR)
+            for fd in range(3):
+                os.dup2(null_fd, fd)
+            os.close(null_fd)
+
+        logger.info("Agent listening on {socket_path}", socket_path=socket_path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+
+@app.group()
+def cache() -> None:
+    pass
+
+
+@cache.command()
+@pass_obj
+def clear(obj: SimpleNamespace) -> None:
+    cache = cast(Cache, obj.cache)
+    entry_count = cache.clear()
+    echo(f"Removed {entry_count} entries from {cache.folder_path}")
+
+
+@cache.command()
+@pass_obj
+def stats(obj: SimpleNamespace) -> None:
+    cache_stats = cast(Cache, obj.cache).stats()
+    echo(f"folder: {cache_stats.folder_path}")
+    echo(f"entries: {cache_stats.entries}")
+    echo(f"expired_entries: {cache_stats.expired_entries}")
+    echo(f"size: {cache_stats.size}")
+    echo(f"max_size: {cache_stats.max_size}")
+    echo(f"ttl: {cache_stats.ttl:g}")
@@ -1,8 +1,10 @@
-from .age import Age, Config, parse_config, create_backend
+from .age import Age, AsyncAge, Config, parse_config, create_backend, create_async_backend
 
 __all__ = [
     "Age",
+    "AsyncAge",
     "Config",
     "parse_config",
     "create_backend",
+    "create_async_backend",
 ]
\ No newline at end of file
@@ -1,9 +1,9 @@
 from pathlib import Path
-from contextlib import contextmanager
-from subprocess import run
-from typing import Generator, TypeAlias
+from contextlib import contextmanager, asynccontextmanager, closing, ExitStack
+from subprocess import run, PIPE, CalledProcessError
+from asyncio import create_subprocess_exec, to_thread
+from typing import Generator, AsyncGenerator, TypeAlias, TYPE_CHECKING, cast
 from loguru import logger
-from textwrap import dedent
 import sys
 
 from ...files import create_temp_file
@@ -12,22 +12,44 @@ from .types import KeyPair, Passphrase
 from .key_pair import load_key_pair, find_key_pair
 from .passphrase import find_passphrase
 
+if TYPE_CHECKING:
+    # The session pulls the age format in, which only the passphrase mode needs
+    from .session import PassphraseSession
+
 
 
 Config: TypeAlias = KeyPair | Passphrase
 
 
+
+
 class Age():
 
     config: Config
+    passphrase_session: "PassphraseSession | None"
 
-    def __init__(self, config: Config) -> None:
+    def __init__(self, config: Config, passphrase_session: "PassphraseSession | None" = None) -> None:
         self.config = config
+        if passphrase_session is None and isinstance(passphrase := config, str):
+            from .session import PassphraseSession
+
+            passphrase_session = PassphraseSession(passphrase)
+        self.passphrase_session = passphrase_session
 
 
     def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        [encrypted_value] = self.encrypt_values([decrypted_value])
+        return encrypted_value
+
+
+    def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        [decrypted_value] = self.decrypt_values([encrypted_value])
+        return decrypted_value
+
+
+    def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
         if isinstance(key_pair := self.config, KeyPair):
-            logger.debug("Spawning age with key pair encryption... ")
+            logger.debug("Spawning age with key pair encryption for {count} values... ", count=len(decrypted_values))
             command = [
                 "age", 
                 "--encrypt", 
@@ -35,44 +57,23 @@ class Age():
                 "-o", "-",
                 "-"
             ]
-            process = run(command, input=decrypted_value, capture_output=True)
-            sys.stderr.buffer.write(process.stderr)
-            return process.stdout
+            encrypted_values: list[bytes] = []
+            for decrypted_value in decrypted_values:
+                process = run(command, input=decrypted_value, capture_output=True)
+                sys.stderr.buffer.write(process.stderr)
+                encrypted_values.append(process.stdout)
+            return encrypted_values
         
-        if isinstance(passphrase := self.config, str):
-            logger.debug("Spawning age (through expect) with passphrase encryption... ")
-            expect_script_content = dedent(r"""
-                set timeout -1
-                set log_user 0
-                set encrypted_file [lindex $argv 0]
-                set decrypted_file [lindex $argv 1]
-                set passphrase [lindex $argv 2]
-                spawn age --encrypt --passphrase -o "$encrypted_file" "$decrypted_file"
-                expect "Enter passphrase*"
-                send "$passphrase\r"
-                expect "Confirm passphrase*"
-                send "$passphrase\r"
-                expect eof  
-            """)
-            with create_temp_file(content=decrypted_value) as decrypted_value_file_path:
-                with create_temp_file() as encrypted_value_file_path:
-                    with create_temp_file(content=expect_script_content) as expect_script_file_path:
-                        command = [
-                            "expect",
-                            "-f", str(expect_script_file_path),
-                            str(encrypted_value_file_path),
-                            str(decrypted_value_file_path),
-                            passphrase,
-                        ]
-                        process = run(command, check=True)
-                        return encrypted_value_file_path.read_bytes()
+        if (passphrase_session := self.passphrase_session) is not None:
+            logger.debug("Encrypting {count} values with the passphrase of the session... ", count=len(decrypted_values))
+            return [passphrase_session.encrypt_value(decrypted_value) for decrypted_value in decrypted_values]
 
         raise Exception("Invalid key pair or passphrase.")
     
 
-    def decrypt_value(self, encrypted_value: bytes) -> bytes:
+    def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
         if isinstance(key_pair := self.config, KeyPair):
-            logger.debug("Spawning age with key pair decryption... ")
+            logger.debug("Spawning age with key pair decryption for {count} values... ", count=len(encrypted_values))
             private_key = key_pair.private_key
             with create_temp_file(content=private_key) as private_key_file_path:
                 command = [
@@ -82,41 +83,99 @@ class Age():
                     "-o", "-",
                     "-"
                 ]
-                process = run(command, input=encrypted_value, capture_output=True)
-                sys.stderr.buffer.write(process.stderr)
-                return process.stdout
+                decrypted_values: list[bytes] = []
+                for encrypted_value in encrypted_values:
+                    process = run(command, input=encrypted_value, capture_output=True)
+                    sys.stderr.buffer.write(process.stderr)
+                    decrypted_values.append(process.stdout)
+                return decrypted_values
             
-        if isinstance(passphrase := self.config, str):
-            logger.debug("Spawning age (through expect) with passphrase decryption... ")
-            expect_script_content = dedent(r"""
-                set timeout -1
-                set log_user 0
-                set encrypted_file [lindex $argv 0]
-                set decrypted_file [lindex $argv 1]
-                set passphrase [lindex $argv 2]
-                spawn age --decrypt -o "$decrypted_file" "$encrypted_file"
-                expect "Enter passphrase*"
-                send "$passphrase\r"
-                send "\004"
-                expect eof                            
-            """)
-
-            with create_temp_file(content=encrypted_value) as encrypted_value_file_path:
-                with create_temp_file() as decrypted_value_file_path:
-                    with create_temp_file(content=expect_script_content) as expect_script_file_path:
-                        command = [
-                            "expect",
-                            "-f", str(expect_script_file_path),
-                            str(encrypted_value_file_path),
-                            str(decrypted_value_file_path),
-                            passphrase,
-                        ]
-                        process = run(command, check=True)
-                        return decrypted_value_file_path.read_bytes()
+        if (passphrase_session := self.passphrase_session) is not None:
+            logger.debug("Decrypting {count} values with the passphrase of the session... ", count=len(encrypted_values))
+            return [passphrase_session.decrypt_value(encrypted_value) for encrypted_value in encrypted_values]
         
         raise Exception("Invalid key pair or passphrase.")
 
 
+    def close(self) -> None:
+        if (passphrase_session := self.passphrase_session) is not None:
+            passphrase_session.close()
+
+
+
+class AsyncAge():
+
+    config: Config
+    identity_file_path: Path | None
+    passphrase_session: "PassphraseSession | None"
+
+    def __init__(self, config: Config, identity_file_path: Path | None = None, passphrase_session: "PassphraseSession | None" = None) -> None:
+        self.config = config
+        self.identity_file_path = identity_file_path
+        if passphrase_session is None and isinstance(passphrase := config, str):
+            from .session import PassphraseSession
+
+            passphrase_session = PassphraseSession(passphrase)
+        self.passphrase_session = passphrase_session
+
+
+    async def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        if isinstance(key_pair := self.config, KeyPair):
+            logger.debug("Spawning age with key pair encryption... ")
+            return await _communicate(
+                [
+                    "age",
+                    "--encrypt",
+                    "--recipient", str(key_pair.public_key),
+                    "-o", "-",
+                    "-",
+                ],
+                decrypted_value,
+            )
+
+        if (passphrase_session := self.passphrase_session) is not None:
+            # Only the first call derives the key, so it does not matter much that it runs in a thread
+            return await to_thread(passphrase_session.encrypt_value, decrypted_value)
+
+        raise Exception("Invalid key pair or passphrase.")
+
+
+    async def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        if isinstance(self.config, KeyPair):
+            assert self.identity_file_path is not None, "The identity file should have been created with the backend."
+            logger.debug("Spawning age with key pair decryption... ")
+            return await _communicate(
+                [
+                    "age",
+                    "--decrypt",
+                    "--identity", str(self.identity_file_path),
+                    "-o", "-",
+                    "-",
+                ],
+                encrypted_value,
+            )
+
+        if (passphrase_session := self.passphrase_session) is not None:
+            return await to_thread(passphrase_session.decrypt_value, encrypted_value)
+
+        raise Exception("Invalid key pair or passphrase.")
+
+
+    def close(self) -> None:
+        if (passphrase_session := self.passphrase_session) is not None:
+            passphrase_session.close()
+
+
+
+async def _communicate(command: list[str], input: bytes) -> bytes:
+    process = await create_subprocess_exec(*command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    stdout, stderr = await process.communicate(input)
+    sys.stderr.buffer.write(stderr)
+    if process.returncode != 0:
+        raise CalledProcessError(cast(int, process.returncode), command, stdout, stderr)
+    return stdout
+
+
 def parse_config(obj: dict[str, str]) -> Config:
     key_pair: KeyPair | None = None
     if "key_pair" in obj:
@@ -140,4 +199,14 @@ def parse_config(obj: dict[str, str]) -> Config:
 
 @contextmanager
 def create_backend(config: Config) -> Generator[Age, None, None]:
-    yield Age(config)
\ No newline at end of file
+    # The passphrase session (if any) lives as long as the backend
+    with closing(Age(config)) as age:
+        yield age
+
+
+@asynccontextmanager
+async def create_async_backend(config: Config) -> AsyncGenerator[AsyncAge, None]:
+    with ExitStack() as exit_stack:
+        # The identity is written once for the whole lifetime of the backend
+        identity_file_path = exit_stack.enter_context(create_temp_file(content=config.private_key)) if isinstance(config, KeyPair) else None
+        yield exit_stack.enter_context(closing(AsyncAge(config, identity_file_path)))
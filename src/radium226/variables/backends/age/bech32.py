@@ -0,0 +1,77 @@
+from typing import Sequence
+
+
+
+CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+
+GENERATOR = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+
+
+
+class Bech32Error(Exception):
+    pass
+
+
+def _polymod(values: Sequence[int]) -> int:
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for index, generator in enumerate(GENERATOR):
+            if (top >> index) & 1:
+                checksum ^= generator
+    return checksum
+
+
+def _expand_hrp(hrp: str) -> list[int]:
+    return [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+
+
+def _convert_bits(data: Sequence[int], from_bits: int, to_bits: int, *, pad: bool) -> list[int]:
+    accumulator = 0
+    bits = 0
+    result: list[int] = []
+    max_value = (1 << to_bits) - 1
+    for value in data:
+        accumulator = (accumulator << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((accumulator >> bits) & max_value)
+
+    if pad:
+        if bits:
+            result.append((accumulator << (to_bits - bits)) & max_value)
+    elif bits >= from_bits or ((accumulator << (to_bits - bits)) & max_value):
+        raise Bech32Error("Invalid padding")
+
+    return result
+
+
+def encode(hrp: str, data: bytes) -> str:
+    words = _convert_bits(data, 8, 5, pad=True)
+    polymod = _polymod(_expand_hrp(hrp) + words + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - index)) & 31 for index in range(6)]
+    return hrp + "1" + "".join(CHARSET[word] for word in words + checksum)
+
+
+def decode(text: str) -> tuple[str, bytes]:
+    if text.lower() != text and text.upper() != text:
+        raise Bech32Error("Mixed case")
+
+    text = text.lower()
+    separator_index = text.rfind("1")
+    if separator_index < 1 or separator_index + 7 > len(text):
+        raise Bech32Error("Invalid separator position")
+
+    hrp = text[:separator_index]
+    try:
+        words = [CHARSET.index(char) for char in text[separator_index + 1:]]
+    except ValueError as e:
+        raise Bech32Error("Invalid character") from e
+
+    if _polymod(_expand_hrp(hrp) + words) != 1:
+        raise Bech32Error("Invalid checksum")
+
+    return hrp, bytes(_convert_bits(words[:-6], 5, 8, pad=False))
@@ -0,0 +1,368 @@
+from dataclasses import dataclass
+from base64 import b64encode, b64decode
+from typing import Callable
+import hashlib
+import hmac
+import os
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from cryptography.hazmat.primitives.hashes import SHA256
+from cryptography.exceptions import InvalidTag
+
+from . import bech32
+from .types import PrivateKey, PublicKey
+
+
+
+# See https://age-encryption.org/v1 for the specification of the format.
+
+VERSION_LINE = b"age-encryption.org/v1"
+
+
+ARMOR_BEGIN = b"-----BEGIN AGE ENCRYPTED FILE-----"
+
+
+ARMOR_END = b"-----END AGE ENCRYPTED FILE-----"
+
+
+FILE_KEY_SIZE = 16
+
+
+NONCE_SIZE = 16
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+TAG_SIZE = 16
+
+
+COLUMNS = 64
+
+
+X25519_LABEL = b"age-encryption.org/v1/X25519"
+
+
+SCRYPT_LABEL = b"age-encryption.org/v1/scrypt"
+
+
+SCRYPT_SALT_SIZE = 16
+
+
+# Same work factors as the age CLI: 2^18 when encrypting, at most 2^22 accepted when decrypting.
+SCRYPT_WORK_FACTOR = 18
+
+
+SCRYPT_MAX_WORK_FACTOR = 22
+
+
+PUBLIC_KEY_HRP = "age"
+
+
+PRIVATE_KEY_HRP = "age-secret-key-"
+
+
+
+class AgeError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Stanza:
+    type: str
+    args: list[str]
+    body: bytes
+
+
+@dataclass(frozen=True)
+class Header:
+    stanzas: list[Stanza]
+    # The header up to and including "---", which is what the MAC covers
+    content: bytes
+    mac: bytes
+
+
+Unwrap = Callable[[list[Stanza]], bytes]
+
+
+
+def _encode_base64(data: bytes) -> str:
+    return b64encode(data).decode("ascii").rstrip("=")
+
+
+def _decode_base64(text: str) -> bytes:
+    if text.endswith("=") or "\n" in text or "\r" in text:
+        raise AgeError("Invalid base64 encoding in header")
+
+    try:
+        data = b64decode(text + "=" * (-len(text) % 4), validate=True)
+    except ValueError as e:
+        raise AgeError("Invalid base64 encoding in header") from e
+
+    if _encode_base64(data) != text:
+        raise AgeError("Non canonical base64 encoding in header")
+
+    return data
+
+
+def _hkdf(ikm: bytes, salt: bytes, info: bytes) -> bytes:
+    return HKDF(algorithm=SHA256(), length=32, salt=salt, info=info).derive(ikm)
+
+
+def _header_mac(file_key: bytes, content: bytes) -> bytes:
+    return hmac.new(_hkdf(file_key, b"", b"header"), content, hashlib.sha256).digest()
+
+
+def _wrap(wrap_key: bytes, file_key: bytes) -> bytes:
+    return ChaCha20Poly1305(wrap_key).encrypt(b"\x00" * 12, file_key, None)
+
+
+def _unwrap(wrap_key: bytes, body: bytes) -> bytes | None:
+    if len(body) != FILE_KEY_SIZE + TAG_SIZE:
+        raise AgeError("Invalid stanza body size")
+
+    try:
+        return ChaCha20Poly1305(wrap_key).decrypt(b"\x00" * 12, body, None)
+    except InvalidTag:
+        return None
+
+
+def generate_file_key() -> bytes:
+    return os.urandom(FILE_KEY_SIZE)
+
+
+def parse_public_key(public_key: PublicKey) -> X25519PublicKey:
+    try:
+        hrp, data = bech32.decode(public_key)
+    except bech32.Bech32Error as e:
+        raise AgeError(f"Invalid age public key ({e})") from e
+    if hrp != PUBLIC_KEY_HRP or len(data) != 32:
+        raise AgeError("Invalid age public key")
+    return X25519PublicKey.from_public_bytes(data)
+
+
+def parse_private_key(private_key: PrivateKey) -> X25519PrivateKey:
+    try:
+        hrp, data = bech32.decode(private_key)
+    except bech32.Bech32Error as e:
+        raise AgeError(f"Invalid age private key ({e})") from e
+    if hrp != PRIVATE_KEY_HRP or len(data) != 32:
+        raise AgeError("Invalid age private key")
+    return X25519PrivateKey.from_private_bytes(data)
+
+
+def wrap_with_x25519(file_key: bytes, public_key: PublicKey) -> Stanza:
+    recipient = parse_public_key(public_key)
+    ephemeral_secret = X25519PrivateKey.generate()
+    ephemeral_share = ephemeral_secret.public_key().public_bytes_raw()
+    shared_secret = ephemeral_secret.exchange(recipient)
+    wrap_key = _hkdf(shared_secret, ephemeral_share + recipient.public_bytes_raw(), X25519_LABEL)
+    return Stanza(
+        type="X25519",
+        args=[_encode_base64(ephemeral_share)],
+        body=_wrap(wrap_key, file_key),
+    )
+
+
+def unwrap_with_x25519(stanzas: list[Stanza], private_key: PrivateKey) -> bytes:
+    identity = parse_private_key(private_key)
+    identity_public_key = identity.public_key().public_bytes_raw()
+    for stanza in stanzas:
+        if stanza.type != "X25519":
+            continue
+
+        if len(stanza.args) != 1:
+            raise AgeError("Invalid X25519 stanza")
+
+        ephemeral_share = _decode_base64(stanza.args[0])
+        if len(ephemeral_share) != 32:
+            raise AgeError("Invalid X25519 stanza")
+
+        try:
+            shared_secret = identity.exchange(X25519PublicKey.from_public_bytes(ephemeral_share))
+        except ValueError as e:
+            raise AgeError("Invalid X25519 share") from e
+
+        wrap_key = _hkdf(shared_secret, ephemeral_share + identity_public_key, X25519_LABEL)
+        if (file_key := _unwrap(wrap_key, stanza.body)) is not None:
+            return file_key
+
+    raise AgeError("No identity matched any of the recipients")
+
+
+def derive_scrypt_key(passphrase: str, salt: bytes, work_factor: int) -> bytes:
+    # Not hashlib.scrypt, which caps its memory at INT_MAX bytes when the work factors from 21 need more
+    try:
+        return Scrypt(salt=SCRYPT_LABEL + salt, length=32, n=1 << work_factor, r=8, p=1).derive(passphrase.encode("utf-8"))
+    except (ValueError, MemoryError) as e:
+        raise AgeError(f"Unable to derive the scrypt key with work factor {work_factor}") from e
+
+
+def generate_scrypt_salt() -> bytes:
+    return os.urandom(SCRYPT_SALT_SIZE)
+
+
+def wrap_with_scrypt_key(file_key: bytes, scrypt_key: bytes, salt: bytes, work_factor: int) -> Stanza:
+    return Stanza(
+        type="scrypt",
+        args=[_encode_base64(salt), str(work_factor)],
+        body=_wrap(scrypt_key, file_key),
+    )
+
+
+def wrap_with_scrypt(file_key: bytes, passphrase: str, work_factor: int = SCRYPT_WORK_FACTOR) -> Stanza:
+    salt = generate_scrypt_salt()
+    return wrap_with_scrypt_key(file_key, derive_scrypt_key(passphrase, salt, work_factor), salt, work_factor)
+
+
+def parse_scrypt_stanza(stanzas: list[Stanza], max_work_factor: int = SCRYPT_MAX_WORK_FACTOR) -> tuple[bytes, int, bytes]:
+    if not any(stanza.type == "scrypt" for stanza in stanzas):
+        raise AgeError("The file is not encrypted with a passphrase")
+
+    if len(stanzas) != 1:
+        raise AgeError("A scrypt stanza must be the only stanza of the header")
+
+    [stanza] = stanzas
+    if len(stanza.args) != 2 or not stanza.args[1].isdigit() or stanza.args[1].startswith("0"):
+        raise AgeError("Invalid scrypt stanza")
+
+    salt = _decode_base64(stanza.args[0])
+    work_factor = int(stanza.args[1])
+    if len(salt) != SCRYPT_SALT_SIZE:
+        raise AgeError("Invalid scrypt stanza")
+
+    if work_factor > max_work_factor:
+        raise AgeError(f"The scrypt work factor is too large ({work_factor} > {max_work_factor})")
+
+    return salt, work_factor, stanza.body
+
+
+def unwrap_with_scrypt_key(body: bytes, scrypt_key: bytes) -> bytes:
+    if (file_key := _unwrap(scrypt_key, body)) is None:
+        raise AgeError("Incorrect passphrase")
+    return file_key
+
+
+def unwrap_with_scrypt(stanzas: list[Stanza], passphrase: str) -> bytes:
+    salt, work_factor, body = parse_scrypt_stanza(stanzas)
+    return unwrap_with_scrypt_key(body, derive_scrypt_key(passphrase, salt, work_factor))
+
+
+def encode_header(stanzas: list[Stanza], file_key: bytes) -> bytes:
+    lines = [VERSION_LINE]
+    for stanza in stanzas:
+        lines.append(" ".join(["->", stanza.type, *stanza.args]).encode("ascii"))
+        body = _encode_base64(stanza.body)
+        # The last line of a body is always shorter than a full line, even if it means it is empty
+        lines.extend(body[index:index + COLUMNS].encode("ascii") for index in range(0, len(body) + 1, COLUMNS))
+    lines.append(b"---")
+    content = b"\n".join(lines)
+    return content + b" " + _encode_base64(_header_mac(file_key, content)).encode("ascii") + b"\n"
+
+
+def parse_header(encrypted_value: bytes) -> tuple[Header, bytes]:
+    if encrypted_value.startswith(ARMOR_BEGIN):
+        encrypted_value = _dearmor(encrypted_value)
+
+    offset = 0
+
+    def next_line() -> str:
+        nonlocal offset
+        if (end := encrypted_value.find(b"\n", offset)) < 0:
+            raise AgeError("Truncated header")
+        line = encrypted_value[offset:end]
+        offset = end + 1
+        try:
+            return line.decode("ascii")
+        except UnicodeDecodeError as e:
+            raise AgeError("Invalid character in header") from e
+
+    if next_line().encode("ascii") != VERSION_LINE:
+        raise AgeError("Unsupported age format version")
+
+    stanzas: list[Stanza] = []
+    line = next_line()
+    while line.startswith("-> "):
+        [stanza_type, *args] = line[len("-> "):].split(" ")
+        body = ""
+        while True:
+            body_line = next_line()
+            if len(body_line) > COLUMNS:
+                raise AgeError("Stanza body line is too long")
+            body += body_line
+            if len(body_line) < COLUMNS:
+                break
+        stanzas.append(Stanza(type=stanza_type, args=args, body=_decode_base64(body)))
+        line = next_line()
+
+    if not line.startswith("--- "):
+        raise AgeError("Invalid header")
+
+    content_end = offset - len(line) - 1 + len("---")
+    header = Header(
+        stanzas=stanzas,
+        content=encrypted_value[:content_end],
+        mac=_decode_base64(line[len("--- "):]),
+    )
+    return header, encrypted_value[offset:]
+
+
+def _dearmor(armored_value: bytes) -> bytes:
+    lines = armored_value.strip().splitlines()
+    if lines[0] != ARMOR_BEGIN or lines[-1] != ARMOR_END:
+        raise AgeError("Invalid armor")
+    try:
+        return b64decode(b"".join(lines[1:-1]), validate=True)
+    except ValueError as e:
+        raise AgeError("Invalid armor") from e
+
+
+def _chunk_nonce(counter: int, last: bool) -> bytes:
+    return counter.to_bytes(11, "big") + (b"\x01" if last else b"\x00")
+
+
+def encrypt_payload(file_key: bytes, decrypted_value: bytes) -> bytes:
+    nonce = os.urandom(NONCE_SIZE)
+    cipher = ChaCha20Poly1305(_hkdf(file_key, nonce, b"payload"))
+    chunks = [nonce]
+    chunk_count = max(1, -(-len(decrypted_value) // CHUNK_SIZE))
+    for counter in range(chunk_count):
+        chunk = decrypted_value[counter * CHUNK_SIZE:(counter + 1) * CHUNK_SIZE]
+        chunks.append(cipher.encrypt(_chunk_nonce(counter, counter == chunk_count - 1), chunk, None))
+    return b"".join(chunks)
+
+
+def decrypt_payload(file_key: bytes, payload: bytes) -> bytes:
+    if len(payload) < NONCE_SIZE + TAG_SIZE:
+        raise AgeError("Truncated payload")
+
+    nonce, payload = payload[:NONCE_SIZE], payload[NONCE_SIZE:]
+    cipher = ChaCha20Poly1305(_hkdf(file_key, nonce, b"payload"))
+    encrypted_chunk_size = CHUNK_SIZE + TAG_SIZE
+    chunk_count = max(1, -(-len(payload) // encrypted_chunk_size))
+    chunks: list[bytes] = []
+    for counter in range(chunk_count):
+        encrypted_chunk = payload[counter * encrypted_chunk_size:(counter + 1) * encrypted_chunk_size]
+        last = counter == chunk_count - 1
+        if len(encrypted_chunk) < TAG_SIZE or (last and counter > 0 and len(encrypted_chunk) == TAG_SIZE):
+            raise AgeError("Truncated payload")
+        try:
+            chunks.append(cipher.decrypt(_chunk_nonce(counter, last), encrypted_chunk, None))
+        except InvalidTag as e:
+            raise AgeError("Payload authentication failed") from e
+    return b"".join(chunks)
+
+
+def encrypt(decrypted_value: bytes, header: bytes, file_key: bytes) -> bytes:
+    return header + encrypt_payload(file_key, decrypted_value)
+
+
+def decrypt(encrypted_value: bytes, unwrap: Unwrap) -> bytes:
+    header, payload = parse_header(encrypted_value)
+    file_key = unwrap(header.stanzas)
+    if not hmac.compare_digest(_header_mac(file_key, header.content), header.mac):
+        raise AgeError("Header authentication failed")
+    return decrypt_payload(file_key, payload)
@@ -0,0 +1,90 @@
+from contextlib import contextmanager, closing
+from functools import partial
+from typing import Generator
+from loguru import logger
+
+from .age import Config, parse_config
+from .types import KeyPair
+from .session import PassphraseSession
+from .format import (
+    encrypt,
+    decrypt,
+    encode_header,
+    generate_file_key,
+    wrap_with_x25519,
+    unwrap_with_x25519,
+    Unwrap,
+)
+
+
+
+__all__ = [
+    "NativeAge",
+    "parse_config",
+    "create_backend",
+]
+
+
+
+class NativeAge():
+    """
+    Reads and writes the same ciphertexts as the age CLI, without spawning any process.
+    """
+
+    config: Config
+    passphrase_session: PassphraseSession | None
+
+    def __init__(self, config: Config, passphrase_session: PassphraseSession | None = None) -> None:
+        self.config = config
+        if passphrase_session is None and isinstance(passphrase := config, str):
+            passphrase_session = PassphraseSession(passphrase)
+        self.passphrase_session = passphrase_session
+
+
+    def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        [encrypted_value] = self.encrypt_values([decrypted_value])
+        return encrypted_value
+
+
+    def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        [decrypted_value] = self.decrypt_values([encrypted_value])
+        return decrypted_value
+
+
+    def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
+        logger.debug("Encrypting {count} values in-process... ", count=len(decrypted_values))
+        if (passphrase_session := self.passphrase_session) is not None:
+            return [passphrase_session.encrypt_value(decrypted_value) for decrypted_value in decrypted_values]
+
+        if not isinstance(key_pair := self.config, KeyPair):
+            raise Exception("Invalid key pair or passphrase.")
+
+        encrypted_values: list[bytes] = []
+        for decrypted_value in decrypted_values:
+            file_key = generate_file_key()
+            stanza = wrap_with_x25519(file_key, key_pair.public_key)
+            encrypted_values.append(encrypt(decrypted_value, encode_header([stanza], file_key), file_key))
+        return encrypted_values
+
+
+    def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
+        logger.debug("Decrypting {count} values in-process... ", count=len(encrypted_values))
+        if (passphrase_session := self.passphrase_session) is not None:
+            return [passphrase_session.decrypt_value(encrypted_value) for encrypted_value in encrypted_values]
+
+        if not isinstance(key_pair := self.config, KeyPair):
+            raise Exception("Invalid key pair or passphrase.")
+
+        unwrap: Unwrap = partial(unwrap_with_x25519, private_key=key_pair.private_key)
+        return [decrypt(encrypted_value, unwrap) for encrypted_value in encrypted_values]
+
+
+    def close(self) -> None:
+        if (passphrase_session := self.passphrase_session) is not None:
+            passphrase_session.close()
+
+
+@contextmanager
+def create_backend(config: Config) -> Generator[NativeAge, None, None]:
+    with closing(NativeAge(config)) as native_age:
+        yield native_age
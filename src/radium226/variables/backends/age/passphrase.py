@@ -13,7 +13,8 @@ def find_passphrase() -> Passphrase | None:
     folder_path = Path.cwd()
     while True:
         if (passphrase_file_path := folder_path / "variables.passphrase").exists():
-            return passphrase_file_path.read_text(encoding="utf-8")
+            # The trailing newline of the file is not part of the passphrase
+            return passphrase_file_path.read_text(encoding="utf-8").rstrip("\r\n")
         
         if ( folder_path / ".git" ).exists():
             logger.debug("Reached the git root folder without finding a 'variables.passphrase' file.")
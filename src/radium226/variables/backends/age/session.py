@@ -0,0 +1,90 @@
+from threading import Lock
+from loguru import logger
+
+from .types import Passphrase
+from .format import (
+    SCRYPT_WORK_FACTOR,
+    Stanza,
+    encrypt,
+    decrypt,
+    encode_header,
+    generate_file_key,
+    generate_scrypt_salt,
+    derive_scrypt_key,
+    wrap_with_scrypt_key,
+    parse_scrypt_stanza,
+    unwrap_with_scrypt_key,
+)
+
+
+
+class PassphraseSession():
+    """
+    Runs scrypt once per salt for the whole lifetime of a backend instead of once per value.
+
+    All the values encrypted during the session share the same file key and header (so the same
+    salt), and as each of them gets its own random payload nonce, and so its own payload key,
+    every ciphertext is still a regular file for `age --decrypt`.
+
+    Unlike `age -p`, which draws a file key per file, the file key is not drawn again for each value:
+    the scrypt stanza wraps it with a fixed zero nonce, so wrapping another file key with the same
+    derived key would reuse that nonce (and a stanza with a nonce of its own is not readable by age).
+    The values encrypted during one session can then be told apart from the other ones by their header.
+    """
+
+    passphrase: Passphrase
+    work_factor: int
+
+    def __init__(self, passphrase: Passphrase, work_factor: int = SCRYPT_WORK_FACTOR) -> None:
+        self.passphrase = passphrase
+        self.work_factor = work_factor
+        self._lock = Lock()
+        self._scrypt_key_locks: dict[tuple[bytes, int], Lock] = {}
+        self._scrypt_keys: dict[tuple[bytes, int], bytes] = {}
+        self._file_key_lock = Lock()
+        self._file_key_and_header: tuple[bytes, bytes] | None = None
+
+
+    def _scrypt_key(self, salt: bytes, work_factor: int) -> bytes:
+        # Concurrent jobs wait for the derivation of the same salt instead of running it again
+        with self._lock:
+            key_lock = self._scrypt_key_locks.setdefault((salt, work_factor), Lock())
+
+        with key_lock:
+            if (scrypt_key := self._scrypt_keys.get((salt, work_factor))) is None:
+                logger.debug("Deriving the key from the passphrase (work factor: {work_factor})... ", work_factor=work_factor)
+                scrypt_key = derive_scrypt_key(self.passphrase, salt, work_factor)
+                self._scrypt_keys[(salt, work_factor)] = scrypt_key
+            return scrypt_key
+
+
+    def _unwrap(self, stanzas: list[Stanza]) -> bytes:
+        salt, work_factor, body = parse_scrypt_stanza(stanzas)
+        return unwrap_with_scrypt_key(body, self._scrypt_key(salt, work_factor))
+
+
+    def _get_file_key_and_header(self) -> tuple[bytes, bytes]:
+        with self._file_key_lock:
+            if (file_key_and_header := self._file_key_and_header) is None:
+                salt = generate_scrypt_salt()
+                file_key = generate_file_key()
+                stanza = wrap_with_scrypt_key(file_key, self._scrypt_key(salt, self.work_factor), salt, self.work_factor)
+                file_key_and_header = (file_key, encode_header([stanza], file_key))
+                self._file_key_and_header = file_key_and_header
+            return file_key_and_header
+
+
+    def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        file_key, header = self._get_file_key_and_header()
+        return encrypt(decrypted_value, header, file_key)
+
+
+    def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        return decrypt(encrypted_value, self._unwrap)
+
+
+    def close(self) -> None:
+        with self._lock, self._file_key_lock:
+            self._scrypt_key_locks.clear()
+            self._scrypt_keys.clear()
+            self._file_key_and_header = None
@@ -0,0 +1,203 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from base64 import b64encode, b64decode
+from pathlib import Path
+from socketserver import ThreadingUnixStreamServer, StreamRequestHandler
+from threading import Lock
+from typing import Generator, Any, cast
+from loguru import logger
+import socket
+import json
+import os
+import shlex
+
+from ..spi import Backend, encrypt_values, decrypt_values
+from ..files import get_runtime_folder_path
+
+
+
+# Like SSH_AUTH_SOCK for ssh-agent
+SOCKET_ENV_VAR = "VARIABLES_AGENT_SOCKET"
+
+
+# Like SSH_AGENT_PID, so that the agent can be stopped with `kill $VARIABLES_AGENT_PID`
+PID_ENV_VAR = "VARIABLES_AGENT_PID"
+
+
+
+@dataclass(frozen=True)
+class Config():
+    socket_path: Path
+
+
+
+def get_default_socket_path() -> Path:
+    return get_runtime_folder_path() / "agent.sock"
+
+
+def parse_config(obj: dict[str, str]) -> Config:
+    if "socket" in obj:
+        return Config(socket_path=Path(obj["socket"]))
+
+    if (socket_path_str := os.getenv(SOCKET_ENV_VAR)) is not None:
+        return Config(socket_path=Path(socket_path_str))
+
+    return Config(socket_path=get_default_socket_path())
+
+
+def format_environment(socket_path: Path, pid: int) -> str:
+    # Like the output of ssh-agent, to be evaluated by the shell
+    return f"{SOCKET_ENV_VAR}={shlex.quote(str(socket_path))}; export {SOCKET_ENV_VAR};\n{PID_ENV_VAR}={pid}; export {PID_ENV_VAR};"
+
+
+def _encode_values(values: list[bytes]) -> list[str]:
+    return [b64encode(value).decode("ascii") for value in values]
+
+
+def _decode_values(values: list[str]) -> list[bytes]:
+    return [b64decode(value) for value in values]
+
+
+
+class Agent():
+    """
+    Forwards the values to a `variables agent` through its Unix socket, in one request per batch.
+
+    The protocol is one JSON object per line: {"operation": "encrypt" | "decrypt", "values": [...]},
+    answered by {"values": [...]} or {"error": "..."}, the values being encoded in base64.
+    """
+
+    config: Config
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self._lock = Lock()
+        self._socket: socket.socket | None = None
+        self._file: Any = None
+
+    def _request(self, operation: str, values: list[bytes]) -> list[bytes]:
+        request = json.dumps({"operation": operation, "values": _encode_values(values)}) + "\n"
+        # The connection is opened once and kept for the lifetime of the backend
+        with self._lock:
+            if self._socket is None:
+                logger.debug("Connecting to the agent listening on {socket_path}... ", socket_path=self.config.socket_path)
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    self._socket.connect(str(self.config.socket_path))
+                except OSError as e:
+                    self._socket.close()
+                    self._socket = None
+                    raise Exception(f"No agent is listening on {self.config.socket_path} (start one with `variables agent`)") from e
+                self._file = self._socket.makefile("rwb")
+
+            self._file.write(request.encode("utf-8"))
+            self._file.flush()
+            if not (line := self._file.readline()):
+                raise Exception("The agent closed the connection")
+
+        response = cast(dict[str, Any], json.loads(line))
+        if (error := response.get("error")) is not None:
+            raise Exception(f"The agent failed to {operation} the values: {error}")
+        return _decode_values(response["values"])
+
+    def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        [encrypted_value] = self.encrypt_values([decrypted_value])
+        return encrypted_value
+
+    def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        [decrypted_value] = self.decrypt_values([encrypted_value])
+        return decrypted_value
+
+    def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
+        return self._request("encrypt", decrypted_values)
+
+    def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
+        return self._request("decrypt", encrypted_values)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+
+
+@contextmanager
+def create_backend(config: Config) -> Generator[Agent, None, None]:
+    agent = Agent(config)
+    try:
+        yield agent
+    finally:
+        agent.close()
+
+
+
+class AgentRequestHandler(StreamRequestHandler):
+
+    server: "AgentServer"
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = cast(dict[str, Any], json.loads(line))
+                values = _decode_values(request["values"])
+                match request["operation"]:
+                    case "encrypt":
+                        response: dict[str, Any] = {"values": _encode_values(encrypt_values(self.server.backend, values))}
+                    case "decrypt":
+                        response = {"values": _encode_values(decrypt_values(self.server.backend, values))}
+                    case operation:
+                        raise Exception(f"Unknown operation: {operation!r}")
+            except Exception as e:
+                logger.warning("Failed to handle a request: {error}", error=e)
+                response = {"error": str(e)}
+
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+
+class AgentServer(ThreadingUnixStreamServer):
+
+    daemon_threads = True
+
+    backend: Backend
+    socket_path: Path
+
+    def __init__(self, backend: Backend, socket_path: Path) -> None:
+        self.backend = backend
+        self.socket_path = socket_path
+        super().__init__(str(socket_path), AgentRequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.socket_path.unlink(missing_ok=True)
+
+
+
+def _is_listening(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        try:
+            client_socket.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def create_server(backend: Backend, socket_path: Path) -> AgentServer:
+    socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if socket_path.exists():
+        if _is_listening(socket_path):
+            raise Exception(f"An agent is already listening on {socket_path}")
+        logger.debug("Removing the stale socket {socket_path}", socket_path=socket_path)
+        socket_path.unlink()
+
+    # Only the current user can connect, whatever the folder is
+    umask = os.umask(0o177)
+    try:
+        return AgentServer(backend, socket_path)
+    finally:
+        os.umask(umask)
@@ -1,6 +1,8 @@
 from contextlib import contextmanager
+from dataclasses import dataclass
 from typing import Generator
 
+@dataclass(frozen=True)
 class Config():
     pass
 
@@ -17,6 +19,12 @@ class Dummy():
     def decrypt_value(self, encrypted_value: bytes) -> bytes:
         return encrypted_value
 
+    def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
+        return [self.encrypt_value(decrypted_value) for decrypted_value in decrypted_values]
+
+    def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
+        return [self.decrypt_value(encrypted_value) for encrypted_value in encrypted_values]
+
 
 @contextmanager
 def create_backend(config: Config) -> Generator[Dummy, None, None]:
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from base64 import b64encode, b64decode
+from pathlib import Path
+from subprocess import run, CalledProcessError
+from typing import Generator, Any, cast
+from loguru import logger
+import json
+import sys
+
+
+
+# The options of sops which tell which keys the data key is encrypted with, by the name they have in
+# the config of the backend (when none is given, sops uses the creation rules of its config file)
+KEY_OPTIONS = {
+    "age": "--age",
+    "pgp": "--pgp",
+    "kms": "--kms",
+    "gcp_kms": "--gcp-kms",
+    "azure_kv": "--azure-kv",
+    "hc_vault_transit": "--hc-vault-transit",
+}
+
+
+# Where the values are in the documents handed to sops (which authenticates each of them with its path)
+VALUES_KEY = "values"
+
+
+METADATA_KEY = "sops"
+
+
+
+@dataclass(frozen=True)
+class Config():
+    executable: str = "sops"
+    config_file_path: Path | None = None
+    # The path that the documents are handed to sops as (they are read from the standard input), which
+    # the `path_regex` of the creation rules are matched against
+    file_name: str | None = None
+    keys: dict[str, str] = field(default_factory=dict)
+
+
+
+def parse_config(obj: dict[str, str]) -> Config:
+    return Config(
+        executable=obj.get("executable", "sops"),
+        config_file_path=Path(obj["config"]) if "config" in obj else None,
+        file_name=obj.get("filename"),
+        keys={name: obj[name] for name in KEY_OPTIONS if name in obj},
+    )
+
+
+
+class Sops():
+    """
+    Hands all the values of a batch to a single `sops` process, as the leaves of one JSON document.
+
+    Each encrypted value is then a document of its own, with its leaf and the metadata of the batch
+    (the data key, wrapped with the keys of sops). The values which share their metadata are decrypted
+    together, by a single `sops` process as well, which cannot check the MAC of the whole document
+    (it only has some of its values) but still checks the tag of each value.
+    """
+
+    config: Config
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+
+    def _run(self, arguments: list[str], document: dict[str, Any]) -> dict[str, Any]:
+        command = [
+            self.config.executable,
+            *(["--config", str(config_file_path)] if (config_file_path := self.config.config_file_path) is not None else []),
+            *(["--filename-override", file_name] if (file_name := self.config.file_name) is not None else []),
+            *arguments,
+            "--input-type", "json",
+            "--output-type", "json",
+            "/dev/stdin",
+        ]
+        process = run(command, input=json.dumps(document).encode("utf-8"), capture_output=True)
+        sys.stderr.buffer.write(process.stderr)
+        if process.returncode != 0:
+            raise CalledProcessError(process.returncode, command, process.stdout, process.stderr)
+        return cast(dict[str, Any], json.loads(process.stdout))
+
+    def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        [encrypted_value] = self.encrypt_values([decrypted_value])
+        return encrypted_value
+
+    def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        [decrypted_value] = self.decrypt_values([encrypted_value])
+        return decrypted_value
+
+    def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
+        if not decrypted_values:
+            return []
+
+        logger.debug("Spawning sops to encrypt {count} values... ", count=len(decrypted_values))
+        # The values are encoded in base64, as sops only takes text (and the data keys of the envelope
+        # encryption are not)
+        document = self._run(
+            ["--encrypt", *(argument for name, key in self.config.keys.items() for argument in [KEY_OPTIONS[name], key])],
+            {VALUES_KEY: {str(index): b64encode(decrypted_value).decode("ascii") for index, decrypted_value in enumerate(decrypted_values)}},
+        )
+
+        metadata = document[METADATA_KEY]
+        return [
+            json.dumps({METADATA_KEY: metadata, VALUES_KEY: {str(index): document[VALUES_KEY][str(index)]}}, sort_keys=True, separators=(",", ":")).encode("utf-8")
+            for index in range(len(decrypted_values))
+        ]
+
+    def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
+        if not encrypted_values:
+            return []
+
+        # The values by the metadata they were encrypted with, and where each of them lands
+        values_by_metadata: dict[str, dict[str, str]] = {}
+        positions: list[tuple[str, str]] = []
+        for encrypted_value in encrypted_values:
+            document = json.loads(encrypted_value)
+            metadata = json.dumps(document[METADATA_KEY], sort_keys=True, separators=(",", ":"))
+            [(key, value)] = document[VALUES_KEY].items()
+            if values_by_metadata.setdefault(metadata, {}).setdefault(key, value) != value:
+                raise Exception("Two values encrypted together by sops cannot have the same key")
+            positions.append((metadata, key))
+
+        logger.debug("Spawning sops {process_count} times to decrypt {count} values... ", process_count=len(values_by_metadata), count=len(encrypted_values))
+        decrypted_values_by_metadata = {
+            metadata: self._run(["--decrypt", "--ignore-mac"], {METADATA_KEY: json.loads(metadata), VALUES_KEY: values})[VALUES_KEY]
+            for metadata, values in values_by_metadata.items()
+        }
+        return [b64decode(decrypted_values_by_metadata[metadata][key]) for metadata, key in positions]
+
+
+
+@contextmanager
+def create_backend(config: Config) -> Generator[Sops, None, None]:
+    yield Sops(config)
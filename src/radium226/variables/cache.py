@@ -0,0 +1,254 @@
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Any
+from loguru import logger
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+from .spi import Backend, encrypt_values, decrypt_values
+from .files import get_runtime_folder_path, ensure_private_folder, read_or_create_key
+
+
+
+# How long a decrypted value stays in the cache, in seconds
+DEFAULT_TTL = 15 * 60
+
+
+# How large the cache folder can grow, in bytes, before the least recently used entries are evicted
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+
+
+SESSION_KEY_FILE_NAME = "session.key"
+
+
+SESSION_KEY_SIZE = 32
+
+
+NONCE_SIZE = 12
+
+
+# The creation time of the entry, which is authenticated along with its name
+ENTRY_HEADER = struct.Struct(">d")
+
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    folder_path: Path
+    entries: int
+    expired_entries: int
+    size: int
+    ttl: float
+    max_size: int
+
+
+
+class Cache():
+    """
+    Stores decrypted values on disk, encrypted with a random session key which lives next to them.
+
+    The entries are named after an HMAC of the identity of the backend and of the ciphertext, so
+    neither the ciphertexts nor the identities can be recovered from the names. The modification time
+    of an entry is bumped every time it is read, which is what the LRU eviction relies on.
+    """
+
+    folder_path: Path
+    ttl: float
+    max_size: int
+
+    def __init__(self, folder_path: Path | None = None, *, ttl: float = DEFAULT_TTL, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.folder_path = folder_path or get_runtime_folder_path()
+        self.ttl = ttl
+        self.max_size = max_size
+        self._session_key: bytes | None = None
+
+    @property
+    def entries_folder_path(self) -> Path:
+        return self.folder_path / "entries"
+
+    def _ensure_folder(self) -> None:
+        ensure_private_folder(self.folder_path)
+        self.entries_folder_path.mkdir(mode=0o700, exist_ok=True)
+
+    def _get_session_key(self) -> bytes:
+        if (session_key := self._session_key) is not None:
+            return session_key
+
+        self._ensure_folder()
+        session_key = read_or_create_key(self.folder_path / SESSION_KEY_FILE_NAME, SESSION_KEY_SIZE)
+        if len(session_key) != SESSION_KEY_SIZE:
+            raise Exception("The session key of the cache is corrupted (try `variables cache clear`)")
+
+        self._session_key = session_key
+        return session_key
+
+    def _entry_name(self, identity: bytes, encrypted_value: bytes) -> str:
+        message = struct.pack(">I", len(identity)) + identity + encrypted_value
+        return hmac.new(self._get_session_key(), message, hashlib.sha256).hexdigest()
+
+    def get(self, identity: bytes, encrypted_value: bytes) -> bytes | None:
+        # Imported here, as most runs go without the cache
+        from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+        from cryptography.exceptions import InvalidTag
+
+        name = self._entry_name(identity, encrypted_value)
+        entry_file_path = self.entries_folder_path / name
+        try:
+            content = entry_file_path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        if len(content) < ENTRY_HEADER.size + NONCE_SIZE:
+            entry_file_path.unlink(missing_ok=True)
+            return None
+
+        header, nonce, encrypted_entry = content[:ENTRY_HEADER.size], content[ENTRY_HEADER.size:ENTRY_HEADER.size + NONCE_SIZE], content[ENTRY_HEADER.size + NONCE_SIZE:]
+        [created_at] = ENTRY_HEADER.unpack(header)
+        if time.time() - created_at > self.ttl:
+            entry_file_path.unlink(missing_ok=True)
+            return None
+
+        try:
+            decrypted_value = ChaCha20Poly1305(self._get_session_key()).decrypt(nonce, encrypted_entry, name.encode("ascii") + header)
+        except InvalidTag:
+            logger.warning("Dropping the corrupted cache entry {name}", name=name)
+            entry_file_path.unlink(missing_ok=True)
+            return None
+
+        os.utime(entry_file_path)
+        return decrypted_value
+
+    def put(self, identity: bytes, encrypted_value: bytes, decrypted_value: bytes) -> None:
+        from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+
+        name = self._entry_name(identity, encrypted_value)
+        header = ENTRY_HEADER.pack(time.time())
+        nonce = os.urandom(NONCE_SIZE)
+        encrypted_entry = ChaCha20Poly1305(self._get_session_key()).encrypt(nonce, decrypted_value, name.encode("ascii") + header)
+
+        # Written aside then renamed, so that a concurrent run never reads a partial entry
+        temp_entry_file_path = self.entries_folder_path / f".{name}.{os.getpid()}"
+        fd = os.open(temp_entry_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as temp_entry_file:
+            temp_entry_file.write(header + nonce + encrypted_entry)
+        os.replace(temp_entry_file_path, self.entries_folder_path / name)
+
+    def _list_entries(self) -> list[tuple[Path, os.stat_result]]:
+        if not self.entries_folder_path.is_dir():
+            return []
+
+        entries: list[tuple[Path, os.stat_result]] = []
+        for entry_file_path in self.entries_folder_path.iterdir():
+            if entry_file_path.name.startswith("."):
+                continue
+            try:
+                entries.append((entry_file_path, entry_file_path.stat()))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def evict(self) -> int:
+        now = time.time()
+        entries = sorted(self._list_entries(), key=lambda entry: entry[1].st_mtime)
+        size = sum(entry_stat.st_size for _, entry_stat in entries)
+        evicted_count = 0
+        for entry_file_path, entry_stat in entries:
+            # An entry which has not been read for longer than the TTL is expired anyway
+            if size <= self.max_size and now - entry_stat.st_mtime <= self.ttl:
+                continue
+            entry_file_path.unlink(missing_ok=True)
+            size -= entry_stat.st_size
+            evicted_count += 1
+
+        if evicted_count:
+            logger.debug("Evicted {count} entries from the cache", count=evicted_count)
+        return evicted_count
+
+    def clear(self) -> int:
+        entries = self._list_entries()
+        for entry_file_path, _ in entries:
+            entry_file_path.unlink(missing_ok=True)
+        # A new session key makes sure nothing written before can be read again
+        (self.folder_path / SESSION_KEY_FILE_NAME).unlink(missing_ok=True)
+        self._session_key = None
+        return len(entries)
+
+    def stats(self) -> CacheStats:
+        now = time.time()
+        entries = self._list_entries()
+        return CacheStats(
+            folder_path=self.folder_path,
+            entries=len(entries),
+            expired_entries=sum(1 for _, entry_stat in entries if now - entry_stat.st_mtime > self.ttl),
+            size=sum(entry_stat.st_size for _, entry_stat in entries),
+            ttl=self.ttl,
+            max_size=self.max_size,
+        )
+
+
+
+def create_identity(backend_name: str, config: Any) -> bytes:
+    # The config holds the keys (or passphrase), so values decrypted with another key never match
+    return hashlib.sha256(f"{backend_name}\0{config!r}".encode("utf-8")).digest()
+
+
+
+class CachingBackend():
+    """
+    Wraps a backend so that each distinct ciphertext is decrypted only once per process and, when a
+    cache is given, only once per TTL across processes.
+    """
+
+    backend: Backend
+    identity: bytes
+    cache: Cache | None
+
+    def __init__(self, backend: Backend, identity: bytes, cache: Cache | None = None) -> None:
+        self.backend = backend
+        self.identity = identity
+        self.cache = cache
+        self._lock = Lock()
+        self._decrypted_values: dict[bytes, bytes] = {}
+
+    def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        [encrypted_value] = self.encrypt_values([decrypted_value])
+        return encrypted_value
+
+    def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        [decrypted_value] = self.decrypt_values([encrypted_value])
+        return decrypted_value
+
+    def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
+        encrypted_values = encrypt_values(self.backend, decrypted_values)
+        with self._lock:
+            self._decrypted_values.update(zip(encrypted_values, decrypted_values))
+        return encrypted_values
+
+    def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
+        with self._lock:
+            decrypted_values = {encrypted_value: decrypted_value for encrypted_value in encrypted_values if (decrypted_value := self._decrypted_values.get(encrypted_value)) is not None}
+
+        if (cache := self.cache) is not None:
+            for encrypted_value in encrypted_values:
+                if encrypted_value not in decrypted_values and (decrypted_value := cache.get(self.identity, encrypted_value)) is not None:
+                    decrypted_values[encrypted_value] = decrypted_value
+
+        # Each distinct ciphertext is only handed once to the backend
+        missing_encrypted_values = list(dict.fromkeys(encrypted_value for encrypted_value in encrypted_values if encrypted_value not in decrypted_values))
+        logger.debug("{hit_count} values found in the cache, {miss_count} to decrypt", hit_count=len(encrypted_values) - len(missing_encrypted_values), miss_count=len(missing_encrypted_values))
+        if missing_encrypted_values:
+            missing_decrypted_values = decrypt_values(self.backend, missing_encrypted_values)
+            decrypted_values.update(zip(missing_encrypted_values, missing_decrypted_values))
+            if cache is not None:
+                for encrypted_value, decrypted_value in zip(missing_encrypted_values, missing_decrypted_values):
+                    cache.put(self.identity, encrypted_value, decrypted_value)
+                cache.evict()
+
+        with self._lock:
+            self._decrypted_values.update(decrypted_values)
+
+        return [decrypted_values[encrypted_value] for encrypted_value in encrypted_values]
@@ -2,7 +2,7 @@ from click import ParamType, Context, Parameter
 from typing import Any
 from pathlib import Path
 
-from .types import OptionalPrefixAndFilePath, KeyValue
+from .types import OptionalPrefixAndFilePath, KeyValue, ExportSpec, ExportTarget
 
 
 class OptionalPrefixAndFilePathParamType(ParamType):
@@ -59,6 +59,37 @@ class KeyValueParamType(ParamType):
 KEY_VALUE = KeyValueParamType()
 
 
+
+class ExportSpecParamType(ParamType):
+    name = "export_spec"
+
+    def convert(self, value: Any, param: Parameter | None, ctx: Context | None) -> ExportSpec:
+        # TARGET[,KEY=VALUE...][:FILE_PATH]
+        try:
+            assert isinstance(value, str), f"Expected a string value, got {type(value).__name__}"
+            target_and_config_str, _, file_path_str = value.partition(":")
+            target_str, *key_value_strs = target_and_config_str.split(",")
+            config: dict[str, str] = {}
+            for key_value_str in key_value_strs:
+                key_value = KEY_VALUE.convert(key_value_str, param, ctx)
+                config[key_value.key] = key_value.value
+
+            return ExportSpec(
+                target=ExportTarget(target_str.strip()),
+                config=config,
+                file_path=Path(file_path_str.strip()) if file_path_str.strip() not in {"", "-"} else None,
+            )
+        except Exception as e:
+            self.fail(
+                f"{e}",
+                param,
+                ctx,
+            )
+
+
+EXPORT_SPEC = ExportSpecParamType()
+
+
 def to_dict(ctx: Context, param: Parameter, value: Any) -> dict[str, str]:
     result: dict[str, str] = {}
     if value is None:
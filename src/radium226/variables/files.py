@@ -1,7 +1,10 @@
 from contextlib import contextmanager
-from typing import Generator
-from tempfile import mkstemp
+from typing import Generator, TextIO
+from tempfile import mkstemp, gettempdir
 from pathlib import Path
+import fcntl
+import os
+import stat
 
 
 
@@ -17,4 +20,108 @@ def create_temp_file(content: str | bytes | None = None) -> Generator[Path, None
     try:
         yield temp_file_path
     finally:
-        temp_file_path.unlink(missing_ok=True)
\ No newline at end of file
+        temp_file_path.unlink(missing_ok=True)
+
+
+def is_memory_file_supported() -> bool:
+    return hasattr(os, "memfd_create")
+
+
+@contextmanager
+def create_memory_file(content: str | bytes, name: str = "variables") -> Generator[int, None, None]:
+    """
+    Write the content into an anonymous file which only lives in memory, and give its fd.
+
+    The file is sealed, so that none of the processes it is handed to can change it, and it goes
+    away with the last fd on it. Its content can be read from /dev/fd/<fd> (see get_memory_file_path()).
+    """
+    fd = os.memfd_create(name, os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+    try:
+        view = memoryview(content if isinstance(content, bytes) else content.encode("utf-8"))
+        while view:
+            view = view[os.write(fd, view):]
+        fcntl.fcntl(fd, fcntl.F_ADD_SEALS, fcntl.F_SEAL_SEAL | fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_GROW | fcntl.F_SEAL_WRITE)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def get_memory_file_path(fd: int) -> Path:
+    # Opening it gives a new file description, so each reader starts from the beginning
+    return Path(f"/dev/fd/{fd}")
+
+
+def get_runtime_folder_path() -> Path:
+    # Where the files of the current user which should stay in memory (tmpfs) live
+    if (runtime_folder_path_str := os.getenv("XDG_RUNTIME_DIR")) is not None:
+        return Path(runtime_folder_path_str) / "radium226-variables"
+
+    shm_folder_path = Path("/dev/shm")
+    base_folder_path = shm_folder_path if shm_folder_path.is_dir() else Path(gettempdir())
+    return base_folder_path / f"radium226-variables-{os.getuid()}"
+
+
+def ensure_private_folder(folder_path: Path) -> None:
+    folder_path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    folder_stat = folder_path.stat()
+    if folder_stat.st_uid != os.getuid() or stat.S_IMODE(folder_stat.st_mode) & 0o077:
+        raise Exception(f"The folder {folder_path} should only be accessible by the current user")
+
+
+def read_or_create_key(key_file_path: Path, key_size: int) -> bytes:
+    try:
+        return key_file_path.read_bytes()
+    except FileNotFoundError:
+        pass
+
+    # The key is written aside and only then linked in place, which fails when another run got there
+    # first, so that concurrent runs all end up with the same key, and never see it half written
+    key = os.urandom(key_size)
+    fd, temp_file_path_str = mkstemp(dir=key_file_path.parent, prefix=f".{key_file_path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(key)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        try:
+            os.link(temp_file_path_str, key_file_path)
+        except FileExistsError:
+            return key_file_path.read_bytes()
+        return key
+    finally:
+        os.unlink(temp_file_path_str)
+
+
+@contextmanager
+def open_file_atomically(file_path: Path) -> Generator[TextIO, None, None]:
+    """
+    Give a file which is written aside and renamed over the file once everything went well, so that the
+    file is never seen half written (and is left as it was otherwise). The file keeps its permissions.
+    """
+    try:
+        mode: int | None = stat.S_IMODE(file_path.stat().st_mode)
+    except FileNotFoundError:
+        mode = None
+
+    temp_file_path = file_path.with_name(f".{file_path.name}.{os.getpid()}")
+    fd = os.open(temp_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 if mode is not None else 0o666)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as temp_file:
+            yield temp_file
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        if mode is not None:
+            os.chmod(temp_file_path, mode)
+        os.replace(temp_file_path, file_path)
+    except BaseException:
+        temp_file_path.unlink(missing_ok=True)
+        raise
+
+
+def write_file_atomically(file_path: Path, content: str) -> None:
+    """
+    Write the content aside and rename it over the file, so that the file is never seen half written.
+    The file keeps its permissions.
+    """
+    with open_file_atomically(file_path) as file:
+        file.write(content)
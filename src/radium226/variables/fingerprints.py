@@ -0,0 +1,112 @@
+from pathlib import Path
+from loguru import logger
+from typing import cast
+import hashlib
+import hmac
+import json
+import os
+import struct
+
+from .types import Variable, VariableName, VariableValue
+from .files import get_runtime_folder_path, ensure_private_folder, read_or_create_key
+
+
+
+FINGERPRINT_KEY_FILE_NAME = "fingerprints.key"
+
+
+FINGERPRINT_KEY_SIZE = 32
+
+
+
+class Fingerprints():
+    """
+    Remembers, for each secret of a variables file, a keyed HMAC of its plaintext next to its ciphertext.
+
+    When the plaintext of a secret is the same as the last time it was decrypted or encrypted, the
+    same ciphertext can be written back instead of a fresh one. The fingerprints live in the runtime
+    folder (like the cache), and the key of the HMACs never leaves it, so they cannot be used to guess
+    the plaintexts.
+    """
+
+    folder_path: Path
+    file_path: Path
+    identity: bytes
+
+    def __init__(self, file_path: Path, identity: bytes, folder_path: Path | None = None) -> None:
+        self.folder_path = folder_path or get_runtime_folder_path()
+        self.file_path = file_path
+        self.identity = identity
+        self._key: bytes | None = None
+        self._entries: dict[VariableName, list[str]] | None = None
+
+    @property
+    def entries_file_path(self) -> Path:
+        # One file per variables file, named so that its path cannot be read from it
+        name = hashlib.sha256(str(self.file_path.resolve()).encode("utf-8")).hexdigest()
+        return self.folder_path / "fingerprints" / f"{name}.json"
+
+    def _get_key(self) -> bytes:
+        if (key := self._key) is not None:
+            return key
+
+        ensure_private_folder(self.folder_path)
+        key = read_or_create_key(self.folder_path / FINGERPRINT_KEY_FILE_NAME, FINGERPRINT_KEY_SIZE)
+        if len(key) != FINGERPRINT_KEY_SIZE:
+            raise Exception(f"The key of the fingerprints is corrupted (remove {self.folder_path / FINGERPRINT_KEY_FILE_NAME})")
+
+        self._key = key
+        return key
+
+    def _get_entries(self) -> dict[VariableName, list[str]]:
+        if (entries := self._entries) is not None:
+            return entries
+
+        try:
+            entries = cast(dict[VariableName, list[str]], json.loads(self.entries_file_path.read_text(encoding="utf-8")))
+        except FileNotFoundError:
+            entries = {}
+        except ValueError:
+            logger.warning("Dropping the corrupted fingerprints of {file_path}", file_path=self.file_path)
+            entries = {}
+
+        self._entries = entries
+        return entries
+
+    def _fingerprint(self, variable: Variable) -> str:
+        # The backend is part of it, so that a ciphertext is never reused with another key
+        message = b"".join(
+            struct.pack(">I", len(part)) + part
+            for part in [self.identity, variable.name.encode("utf-8"), variable.value.encode("utf-8")]
+        )
+        return hmac.new(self._get_key(), message, hashlib.sha256).hexdigest()
+
+    def find_encrypted_value(self, variable: Variable) -> VariableValue | None:
+        """
+        Give the ciphertext last seen with the plaintext of the variable, if it did not change since.
+        """
+        if (entry := self._get_entries().get(variable.name)) is None:
+            return None
+
+        [fingerprint, encrypted_value] = entry
+        if not hmac.compare_digest(fingerprint, self._fingerprint(variable)):
+            return None
+
+        return encrypted_value
+
+    def add(self, variable: Variable, encrypted_value: VariableValue) -> None:
+        self._get_entries()[variable.name] = [self._fingerprint(variable), encrypted_value]
+
+    def save(self) -> None:
+        if (entries := self._entries) is None:
+            return
+
+        ensure_private_folder(self.folder_path)
+        entries_file_path = self.entries_file_path
+        entries_file_path.parent.mkdir(mode=0o700, exist_ok=True)
+        # Written aside then renamed, like the entries of the cache
+        temp_entries_file_path = entries_file_path.with_name(f".{entries_file_path.name}.{os.getpid()}")
+        fd = os.open(temp_entries_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as temp_entries_file:
+            json.dump(entries, temp_entries_file)
+        os.replace(temp_entries_file_path, entries_file_path)
@@ -1,13 +1,32 @@
-from typing import Protocol, Callable, ContextManager, Any, cast, TypeAlias, TypeVar, Generic
-from importlib.metadata import entry_points, EntryPoint
+from typing import Protocol, Callable, ContextManager, AsyncContextManager, Any, cast, TypeAlias, TypeVar, Generic, runtime_checkable, TYPE_CHECKING
 from importlib import import_module
 from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from loguru import logger
+import json
+import os
+import sys
+
+from .tracing import span
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
 
 
 
 ENTRY_POINT_GROUP = "radium226.variables.backend"
 
 
+# Where the names and modules of the backends are kept, so that the entry points are only scanned
+# again when the installed distributions change
+REGISTRY_FILE_NAME = "backends.json"
+
+
+# The metadata folders of the distributions, which declare their entry points
+METADATA_FOLDER_SUFFIXES = (".dist-info", ".egg-info")
+
+
 class Config(Protocol):
     pass
 
@@ -18,6 +37,8 @@ ParseConfig: TypeAlias = Callable[[dict[str, str]], T]
 
 CreateBackend: TypeAlias = Callable[[T], ContextManager['Backend']]
 
+CreateAsyncBackend: TypeAlias = Callable[[T], AsyncContextManager['AsyncBackend']]
+
 Name: TypeAlias = str
 
 @dataclass
@@ -26,6 +47,8 @@ class Factory(Generic[T]):
     name: Name
     parse_config: Callable[[dict[str, str]], T]
     create_backend: Callable[[T], ContextManager['Backend']]
+    # Only for the backends which have a native async implementation
+    create_async_backend: Callable[[T], AsyncContextManager['AsyncBackend']] | None = None
 
 
 class Backend(Protocol):
@@ -37,19 +60,170 @@ class Backend(Protocol):
         ...
 
 
-def _create_factory(entry_point: EntryPoint) -> Factory[Any]:
-    module_name = entry_point.value
+@runtime_checkable
+class BatchBackend(Backend, Protocol):
+
+    def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
+        ...
+
+    def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
+        ...
+
+
+class AsyncBackend(Protocol):
+
+    async def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        ...
+
+    async def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        ...
+
+
+def _encrypt_values(backend: Backend, decrypted_values: list[bytes]) -> list[bytes]:
+    with span("encrypt_values", backend=type(backend).__name__, count=len(decrypted_values), bytes_in=sum(map(len, decrypted_values))) as args:
+        if isinstance(backend, BatchBackend):
+            encrypted_values = backend.encrypt_values(decrypted_values)
+        else:
+            encrypted_values = [backend.encrypt_value(decrypted_value) for decrypted_value in decrypted_values]
+        args["bytes_out"] = sum(map(len, encrypted_values))
+        return encrypted_values
+
+
+def _decrypt_values(backend: Backend, encrypted_values: list[bytes]) -> list[bytes]:
+    with span("decrypt_values", backend=type(backend).__name__, count=len(encrypted_values), bytes_in=sum(map(len, encrypted_values))) as args:
+        if isinstance(backend, BatchBackend):
+            decrypted_values = backend.decrypt_values(encrypted_values)
+        else:
+            decrypted_values = [backend.decrypt_value(encrypted_value) for encrypted_value in encrypted_values]
+        args["bytes_out"] = sum(map(len, decrypted_values))
+        return decrypted_values
+
+
+def _map_in_chunks(function: Callable[[list[bytes]], list[bytes]], values: list[bytes], *, jobs: int, executor: "Executor | None" = None) -> list[bytes]:
+    if not values:
+        return []
+
+    if (jobs <= 1 or len(values) == 1) and executor is None:
+        return function(values)
+
+    # One contiguous chunk per job keeps the batches as large as possible, and map() gives
+    # the results (and raises the first error) in the order of the values
+    chunk_size = -(-len(values) // jobs)
+    chunks = [values[index:index + chunk_size] for index in range(0, len(values), chunk_size)]
+    if executor is not None:
+        return [value for chunk in executor.map(function, chunks) for value in chunk]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=len(chunks), thread_name_prefix="variables") as executor:
+        return [value for chunk in executor.map(function, chunks) for value in chunk]
+
+
+def encrypt_values(backend: Backend, decrypted_values: list[bytes], *, jobs: int = 1, executor: "Executor | None" = None) -> list[bytes]:
+    """
+    Encrypt all the values in one call when the backend supports it, one by one otherwise.
+
+    With jobs > 1, the values are split in as many chunks which are encrypted concurrently. With an
+    executor, the chunks are run by its workers, so that they bound the calls shared with other threads.
+    """
+    return _map_in_chunks(partial(_encrypt_values, backend), decrypted_values, jobs=jobs, executor=executor)
+
+
+def decrypt_values(backend: Backend, encrypted_values: list[bytes], *, jobs: int = 1, executor: "Executor | None" = None) -> list[bytes]:
+    """
+    Decrypt all the values in one call when the backend supports it, one by one otherwise.
+
+    With jobs > 1, the values are split in as many chunks which are decrypted concurrently. With an
+    executor, the chunks are run by its workers, so that they bound the calls shared with other threads.
+    """
+    return _map_in_chunks(partial(_decrypt_values, backend), encrypted_values, jobs=jobs, executor=executor)
+
+
+def _create_factory(factory_name: Name, module_name: str) -> Factory[Any]:
     module = import_module(module_name)
     parse_config = cast(ParseConfig[Any], getattr(module, "parse_config"))
     create_backend = cast(CreateBackend[Any], getattr(module, "create_backend"))
+    create_async_backend = cast(CreateAsyncBackend[Any] | None, getattr(module, "create_async_backend", None))
 
-    factory_name = entry_point.name
     return Factory(
         name=factory_name,
         parse_config=parse_config,
         create_backend=create_backend,
+        create_async_backend=create_async_backend,
     )
 
 
+def _get_registry_file_path() -> Path:
+    cache_folder_path = Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache")
+    return cache_folder_path / "radium226-variables" / REGISTRY_FILE_NAME
+
+
+def _compute_fingerprint() -> list[list[Any]]:
+    # Installing or removing a distribution adds or removes its metadata folder next to the
+    # others, which changes the modification time of the folder of the path. Only the folders
+    # with such metadata are taken, so that the changes to the current (or the script) folder
+    # do not count
+    fingerprint: list[list[Any]] = []
+    for path_str in sys.path:
+        try:
+            with os.scandir(path_str or ".") as entries:
+                if any(entry.name.endswith(METADATA_FOLDER_SUFFIXES) for entry in entries):
+                    fingerprint.append([path_str, os.stat(path_str or ".").st_mtime_ns])
+        except OSError:
+            pass
+    return fingerprint
+
+
+def _scan_entry_points() -> dict[Name, str]:
+    from importlib.metadata import entry_points
+
+    return {entry_point.name: entry_point.value for entry_point in entry_points(group=ENTRY_POINT_GROUP)}
+
+
+def _load_registry(*, refresh: bool = False) -> dict[Name, str]:
+    registry_file_path = _get_registry_file_path()
+    fingerprint = _compute_fingerprint()
+    if not refresh:
+        try:
+            registry = json.loads(registry_file_path.read_text(encoding="utf-8"))
+            if registry["fingerprint"] == fingerprint:
+                return cast(dict[Name, str], registry["backends"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    logger.debug("Scanning the entry points for the backends... ")
+    backends = _scan_entry_points()
+    try:
+        registry_file_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_registry_file_path = registry_file_path.with_name(f".{registry_file_path.name}.{os.getpid()}")
+        temp_registry_file_path.write_text(json.dumps({"fingerprint": fingerprint, "backends": backends}), encoding="utf-8")
+        temp_registry_file_path.replace(registry_file_path)
+    except OSError as e:
+        logger.debug("Unable to write the registry of the backends: {error}", error=e)
+    return backends
+
+
+def list_factory_names() -> list[Name]:
+    return list(_load_registry())
+
+
+def find_factory(name: Name) -> Factory[Any] | None:
+    """
+    Import only the module of the backend named `name`, if any.
+    """
+    for refresh in [False, True]:
+        if (module_name := _load_registry(refresh=refresh).get(name)) is None:
+            continue
+
+        try:
+            return _create_factory(name, module_name)
+        except ModuleNotFoundError:
+            # The registry may refer to a module which has been removed in the meantime
+            if refresh:
+                raise
+
+    return None
+
+
 def list_factories() -> list[Factory[Any]]:
-    return [_create_factory(ep) for ep in entry_points(group=ENTRY_POINT_GROUP)]
\ No newline at end of file
+    return [_create_factory(name, module_name) for name, module_name in _scan_entry_points().items()]
@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock, current_thread, get_ident
+from typing import Any, Generator
+import json
+import os
+import sys
+import time
+
+
+
+# The name of the events of the audit hooks which mean a process is spawned (not os.posix_spawn,
+# which subprocess.Popen may use as well)
+SUBPROCESS_AUDIT_EVENTS = {"subprocess.Popen", "os.exec"}
+
+
+# How many functions (by cumulative time) and allocation sites (by size) the profile shows
+PROFILE_LIMIT = 25
+
+
+
+class Tracer():
+    """
+    Collects the spans of a run, as the complete events ("ph": "X") of the Chrome trace event format,
+    which chrome://tracing and Perfetto can open.
+
+    The number of processes spawned during a span comes from an audit hook, so it also counts the
+    ones spawned by other threads in the meantime.
+    """
+
+    events: list[dict[str, Any]]
+    subprocess_count: int
+
+    def __init__(self) -> None:
+        self.events = []
+        self.subprocess_count = 0
+        self._lock = Lock()
+        self._thread_names: dict[int, str] = {}
+
+    def add_span(self, name: str, started_at_ns: int, ended_at_ns: int, args: dict[str, Any]) -> None:
+        thread_id = get_ident()
+        event = {
+            "name": name,
+            "cat": "variables",
+            "ph": "X",
+            "ts": started_at_ns / 1000,
+            "dur": (ended_at_ns - started_at_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": thread_id,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+            self._thread_names.setdefault(thread_id, current_thread().name)
+
+    def dump(self, file_path: Path, other_data: dict[str, Any] | None = None) -> None:
+        with self._lock:
+            thread_name_events = [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id, "args": {"name": thread_name}}
+                for thread_id, thread_name in self._thread_names.items()
+            ]
+            trace = {
+                "traceEvents": [*thread_name_events, *self.events],
+                "displayTimeUnit": "ms",
+                "otherData": other_data or {},
+            }
+        file_path.write_text(json.dumps(trace, default=str), encoding="utf-8")
+
+
+
+_tracer: Tracer | None = None
+
+
+_audit_hook_added = False
+
+
+def _count_subprocesses(event: str, args: tuple[Any, ...]) -> None:
+    if (tracer := _tracer) is not None and event in SUBPROCESS_AUDIT_EVENTS:
+        tracer.subprocess_count += 1
+
+
+def set_tracer(tracer: Tracer | None) -> None:
+    global _tracer, _audit_hook_added
+
+    # Audit hooks cannot be removed, so there is only one, which does nothing without a tracer
+    if tracer is not None and not _audit_hook_added:
+        sys.addaudithook(_count_subprocesses)
+        _audit_hook_added = True
+    _tracer = tracer
+
+
+@contextmanager
+def span(name: str, **args: Any) -> Generator[dict[str, Any], None, None]:
+    """
+    Record the time spent in the block, with the args (which the block can add to) and the number of
+    processes spawned meanwhile. Does nothing but yield the args without a tracer.
+    """
+    if (tracer := _tracer) is None:
+        yield args
+        return
+
+    subprocess_count = tracer.subprocess_count
+    started_at_ns = time.perf_counter_ns()
+    try:
+        yield args
+    finally:
+        args["subprocesses"] = tracer.subprocess_count - subprocess_count
+        tracer.add_span(name, started_at_ns, time.perf_counter_ns(), args)
+
+
+@contextmanager
+def profiling(*, limit: int = PROFILE_LIMIT) -> Generator[dict[str, Any], None, None]:
+    """
+    Run the block under cProfile and tracemalloc, and fill the yielded dict with the summaries (which are
+    also printed to stderr) once it is done.
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+    from io import StringIO
+
+    summaries: dict[str, Any] = {}
+    profile = cProfile.Profile()
+    tracemalloc.start()
+    profile.enable()
+    try:
+        yield summaries
+    finally:
+        profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_size = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stream = StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        summaries["cpu"] = stream.getvalue()
+        summaries["peak_memory"] = peak_size
+        summaries["memory"] = [str(statistic) for statistic in snapshot.statistics("lineno")[:limit]]
+
+        print(summaries["cpu"], file=sys.stderr)
+        print(f"Peak memory: {peak_size} bytes", *summaries["memory"], sep="\n", file=sys.stderr)
@@ -1,5 +1,5 @@
-from dataclasses import dataclass, replace
-from typing import TypeAlias
+from dataclasses import dataclass
+from typing import Any, Iterable, Self, SupportsIndex, TypeAlias
 from enum import StrEnum, auto
 from pathlib import Path
 
@@ -17,6 +17,10 @@ VariablePrefix: TypeAlias = str
 
 
 
+DataKeyId: TypeAlias = str
+
+
+
 class VariableVisibility(StrEnum):
     PLAIN = auto()
     SECRET = auto()
@@ -29,7 +33,7 @@ class VariableType(StrEnum):
 
 
 
-@dataclass(frozen=True, eq=True)
+@dataclass(frozen=True, eq=True, slots=True)
 class Variable():
     name: VariableName
     value: VariableValue
@@ -37,39 +41,144 @@ class Variable():
     prefix: VariablePrefix | None = None
     type: VariableType = VariableType.TEXT
 
+    # Calling the constructor directly is much cheaper than dataclasses.replace()
+
     def with_value(self, value: VariableValue) -> "Variable":
-        return replace(self, value=value)
+        return Variable(self.name, value, self.visibility, self.prefix, self.type)
     
     def with_prefix(self, prefix: VariablePrefix) -> "Variable":
-        return replace(self, prefix=prefix)
+        return Variable(self.name, self.value, self.visibility, prefix, self.type)
     
     def without_prefix(self) -> "Variable":
-        return replace(self, prefix=None)
+        return Variable(self.name, self.value, self.visibility, None, self.type)
+
+    @property
+    def prefixed_name(self) -> VariableName:
+        return self.name if self.prefix is None else f"{self.prefix}_{self.name}"
 
 
 
 class Variables(list[Variable]):
-    
+    """
+    A list of variables which also finds them by name in constant time.
+
+    The index (from the name to the position of the first variable with that name) is built on the
+    first lookup, and dropped by any change to the list but append() and put(), which keep it up to date.
+
+    The data keys (by their ID, as wrapped by the backend) are the ones the envelope encrypted values
+    refer to. They come along when the variables are copied from other variables.
+    """
+
+    __slots__ = ("_index", "data_keys")
+
+    _index: dict[VariableName, int] | None
+    data_keys: dict[DataKeyId, bytes]
+
+    def __init__(self, variables: Iterable[Variable] = (), data_keys: dict[DataKeyId, bytes] | None = None) -> None:
+        super().__init__(variables)
+        self._index = None
+        # Copied once the variables have been consumed, as they may be the ones which fill the data keys
+        self.data_keys = dict(data_keys if data_keys is not None else variables.data_keys if isinstance(variables, Variables) else {})
+
+    def _get_index(self) -> dict[VariableName, int]:
+        if (index := self._index) is None:
+            index = {}
+            for position, variable in enumerate(self):
+                index.setdefault(variable.name, position)
+            self._index = index
+        return index
+
+    def _drop_index(self) -> None:
+        self._index = None
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # The copies (and the pickles) build their own index
+        return (Variables, (list(self), self.data_keys))
+
     def with_prefix(self, prefix: VariablePrefix) -> "Variables":
-        return Variables([variable.with_prefix(prefix) for variable in self])
+        return Variables([variable.with_prefix(prefix) for variable in self], self.data_keys)
     
     def without_prefix(self) -> "Variables":
-        return Variables([variable.without_prefix() for variable in self])
+        return Variables([variable.without_prefix() for variable in self], self.data_keys)
     
     def to_dict(self) -> dict[VariableName, VariableValue]:
+        return {variable.prefixed_name: variable.value for variable in self}
 
-        def variable_name(variable: Variable) -> VariableName:
-            if variable.prefix is not None:
-                return f"{variable.prefix}_{variable.name}"
-            return variable.name
+    def names(self) -> set[VariableName]:
+        return set(self._get_index())
 
-        return {variable_name(variable): variable.value for variable in self}
+    def index_by_name(self, name: VariableName) -> int | None:
+        return self._get_index().get(name)
     
     def by_name(self, name: VariableName) -> Variable | None:
-        for variable in self:
-            if variable.name == name:
-                return variable
-        return None
+        if (position := self.index_by_name(name)) is None:
+            return None
+        return self[position]
+
+    def put(self, variable: Variable) -> None:
+        """
+        Replace the (first) variable with the same name, or append it if there is none.
+        """
+        if (position := self.index_by_name(variable.name)) is None:
+            self.append(variable)
+        else:
+            super().__setitem__(position, variable)
+
+    def with_variable(self, variable: Variable) -> "Variables":
+        variables = Variables(self)
+        variables.put(variable)
+        return variables
+
+    def append(self, variable: Variable) -> None:
+        if (index := self._index) is not None:
+            index.setdefault(variable.name, len(self))
+        super().append(variable)
+
+    # Anything else which changes the list drops the index
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._drop_index()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: Any) -> None:
+        self._drop_index()
+        super().__delitem__(key)
+
+    def __iadd__(self, variables: Iterable[Variable]) -> Self:  # type: ignore[override, misc]
+        self._drop_index()
+        return super().__iadd__(variables)
+
+    def __imul__(self, count: SupportsIndex) -> Self:
+        self._drop_index()
+        return super().__imul__(count)
+
+    def extend(self, variables: Iterable[Variable]) -> None:
+        self._drop_index()
+        super().extend(variables)
+
+    def insert(self, position: SupportsIndex, variable: Variable) -> None:
+        self._drop_index()
+        super().insert(position, variable)
+
+    def pop(self, position: SupportsIndex = -1) -> Variable:
+        self._drop_index()
+        return super().pop(position)
+
+    def remove(self, variable: Variable) -> None:
+        self._drop_index()
+        super().remove(variable)
+
+    def clear(self) -> None:
+        self._drop_index()
+        super().clear()
+
+    def sort(self, *args: Any, **kwargs: Any) -> None:
+        self._drop_index()
+        super().sort(*args, **kwargs)
+
+    def reverse(self) -> None:
+        self._drop_index()
+        super().reverse()
 
 
 OptionalPrefixAndFilePath = tuple[VariablePrefix | None, Path]
@@ -81,19 +190,75 @@ Argument: TypeAlias = str
 Command: TypeAlias = list[Argument]
 
 
+class FileStorage(StrEnum):
+    DISK = auto()
+    MEMORY = auto()
+
+
 class ExportTarget(StrEnum):
     BASH = auto()
     ENV_FILE = auto()
     KUBECTL = auto()
 
 
+class BashExportMode(StrEnum):
+    # Each value is decoded by `base64`, and each file is created by `mktemp`
+    BASE64 = auto()
+    # The values are quoted, and the files are written by shell builtins in one `mktemp -d` folder
+    BUILTINS = auto()
+
+
+class EnvFileQuoting(StrEnum):
+    # The values as they are, which is what `docker run --env-file` reads (it does not unquote anything)
+    DOCKER = auto()
+    # The values quoted and escaped when they need it, like the dotenv parsers expect
+    DOTENV = auto()
+
+
+class KubectlExportFormat(StrEnum):
+    # One YAML document per manifest
+    YAML = auto()
+    # A single List of all the manifests
+    JSON = auto()
+
+
 @dataclass(frozen=True, eq=True)
 class KeyValue():
     key: str
     value: str
 
 
+@dataclass(frozen=True, eq=True)
+class VariableAssignment():
+    name: VariableName
+    value: VariableValue
+    # Those of the variable if it exists, the defaults otherwise
+    visibility: VariableVisibility | None = None
+    type: VariableType | None = None
+
+
+class AssignmentFormat(StrEnum):
+    # NAME=VALUE lines
+    ENV = auto()
+    # {"name": ..., "value": ..., "visibility": ..., "type": ...} lines
+    JSONL = auto()
+
+
+@dataclass(frozen=True, eq=True)
+class ExportSpec():
+    target: ExportTarget
+    config: dict[str, str]
+    # Where to write, stdout if None
+    file_path: Path | None = None
+
+
 class VariableNotEncryptedError(Exception):
     def __init__(self, variable_name: VariableName) -> None:
         self.variable_name = variable_name
-        super().__init__(f"Variable {variable_name!r} is not encrypted")
\ No newline at end of file
+        super().__init__(f"Variable {variable_name!r} is not encrypted")
+
+
+class VariablesNotStreamableError(ValueError):
+    def __init__(self, file_path: Path) -> None:
+        self.file_path = file_path
+        super().__init__(f"The variables of {file_path} cannot be streamed (use load_variables() instead)")
\ No newline at end of file
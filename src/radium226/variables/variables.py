@@ -1,35 +1,155 @@
-from typing import overload, Generator, Any
+from typing import overload, Callable, Generator, Iterator, Iterable, Any, NoReturn, TextIO, TYPE_CHECKING
 from pathlib import Path
 import yaml
-from subprocess import run, CompletedProcess
+from yaml.events import (
+    Event,
+    ScalarEvent,
+    MappingStartEvent,
+    MappingEndEvent,
+    SequenceStartEvent,
+    SequenceEndEvent,
+    CollectionStartEvent,
+    CollectionEndEvent,
+    DocumentStartEvent,
+    DocumentEndEvent,
+    StreamStartEvent,
+    StreamEndEvent,
+)
+from yaml.nodes import ScalarNode, SequenceNode, MappingNode
+from yaml.resolver import Resolver
+from yaml.constructor import SafeConstructor
+from yaml.representer import SafeRepresenter
+from subprocess import run, CompletedProcess, Popen, DEVNULL, TimeoutExpired
 from base64 import b64encode, b64decode
 from loguru import logger
 from os import environ
+from dataclasses import dataclass, field
 from contextlib import ExitStack
 from io import StringIO
-from jinja2 import Environment
-from jinja2.meta import find_undeclared_variables
 from textwrap import dedent
+from itertools import islice
+from functools import lru_cache
+import hashlib
+import json
+import os
+import re
+import signal
+import sys
 
 from .types import (
     Variable,
     Variables,
     VariableVisibility,
     Command,
+    Argument,
     VariableType,
     ExportTarget,
+    BashExportMode,
+    EnvFileQuoting,
+    KubectlExportFormat,
+    VariableAssignment,
+    AssignmentFormat,
     VariableNotEncryptedError,
+    VariablesNotStreamableError,
+    FileStorage,
 )
 
-from .files import create_temp_file
-from .types import VariableName, VariableValue
-from .spi import Backend
+from .files import create_temp_file, create_memory_file, get_memory_file_path, is_memory_file_supported
+from .types import VariableName, VariableValue, DataKeyId
+from .spi import Backend, encrypt_values, decrypt_values
+from .tracing import span
+from .watch import FileWatcher
+
+if TYPE_CHECKING:
+    from jinja2 import Environment, Template
+
+    from concurrent.futures import Executor
+
+    from .fingerprints import Fingerprints
 
 
 
 ENCRYPTION_PREFIX = "encrypted:"
 
 
+# The values encrypted in-process under a data key of the file (whose ID comes next), instead of by
+# the backend. The base64 alphabet has no colon, so they cannot be mistaken for the other ones
+ENVELOPE_ENCRYPTION_PREFIX = ENCRYPTION_PREFIX + "envelope:"
+
+
+# The data keys are ChaCha20-Poly1305 keys, identified by a hash of their wrapped form
+DATA_KEY_SIZE = 32
+DATA_KEY_ID_SIZE = 8
+ENVELOPE_NONCE_SIZE = 12
+
+
+# The libyaml based loader and dumper are much faster, when PyYAML has been built with it
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+STR_TAG = "tag:yaml.org,2002:str"
+
+
+SEQ_TAG = "tag:yaml.org,2002:seq"
+
+
+MAP_TAG = "tag:yaml.org,2002:map"
+
+
+LIBYAML_SAFE_STR_PATTERN = re.compile(r"[\x20-\x7e]*")
+
+
+# What `docker run --env-file` cannot read in a value, as it has one variable per line
+ENV_FILE_LINE_BREAK_PATTERN = re.compile(r"[\n\r]")
+
+
+# The values which can be written as they are in an env file, and the characters which cannot be
+# single-quoted (dotenv unescapes \\ and \' in single quotes, and only double quotes have \n)
+ENV_FILE_BARE_VALUE_PATTERN = re.compile(r"[A-Za-z0-9_./:@%+,=-]*")
+ENV_FILE_SINGLE_QUOTE_UNSAFE_PATTERN = re.compile(r"['\\\n\r]")
+ENV_FILE_DOUBLE_QUOTE_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r"})
+
+
+# The values which bash reads as they are, and the characters which cannot be single-quoted
+BASH_BARE_VALUE_PATTERN = re.compile(r"[A-Za-z0-9_./:@%+,=-]+")
+BASH_CONTROL_CHAR_PATTERN = re.compile(r"[\x00-\x1f\x7f]")
+BASH_ANSI_C_ESCAPES = str.maketrans({
+    "\\": "\\\\",
+    "'": "\\'",
+    "\n": "\\n",
+    "\t": "\\t",
+    "\r": "\\r",
+    **{chr(code): f"\\x{code:02x}" for code in [*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20), 0x7f]},
+})
+
+
+# Where the file variables are written when the bash export is sourced in the builtins mode
+BASH_FILES_FOLDER_VARIABLE_NAME = "__variables_files_folder_path"
+
+
+# Kubernetes (etcd, actually) rejects the objects larger than 1 MiB, so the data of a ConfigMap or a
+# Secret is kept below that, with some room for the rest of the manifest
+KUBERNETES_MAX_OBJECT_SIZE = 1024 * 1024
+DEFAULT_MANIFEST_MAX_DATA_SIZE = KUBERNETES_MAX_OBJECT_SIZE - 64 * 1024
+
+
+# How often watch_and_execute_with_variables() checks if the command is still running, and how long
+# it waits for the command to stop before it kills it
+WATCH_INTERVAL = 0.5
+STOP_TIMEOUT = 10.0
+
+
+# How many variables iter_decrypted_variables() hands to the backend at once
+DEFAULT_BATCH_SIZE = 64
+
+
+# In the order of yaml.dump(), which sorts the keys
+VARIABLE_KEYS = ("name", "type", "value", "visibility")
+
+
 
 def merge_variables(base: Variables, override: Variables | None) -> Variables:
     """
@@ -43,7 +163,7 @@ def merge_variables(base: Variables, override: Variables | None) -> Variables:
         return base
 
     result: list[Variable] = []
-    override_names = {v.name for v in override}
+    override_names = override.names()
 
     # Keep base variables that are not overridden
     for variable in base:
@@ -53,7 +173,141 @@ def merge_variables(base: Variables, override: Variables | None) -> Variables:
     # Add all override variables
     result.extend(override)
 
-    return Variables(result)
+    return Variables(result, {**base.data_keys, **override.data_keys})
+
+
+class _UnexpectedEvent(Exception):
+    pass
+
+
+_resolver = Resolver()
+
+
+_constructor = SafeConstructor()
+
+
+_representer = SafeRepresenter(default_flow_style=False)
+
+
+def _parse_str(event: Event) -> str:
+    if not isinstance(event, ScalarEvent):
+        raise _UnexpectedEvent(event)
+
+    # Same resolution as the composer: only plain scalars can be something else than a string
+    if event.tag in (None, "!"):
+        if event.implicit[0] and _resolver.resolve(ScalarNode, event.value, (True, False)) != STR_TAG:
+            raise _UnexpectedEvent(event)
+        return event.value
+
+    if event.tag != STR_TAG:
+        raise _UnexpectedEvent(event)
+    return event.value
+
+
+def _skip_value(event: Event, events: Iterator[Event]) -> None:
+    depth = 1 if isinstance(event, CollectionStartEvent) else 0
+    while depth > 0:
+        event = next(events)
+        if isinstance(event, CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, CollectionEndEvent):
+            depth -= 1
+
+
+def _parse_value(event: Event) -> Any:
+    # Unlike the keys, the values can be anything a scalar resolves to (e.g. a number), as with the loader
+    if not isinstance(event, ScalarEvent):
+        raise _UnexpectedEvent(event)
+
+    if event.tag in (None, "!"):
+        tag = _resolver.resolve(ScalarNode, event.value, event.implicit) if event.tag is None else STR_TAG
+    else:
+        tag = event.tag
+
+    if tag == STR_TAG:
+        return event.value
+
+    if (construct := SafeConstructor.yaml_constructors.get(tag)) is None:
+        raise _UnexpectedEvent(event)
+    # Called directly, as construct_object() would keep every node it has seen
+    return construct(_constructor, ScalarNode(tag, event.value, style=event.style))
+
+
+def _iter_variable_objs(events: Iterator[Event], data_keys: dict[DataKeyId, bytes]) -> Generator[dict[str, Any], None, None]:
+    """
+    Read the variables straight from the events of the parser, without building any node, one at a time,
+    and put the data keys into data_keys as they come.
+
+    Anything which does not fit the schema (aliases, collections as values, etc.) raises _UnexpectedEvent.
+    """
+    # The stream and document starts
+    next(events)
+    next(events)
+    if not isinstance(next(events), MappingStartEvent):
+        raise _UnexpectedEvent()
+
+    variables_found = False
+    while not isinstance(event := next(events), MappingEndEvent):
+        key = _parse_str(event)
+        event = next(events)
+        if key == "data_keys":
+            if not isinstance(event, MappingStartEvent):
+                raise _UnexpectedEvent(event)
+            while not isinstance(event := next(events), MappingEndEvent):
+                data_keys[_parse_str(event)] = b64decode(_parse_str(next(events)).encode("utf-8"))
+            continue
+
+        if key != "variables":
+            _skip_value(event, events)
+            continue
+
+        # The loader would only keep the last ones
+        if variables_found or not isinstance(event, SequenceStartEvent):
+            raise _UnexpectedEvent(event)
+        variables_found = True
+
+        while not isinstance(event := next(events), SequenceEndEvent):
+            if not isinstance(event, MappingStartEvent):
+                raise _UnexpectedEvent(event)
+
+            variable_obj: dict[str, Any] = {}
+            while not isinstance(event := next(events), MappingEndEvent):
+                variable_obj[_parse_str(event)] = _parse_value(next(events))
+            yield variable_obj
+
+    # Anything else than the end of the only document is left to the loader
+    if not isinstance(next(events), DocumentEndEvent) or not isinstance(next(events), StreamEndEvent):
+        raise _UnexpectedEvent()
+
+    if not variables_found:
+        raise _UnexpectedEvent()
+
+
+def _parse_variable_objs(text: str) -> tuple[list[dict[str, Any]], dict[DataKeyId, bytes]] | None:
+    """
+    Read the variables and the data keys from the events of the parser, or give None if the document
+    should be loaded as usual.
+    """
+    data_keys: dict[DataKeyId, bytes] = {}
+    try:
+        return list(_iter_variable_objs(yaml.parse(text, Loader=SafeLoader), data_keys)), data_keys
+    except (_UnexpectedEvent, StopIteration):
+        return None
+
+
+def _to_variable(variable_obj: dict[str, Any]) -> Variable | None:
+    variable_name = variable_obj["name"]
+    variable_value = variable_obj["value"]
+    if variable_value == "":
+        logger.warning(f"Variable {variable_name!r} has empty value. Skipping variable.")
+        return None
+
+    return Variable(
+        name=variable_name,
+        value=variable_value,
+        visibility=VariableVisibility(variable_obj.get("visibility", "plain")),
+        type=VariableType(variable_obj.get("type", "text")),
+    )
 
 
 @overload
@@ -82,86 +336,422 @@ def load_variables(
         file_path = None
         text = text_or_file_path
 
-    obj = yaml.safe_load(text)
-
-    def yield_variables() -> Generator[Variable, None, None]:
-        for variable_obj in obj["variables"]:
-            variable_name = variable_obj["name"]
-            variable_value = variable_obj["value"]
-            variable_visibility = VariableVisibility(variable_obj.get("visibility", "plain"))
-            variable_type = VariableType(variable_obj.get("type", "text"))
-            variable = Variable(
-                name=variable_name,
-                value=variable_value,
-                visibility=variable_visibility,
-                type=variable_type,
-            )
-            if variable_value != "":
-                yield variable
-            else:
-                logger.warning(f"Variable {variable_name!r} has empty value. Skipping variable.")
+    with span("parse_variables", file_path=file_path, bytes_in=len(text)) as args:
+        if (parsed := _parse_variable_objs(text)) is not None:
+            variable_objs, data_keys = parsed
+        else:
+            obj = yaml.load(text, Loader=SafeLoader)
+            variable_objs = obj["variables"]
+            data_keys = {str(data_key_id): b64decode(wrapped_data_key) for data_key_id, wrapped_data_key in (obj.get("data_keys") or {}).items()}
 
-    variables = Variables(yield_variables())
+        variables = Variables((variable for variable_obj in variable_objs if (variable := _to_variable(variable_obj)) is not None), data_keys)
+        args["count"] = len(variables)
 
     if not no_override and file_path is not None:
-        # Build override file path: XXXX.yaml -> XXXX.local.yaml
-        override_file_path = file_path.with_suffix(f".{override_suffix}{file_path.suffix}")
-        if override_file_path.exists():
-            logger.debug(f"Loading override file {override_file_path}")
-            override_variables = load_variables(override_file_path)
+        if (override_variables := _load_override_variables(file_path, override_suffix)) is not None:
             variables = merge_variables(variables, override_variables)
 
     return variables
 
 
+def get_override_file_path(file_path: Path, override_suffix: str = "local") -> Path:
+    # XXXX.yaml -> XXXX.local.yaml
+    return file_path.with_suffix(f".{override_suffix}{file_path.suffix}")
 
-def encrypt_variable(backend: Backend, variable: Variable) -> Variable:
+
+def _load_override_variables(file_path: Path, override_suffix: str) -> Variables | None:
+    override_file_path = get_override_file_path(file_path, override_suffix)
+    if not override_file_path.exists():
+        return None
+
+    logger.debug(f"Loading override file {override_file_path}")
+    return load_variables(override_file_path)
+
+
+def iter_variables(
+    file_path: Path,
+    *,
+    no_override: bool = False,
+    override_suffix: str = "local",
+    data_keys: dict[DataKeyId, bytes] | None = None,
+) -> Generator[Variable, None, None]:
+    """
+    Same as load_variables(), but the file is parsed while the variables are consumed, so only one of
+    them is in memory at a time.
+
+    The override file (if any) is loaded first, as a whole, so that the variables it overrides can be
+    left out. They come last, like with merge_variables().
+
+    The data keys of the files are put into data_keys as they are read (to be given to
+    iter_decrypted_variables()), which is before the variables in the files written by dump_variables().
+
+    The documents which only load_variables() reads (e.g. with anchors and aliases, or merge keys) raise
+    VariablesNotStreamableError, possibly once some of their variables were given.
+    """
+    data_keys = data_keys if data_keys is not None else {}
+    override_variables = None if no_override else _load_override_variables(file_path, override_suffix)
+    override_names = override_variables.names() if override_variables is not None else set()
+    if override_variables is not None:
+        data_keys.update(override_variables.data_keys)
+
+    with file_path.open("rb") as stream:
+        try:
+            for variable_obj in _iter_variable_objs(yaml.parse(stream, Loader=SafeLoader), data_keys):
+                if (variable := _to_variable(variable_obj)) is not None and variable.name not in override_names:
+                    yield variable
+        except (_UnexpectedEvent, StopIteration) as e:
+            raise VariablesNotStreamableError(file_path) from e
+
+    if override_variables is not None:
+        yield from override_variables
+
+
+
+def _should_encrypt(variable: Variable) -> bool:
     if variable.visibility != VariableVisibility.SECRET:
-        return variable
+        return False
 
     if variable.value.startswith(ENCRYPTION_PREFIX):
         logger.warning(f"Variable {variable.name!r} is already encrypted. Skipping encryption.")
-        return variable
+        return False
 
-    variable_value = ENCRYPTION_PREFIX + b64encode(backend.encrypt_value(variable.value.encode("utf-8"))).decode("utf-8")
-    return variable.with_value(variable_value)
+    return True
 
 
-def decrypt_variable(backend: Backend, variable: Variable, *, raise_when_not_encrypted: bool = False) -> Variable:
+def _should_decrypt(variable: Variable, *, raise_when_not_encrypted: bool) -> bool:
     if variable.visibility != VariableVisibility.SECRET:
-        return variable
+        return False
 
     if not variable.value.startswith(ENCRYPTION_PREFIX):
         if raise_when_not_encrypted:
             raise VariableNotEncryptedError(variable.name)
         logger.warning(f"Variable {variable.name!r} is not encrypted. Skipping decryption.")
-        return variable
+        return False
 
-    variable_value = variable.value[len(ENCRYPTION_PREFIX):]
-    variable_value_bytes = b64decode(variable_value.encode("utf-8"))
-    variable_value = backend.decrypt_value(variable_value_bytes).decode("utf-8")
-    return variable.with_value(variable_value)
+    return True
 
 
+def _encode_encrypted_value(encrypted_value: bytes) -> VariableValue:
+    return ENCRYPTION_PREFIX + b64encode(encrypted_value).decode("utf-8")
 
-def encrypt_variables(backend: Backend, variables: Variables) -> Variables:
-    return Variables(
-        encrypt_variable(backend, variable)
-        for variable in variables
-    )
+
+def _decode_encrypted_value(variable_value: VariableValue) -> bytes:
+    return b64decode(variable_value[len(ENCRYPTION_PREFIX):].encode("utf-8"))
+
+
+def _get_data_key_id(wrapped_data_key: bytes) -> DataKeyId:
+    return hashlib.blake2b(wrapped_data_key, digest_size=DATA_KEY_ID_SIZE).hexdigest()
+
+
+def _encode_envelope_value(data_key_id: DataKeyId, sealed_value: bytes) -> VariableValue:
+    return f"{ENVELOPE_ENCRYPTION_PREFIX}{data_key_id}:{b64encode(sealed_value).decode('utf-8')}"
+
+
+def _decode_envelope_value(variable_value: VariableValue) -> tuple[DataKeyId, bytes]:
+    data_key_id, _, encoded_value = variable_value[len(ENVELOPE_ENCRYPTION_PREFIX):].partition(":")
+    return data_key_id, b64decode(encoded_value.encode("utf-8"))
+
+
+def select_variables_to_encrypt(variables: Variables) -> list[int]:
+    """
+    Give the indices of the secret variables which are not encrypted yet.
+    """
+    return [index for index, variable in enumerate(variables) if _should_encrypt(variable)]
+
+
+def select_variables_to_decrypt(variables: Variables, *, raise_when_not_encrypted: bool = False) -> list[int]:
+    """
+    Give the indices of the secret variables which are encrypted.
+    """
+    return [index for index, variable in enumerate(variables) if _should_decrypt(variable, raise_when_not_encrypted=raise_when_not_encrypted)]
+
+
+def encode_encrypted_values(encrypted_values: list[bytes]) -> list[VariableValue]:
+    return [_encode_encrypted_value(encrypted_value) for encrypted_value in encrypted_values]
+
+
+def find_wrapped_data_key(data_keys: dict[DataKeyId, bytes]) -> tuple[DataKeyId, bytes] | None:
+    """
+    Give the data key that new values are encrypted with (still wrapped by the backend), which is the only
+    data key of the variables, if they only have one. Otherwise, a new one is generated (see generate_data_key()).
+    """
+    if len(data_keys) != 1:
+        return None
+
+    [(data_key_id, wrapped_data_key)] = data_keys.items()
+    return data_key_id, wrapped_data_key
+
+
+def generate_data_key() -> bytes:
+    return os.urandom(DATA_KEY_SIZE)
+
+
+def add_wrapped_data_key(data_keys: dict[DataKeyId, bytes], wrapped_data_key: bytes) -> DataKeyId:
+    data_key_id = _get_data_key_id(wrapped_data_key)
+    data_keys[data_key_id] = wrapped_data_key
+    return data_key_id
+
+
+def _find_or_create_data_key(backend: Backend, data_keys: dict[DataKeyId, bytes]) -> tuple[DataKeyId, bytes]:
+    if (data_key_id_and_wrapped_data_key := find_wrapped_data_key(data_keys)) is not None:
+        data_key_id, wrapped_data_key = data_key_id_and_wrapped_data_key
+        [data_key] = decrypt_values(backend, [wrapped_data_key])
+        return data_key_id, data_key
+
+    data_key = generate_data_key()
+    [wrapped_data_key] = encrypt_values(backend, [data_key])
+    return add_wrapped_data_key(data_keys, wrapped_data_key), data_key
 
 
+def seal_variables(data_key_id: DataKeyId, data_key: bytes, variables: list[Variable]) -> list[VariableValue]:
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+
+    aead = ChaCha20Poly1305(data_key)
+    variable_values: list[VariableValue] = []
+    for variable in variables:
+        # The name is authenticated as well, so that a value cannot be moved to another variable
+        nonce = os.urandom(ENVELOPE_NONCE_SIZE)
+        sealed_value = nonce + aead.encrypt(nonce, variable.value.encode("utf-8"), variable.name.encode("utf-8"))
+        variable_values.append(_encode_envelope_value(data_key_id, sealed_value))
+    return variable_values
+
+
+def get_backend_encrypted_values(variables: Variables, indices: list[int], data_keys: dict[DataKeyId, bytes]) -> tuple[list[bytes], list[DataKeyId]]:
+    """
+    Give what the backend has to decrypt for these variables: the values it encrypted, then the data keys
+    of the envelope encrypted values which are not in data_keys (already unwrapped) yet, along with their IDs.
+    """
+    encrypted_values: list[bytes] = []
+    data_key_ids: dict[DataKeyId, None] = {}
+    for index in indices:
+        variable = variables[index]
+        if not variable.value.startswith(ENVELOPE_ENCRYPTION_PREFIX):
+            encrypted_values.append(_decode_encrypted_value(variable.value))
+            continue
+
+        data_key_id, _ = _decode_envelope_value(variable.value)
+        if data_key_id not in variables.data_keys:
+            raise ValueError(f"Variable {variable.name!r} is encrypted with the data key {data_key_id!r}, which is not in the variables")
+        if data_key_id not in data_keys:
+            data_key_ids[data_key_id] = None
+
+    return [*encrypted_values, *(variables.data_keys[data_key_id] for data_key_id in data_key_ids)], list(data_key_ids)
+
+
+def open_variables(variables: Variables, indices: list[int], decrypted_values: list[bytes], data_key_ids: list[DataKeyId], data_keys: dict[DataKeyId, bytes]) -> list[bytes]:
+    """
+    Give the decrypted values of the variables from what the backend decrypted (see get_backend_encrypted_values()),
+    and add the data keys it unwrapped to data_keys.
+    """
+    value_count = len(decrypted_values) - len(data_key_ids)
+    data_keys.update(zip(data_key_ids, decrypted_values[value_count:]))
+    if not data_keys:
+        return decrypted_values
+
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+    from cryptography.exceptions import InvalidTag
+
+    aeads_by_data_key_id = {data_key_id: ChaCha20Poly1305(data_key) for data_key_id, data_key in data_keys.items()}
+    backend_decrypted_values = iter(decrypted_values[:value_count])
+
+    opened_values: list[bytes] = []
+    for index in indices:
+        variable = variables[index]
+        if not variable.value.startswith(ENVELOPE_ENCRYPTION_PREFIX):
+            opened_values.append(next(backend_decrypted_values))
+            continue
+
+        data_key_id, sealed_value = _decode_envelope_value(variable.value)
+        try:
+            opened_values.append(aeads_by_data_key_id[data_key_id].decrypt(sealed_value[:ENVELOPE_NONCE_SIZE], sealed_value[ENVELOPE_NONCE_SIZE:], variable.name.encode("utf-8")))
+        except InvalidTag as e:
+            raise ValueError(f"Variable {variable.name!r} cannot be decrypted with its data key") from e
+    return opened_values
+
+
+def with_encrypted_values(variables: Variables, indices: list[int], encrypted_variable_values: list[VariableValue], data_keys: dict[DataKeyId, bytes]) -> Variables:
+    """
+    Give the variables with the encrypted values at these indices, and these data keys.
+    """
+    encrypted_variables = list(variables)
+    for index, encrypted_variable_value in zip(indices, encrypted_variable_values):
+        encrypted_variables[index] = variables[index].with_value(encrypted_variable_value)
+    return Variables(encrypted_variables, data_keys)
+
+
+def with_decrypted_values(variables: Variables, indices: list[int], decrypted_values: list[bytes], *, fingerprints: "Fingerprints | None" = None) -> Variables:
+    """
+    Give the variables with the decrypted values at these indices, without the ones which are then empty.
+    """
+    decrypted_variables = list(variables)
+    for index, decrypted_value in zip(indices, decrypted_values):
+        decrypted_variables[index] = variables[index].with_value(decrypted_value.decode("utf-8"))
+        # So that encrypt_variables() can give the same ciphertext back if the plaintext is left as it is
+        if fingerprints is not None:
+            fingerprints.add(decrypted_variables[index], variables[index].value)
 
-def decrypt_variables(backend: Backend, variables: Variables, *, raise_when_not_encrypted: bool = False) -> Variables:
     def yield_decrypted_variables() -> Generator[Variable, None, None]:
-        for variable in variables:
-            decrypted_variable = decrypt_variable(backend, variable, raise_when_not_encrypted=raise_when_not_encrypted)
+        for decrypted_variable in decrypted_variables:
             if decrypted_variable.value != "":
                 yield decrypted_variable
             else:
-                logger.warning(f"Variable {variable.name!r} has empty value after decryption. Skipping variable.")
+                logger.warning(f"Variable {decrypted_variable.name!r} has empty value after decryption. Skipping variable.")
 
-    return Variables(yield_decrypted_variables())
+    return Variables(yield_decrypted_variables(), variables.data_keys)
+
+
+def encrypt_variable(backend: Backend, variable: Variable) -> Variable:
+    if not _should_encrypt(variable):
+        return variable
+
+    variable_value = _encode_encrypted_value(backend.encrypt_value(variable.value.encode("utf-8")))
+    return variable.with_value(variable_value)
+
+
+def decrypt_variable(backend: Backend, variable: Variable, *, raise_when_not_encrypted: bool = False) -> Variable:
+    if not _should_decrypt(variable, raise_when_not_encrypted=raise_when_not_encrypted):
+        return variable
+
+    variable_value = backend.decrypt_value(_decode_encrypted_value(variable.value)).decode("utf-8")
+    return variable.with_value(variable_value)
+
+
+
+def encrypt_variables(
+    backend: Backend,
+    variables: Variables,
+    *,
+    jobs: int = 1,
+    fingerprints: "Fingerprints | None" = None,
+    envelope: bool | None = None,
+) -> Variables:
+    """
+    Encrypt the secret variables which are not encrypted yet.
+
+    With fingerprints, the secrets whose plaintext did not change since they were last decrypted (or
+    encrypted) get their previous ciphertext back, and only the other ones are handed to the backend.
+
+    With envelope (by default, when the variables already have data keys), the backend only wraps a data
+    key (or unwraps the one of the variables, if there is only one), and the values are encrypted with it
+    in-process.
+    """
+    indices = select_variables_to_encrypt(variables)
+
+    reused_indices: list[int] = []
+    reused_variable_values: list[VariableValue] = []
+    if fingerprints is not None:
+        missing_indices: list[int] = []
+        for index in indices:
+            if (encrypted_variable_value := fingerprints.find_encrypted_value(variables[index])) is None:
+                missing_indices.append(index)
+            else:
+                reused_indices.append(index)
+                reused_variable_values.append(encrypted_variable_value)
+        logger.debug("{reused_count} ciphertexts reused, {encrypted_count} values to encrypt", reused_count=len(reused_indices), encrypted_count=len(missing_indices))
+        indices = missing_indices
+
+    if envelope is None:
+        envelope = bool(variables.data_keys)
+
+    data_keys = dict(variables.data_keys)
+    with span("encrypt_variables", count=len(indices), jobs=jobs, envelope=envelope):
+        if envelope and indices:
+            data_key_id, data_key = _find_or_create_data_key(backend, data_keys)
+            encrypted_variable_values = seal_variables(data_key_id, data_key, [variables[index] for index in indices])
+        else:
+            encrypted_variable_values = encode_encrypted_values(encrypt_values(backend, [variables[index].value.encode("utf-8") for index in indices], jobs=jobs))
+    if fingerprints is not None:
+        for index, encrypted_variable_value in zip(indices, encrypted_variable_values):
+            fingerprints.add(variables[index], encrypted_variable_value)
+
+    return with_encrypted_values(variables, [*reused_indices, *indices], [*reused_variable_values, *encrypted_variable_values], data_keys)
+
+
+
+def decrypt_variables(
+    backend: Backend,
+    variables: Variables,
+    *,
+    raise_when_not_encrypted: bool = False,
+    jobs: int = 1,
+    fingerprints: "Fingerprints | None" = None,
+    executor: "Executor | None" = None,
+) -> Variables:
+    """
+    Decrypt the secret variables, in one batch of the backend: the values it encrypted, along with the
+    data keys of the envelope encrypted values (which are then decrypted in-process).
+
+    The data keys stay with the decrypted variables, so that encrypt_variables() uses them again. With an
+    executor, the backend is called by its workers (see decrypt_values()).
+    """
+    return _decrypt_variables(backend, variables, raise_when_not_encrypted=raise_when_not_encrypted, jobs=jobs, fingerprints=fingerprints, unwrapped_data_keys={}, executor=executor)
+
+
+def _decrypt_variables(
+    backend: Backend,
+    variables: Variables,
+    *,
+    raise_when_not_encrypted: bool,
+    jobs: int,
+    fingerprints: "Fingerprints | None",
+    unwrapped_data_keys: dict[DataKeyId, bytes],
+    executor: "Executor | None",
+) -> Variables:
+    indices = select_variables_to_decrypt(variables, raise_when_not_encrypted=raise_when_not_encrypted)
+    with span("decrypt_variables", count=len(indices), jobs=jobs):
+        encrypted_values, data_key_ids = get_backend_encrypted_values(variables, indices, unwrapped_data_keys)
+        decrypted_values = open_variables(variables, indices, decrypt_values(backend, encrypted_values, jobs=jobs, executor=executor), data_key_ids, unwrapped_data_keys)
+
+    return with_decrypted_values(variables, indices, decrypted_values, fingerprints=fingerprints)
+
+
+def iter_decrypted_variables(
+    backend: Backend,
+    variables: Iterable[Variable],
+    *,
+    raise_when_not_encrypted: bool = False,
+    jobs: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    data_keys: dict[DataKeyId, bytes] | None = None,
+) -> Generator[Variable, None, None]:
+    """
+    Same as decrypt_variables(), but the variables are decrypted batch by batch while they are consumed.
+
+    The data keys are looked up in data_keys when each batch is decrypted, so they can be filled by
+    iter_variables() in the meantime, and each of them is only unwrapped once.
+    """
+    unwrapped_data_keys: dict[DataKeyId, bytes] = {}
+    iterator = iter(variables)
+    while batch := Variables(islice(iterator, batch_size), data_keys):
+        yield from _decrypt_variables(backend, batch, raise_when_not_encrypted=raise_when_not_encrypted, jobs=jobs, fingerprints=None, unwrapped_data_keys=unwrapped_data_keys, executor=None)
+
+
+def _represent_variables(variables: Variables) -> MappingNode:
+    # The nodes are built directly, which gives the same output as yaml.dump() on the equivalent dict
+    variables_node = SequenceNode(
+        SEQ_TAG,
+        [
+            MappingNode(
+                MAP_TAG,
+                [
+                    (ScalarNode(STR_TAG, key), ScalarNode(STR_TAG, value))
+                    for key, value in zip(VARIABLE_KEYS, (variable.name, variable.type.value, variable.value, variable.visibility.value))
+                ],
+                flow_style=False,
+            )
+            for variable in variables
+        ],
+        flow_style=False,
+    )
+    data_keys_items: list[tuple[Any, Any]] = []
+    if variables.data_keys:
+        data_keys_node = MappingNode(
+            MAP_TAG,
+            [(ScalarNode(STR_TAG, data_key_id), ScalarNode(STR_TAG, b64encode(wrapped_data_key).decode("utf-8"))) for data_key_id, wrapped_data_key in sorted(variables.data_keys.items())],
+            flow_style=False,
+        )
+        data_keys_items.append((ScalarNode(STR_TAG, "data_keys"), data_keys_node))
+    return MappingNode(MAP_TAG, [*data_keys_items, (ScalarNode(STR_TAG, "variables"), variables_node)], flow_style=False)
 
 
 @overload
@@ -174,142 +764,549 @@ def dump_variables(variables: Variables, file_path: Path) -> None: ...
 
 
 def dump_variables(variables: Variables, file_path: Path | None = None) -> str | None:
-    obj = {
-        "variables": [
-            {
-                "name": variable.name,
-                "value": variable.value,
-                "visibility": variable.visibility.value,
-                "type": variable.type.value,
-            }
-            for variable in variables
-        ]
-    }
     content = "---\n"
-    content += yaml.dump(obj)
+    # Values which are not strings in the first place (e.g. numbers) are dumped as they were loaded
+    if all(isinstance(variable.value, str) for variable in variables):
+        # libyaml folds and escapes some strings differently than the pure Python emitter, so it
+        # is only used when all of them are single lines of printable ASCII (e.g. base64)
+        dumper = SafeDumper if all(LIBYAML_SAFE_STR_PATTERN.fullmatch(variable.name) and LIBYAML_SAFE_STR_PATTERN.fullmatch(variable.value) for variable in variables) else yaml.SafeDumper
+        content += yaml.serialize(_represent_variables(variables), Dumper=dumper)
+    else:
+        obj: dict[str, Any] = {
+            **({"data_keys": {data_key_id: b64encode(wrapped_data_key).decode("utf-8") for data_key_id, wrapped_data_key in variables.data_keys.items()}} if variables.data_keys else {}),
+            "variables": [
+                {
+                    "name": variable.name,
+                    "value": variable.value,
+                    "visibility": variable.visibility.value,
+                    "type": variable.type.value,
+                }
+                for variable in variables
+            ]
+        }
+        content += yaml.dump(obj)
     if file_path is not None:
-        file_path.write_text(content, encoding="utf-8")
+        with span("write_variables_file", file_path=file_path, bytes_out=len(content)):
+            file_path.write_text(content, encoding="utf-8")
         return None
     else:
         return content
+
+
+def _compose_value_nodes(text: str) -> tuple[list[tuple[VariableName, ScalarNode, bool]], set[DataKeyId]] | None:
+    # The name, the value node and whether it is in a flow mapping, for each variable of the file, and
+    # the IDs of its data keys
+    root_node = yaml.compose(text, Loader=yaml.SafeLoader)
+    if not isinstance(root_node, MappingNode):
+        return None
+
+    value_nodes: list[tuple[VariableName, ScalarNode, bool]] = []
+    data_key_ids: set[DataKeyId] = set()
+    for key_node, variables_node in root_node.value:
+        if key_node.value == "data_keys" and isinstance(variables_node, MappingNode):
+            data_key_ids.update(data_key_id_node.value for data_key_id_node, _ in variables_node.value)
+            continue
+
+        if key_node.value != "variables":
+            continue
+
+        if not isinstance(variables_node, SequenceNode):
+            return None
+
+        for variable_node in variables_node.value:
+            if not isinstance(variable_node, MappingNode):
+                return None
+
+            nodes_by_key = {key_node.value: value_node for key_node, value_node in variable_node.value}
+            name_node, value_node = nodes_by_key.get("name"), nodes_by_key.get("value")
+            if not isinstance(name_node, ScalarNode) or not isinstance(value_node, ScalarNode) or value_node.tag != STR_TAG:
+                return None
+
+            value_nodes.append((name_node.value, value_node, bool(variable_node.flow_style or variables_node.flow_style)))
+
+    return value_nodes, data_key_ids
+
+
+def _represent_value(value: VariableValue, *, flow: bool) -> str:
+    # A single line is all that can replace a scalar without knowing its indentation
+    if not flow:
+        content = yaml.dump(value, Dumper=yaml.SafeDumper, width=float("inf"), allow_unicode=True).removesuffix("\n").removesuffix("\n...")
+        if "\n" not in content:
+            return content
+
+    return yaml.dump(value, Dumper=yaml.SafeDumper, width=float("inf"), allow_unicode=True, default_style='"').removesuffix("\n")
+
+
+def update_variables_file(file_path: Path, variables: Variables) -> bool:
+    """
+    Write the values of the variables which changed into the file, and leave the rest of it untouched.
+
+    Only the value nodes of these variables are replaced in the text, so the comments, the layout and
+    the other values stay as they are. Nothing is written at all when no value changed (which keeps the
+    modification time of the file). Gives whether the file has been written.
+    """
+    text = file_path.read_text(encoding="utf-8")
+    composed = _compose_value_nodes(text)
+    value_nodes, data_key_ids = composed if composed is not None else ([], set())
+    if composed is None or not variables.names() <= {name for name, _, _ in value_nodes} or not variables.data_keys.keys() <= data_key_ids:
+        # Variables or data keys which are not in the file yet (or a file which does not look as expected)
+        content = dump_variables(variables)
+        if content == text:
+            return False
+        file_path.write_text(content, encoding="utf-8")
+        return True
+
+    replacements: list[tuple[int, int, str]] = []
+    names: set[VariableName] = set()
+    for name, value_node, flow in value_nodes:
+        # Like by_name(), only the first variable with a name counts
+        if name in names:
+            continue
+        names.add(name)
+
+        if (variable := variables.by_name(name)) is None or variable.value == value_node.value:
+            continue
+
+        start_index, end_index = value_node.start_mark.index, value_node.end_mark.index
+        # The line breaks which end a block scalar are part of its node
+        node_text = text[start_index:end_index]
+        line_breaks = node_text[len(node_text.rstrip("\r\n")):]
+        replacements.append((start_index, end_index, _represent_value(variable.value, flow=flow) + line_breaks))
+
+    if not replacements:
+        logger.debug("Nothing changed in {file_path}", file_path=file_path)
+        return False
+
+    logger.debug("Updating {count} values in {file_path}", count=len(replacements), file_path=file_path)
+    parts: list[str] = []
+    position = 0
+    for start_index, end_index, value_text in replacements:
+        parts.extend([text[position:start_index], value_text])
+        position = end_index
+    parts.append(text[position:])
+    file_path.write_text("".join(parts), encoding="utf-8")
+    return True
     
 
-def export_variables(variables: Variables, target: ExportTarget, config: dict[str, str]) -> str:
+def _scalar_event(value: Any) -> ScalarEvent:
+    # The same event as the serializer gives for the value (which can be something else than a string)
+    node = _representer.represent_data(value)
+    assert isinstance(node, ScalarNode), f"Unexpected value {value!r}"
+    implicit = (
+        node.tag == _resolver.resolve(ScalarNode, node.value, (True, False)),
+        node.tag == _resolver.resolve(ScalarNode, node.value, (False, True)),
+    )
+    return ScalarEvent(None, node.tag, implicit, node.value, style=node.style)
+
+
+def _yield_manifest_events(kind: str, name: str, data_items: Iterable[tuple[VariableName, Any]], namespace: str | None = None) -> Generator[Event, None, None]:
+    # What yaml.dump(manifest_obj, default_flow_style=False, sort_keys=False) serializes, but with the
+    # data items produced only when the emitter gets to them
+    yield StreamStartEvent()
+    yield DocumentStartEvent(explicit=False)
+    yield MappingStartEvent(None, MAP_TAG, True, flow_style=False)
+    for key, value in [("apiVersion", "v1"), ("kind", kind)]:
+        yield _scalar_event(key)
+        yield _scalar_event(value)
+    yield _scalar_event("metadata")
+    yield MappingStartEvent(None, MAP_TAG, True, flow_style=False)
+    yield _scalar_event("name")
+    yield _scalar_event(name)
+    if namespace is not None:
+        yield _scalar_event("namespace")
+        yield _scalar_event(namespace)
+    yield MappingEndEvent()
+    yield _scalar_event("data")
+    yield MappingStartEvent(None, MAP_TAG, True, flow_style=False)
+    for key, value in data_items:
+        yield _scalar_event(key)
+        yield _scalar_event(value)
+    yield MappingEndEvent()
+    yield MappingEndEvent()
+    yield DocumentEndEvent(explicit=False)
+    yield StreamEndEvent()
+
+
+def _write_manifest(file: TextIO, kind: str, name: str, data_items: Iterable[tuple[VariableName, Any]], namespace: str | None = None) -> None:
+    print("---", file=file)
+    yaml.emit(_yield_manifest_events(kind, name, data_items, namespace), file)
+    print(file=file)
+
+
+def _get_shard_index(name: VariableName, shard_count: int) -> int:
+    # A hash which does not change across runs, and a power of two as the number of shards, so that
+    # going from N to 2N shards only moves some items of shard i to shard i + N
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "big") % shard_count
+
+
+def _shard_data_items(kind: str, data_items: list[tuple[VariableName, Any]], max_size: int) -> list[list[tuple[VariableName, Any]]]:
+    """
+    Split the data of a manifest into as few shards as possible (a power of two) whose data is not
+    larger than max_size. Which shard an item goes to only depends on its name and the number of shards.
+    """
+    sizes = {key: len(key.encode("utf-8")) + len(str(value).encode("utf-8")) for key, value in data_items}
+    for key, size in sizes.items():
+        if size > max_size:
+            raise ValueError(f"Variable {key!r} is too large for a {kind} ({size} bytes, while the limit is {max_size} bytes)")
+
+    shard_count = 1
+    while shard_count * max_size < sum(sizes.values()):
+        shard_count *= 2
+
+    while True:
+        shards: list[list[tuple[VariableName, Any]]] = [[] for _ in range(shard_count)]
+        for key, value in data_items:
+            shards[_get_shard_index(key, shard_count)].append((key, value))
+
+        if all(sum(sizes[key] for key, _ in shard) <= max_size for shard in shards):
+            return shards
+
+        shard_count *= 2
+
+
+def _yield_manifests(variables: Iterable[Variable], config: dict[str, str]) -> Generator[tuple[str, str, list[tuple[VariableName, Any]]], None, None]:
+    configmap_items: list[tuple[VariableName, Any]] = []
+    secret_items: list[tuple[VariableName, Any]] = []
+    for variable in variables:
+        if variable.type != VariableType.TEXT:
+            logger.warning(f"Variable {variable.name!r} has type {variable.type!r} which is not supported for kubectl export. Using variable as is.")
+
+        if variable.visibility == VariableVisibility.SECRET:
+            secret_items.append((variable.name, b64encode(variable.value.encode("utf-8")).decode("utf-8")))
+        else:
+            configmap_items.append((variable.name, variable.value))
+
+    max_size = int(config.get("max_size") or DEFAULT_MANIFEST_MAX_DATA_SIZE)
+    for kind, name, data_items in [
+        ("ConfigMap", config.get("configmap_name") or config.get("name") or "variables", configmap_items),
+        ("Secret", config.get("secret_name") or config.get("name") or "variables", secret_items),
+    ]:
+        shards = _shard_data_items(kind, data_items, max_size)
+        # Everything fits in one manifest most of the time, which keeps its name
+        for index, shard in enumerate(shards):
+            yield kind, name if len(shards) == 1 else f"{name}-{index}", shard
+
+
+def _write_manifests(variables: Iterable[Variable], config: dict[str, str], file: TextIO) -> None:
+    namespace = config.get("namespace") or None
+    match KubectlExportFormat(config.get("format") or KubectlExportFormat.YAML):
+        case KubectlExportFormat.YAML:
+            for kind, name, data_items in _yield_manifests(variables, config):
+                _write_manifest(file, kind, name, data_items, namespace)
+
+        case KubectlExportFormat.JSON:
+            file.write('{"apiVersion": "v1", "kind": "List", "items": [')
+            for index, (kind, name, data_items) in enumerate(_yield_manifests(variables, config)):
+                metadata = {"name": name} if namespace is None else {"name": name, "namespace": namespace}
+                manifest = {"apiVersion": "v1", "kind": kind, "metadata": metadata, "data": dict(data_items)}
+                file.write((", " if index > 0 else "") + json.dumps(manifest))
+            file.write("]}")
+
+
+def _bash_line(variable: Variable) -> str:
+    value = b64encode(variable.value.encode("utf-8")).decode("utf-8")
+    match variable.type:
+        case VariableType.FILE:
+            return dedent("""\
+                export {variable_name}="$( 
+                declare file_path
+                file_path="$( mktemp )"
+                base64 --decode <<<'{value}' >"${{file_path}}"
+                echo "${{file_path}}"
+            )"
+            """).format(
+                variable_name=variable.name,
+                value=value,
+            )
+
+        case VariableType.TEXT:
+            return f'export {variable.name}="$( base64 --decode <<<\'{value}\' )"'
+
+
+def _env_file_line(variable: Variable, quoting: EnvFileQuoting) -> str:
+    if variable.type != VariableType.TEXT:
+        logger.warning(f"Variable {variable.name!r} has type {variable.type!r} which is not supported for env file export. Using variable as is.")
+
+    value = str(variable.value)
+    if quoting == EnvFileQuoting.DOCKER:
+        # Each line is a variable, and whatever follows the = is the value
+        if ENV_FILE_LINE_BREAK_PATTERN.search(value):
+            raise ValueError(f"Variable {variable.name!r} has a line break, which `docker run --env-file` cannot read (export it with -c quoting=dotenv instead)")
+        return f"{variable.name}={value}"
+
+    # Bare values are read the same by `docker run --env-file` and by the dotenv parsers, the other
+    # ones have to be quoted for the latter
+    if ENV_FILE_BARE_VALUE_PATTERN.fullmatch(value):
+        return f"{variable.name}={value}"
+
+    if not ENV_FILE_SINGLE_QUOTE_UNSAFE_PATTERN.search(value):
+        return f"{variable.name}='{value}'"
+
+    return f'{variable.name}="{value.translate(ENV_FILE_DOUBLE_QUOTE_ESCAPES)}"'
+
+
+def _quote_for_bash(value: str) -> str:
+    # Like `printf %q`: as it is if nothing has to be quoted, single-quoted if possible, ANSI-C
+    # quoted ($'...') if there are control characters (like line breaks)
+    if BASH_BARE_VALUE_PATTERN.fullmatch(value):
+        return value
+
+    if not BASH_CONTROL_CHAR_PATTERN.search(value):
+        return "'" + value.replace("'", "'\\''") + "'"
+
+    return "$'" + value.translate(BASH_ANSI_C_ESCAPES) + "'"
+
+
+def _yield_builtins_bash_lines(variables: Iterable[Variable]) -> Generator[str, None, None]:
+    # The only process is the `mktemp -d` which creates the folder of the files, if there are any
+    file_count = 0
+    for variable in variables:
+        value = str(variable.value)
+        match variable.type:
+            case VariableType.FILE:
+                if file_count == 0:
+                    yield f'{BASH_FILES_FOLDER_VARIABLE_NAME}="$( mktemp -d )"'
+                file_path = f'"${{{BASH_FILES_FOLDER_VARIABLE_NAME}}}/{file_count}"'
+                yield f"printf '%s' {_quote_for_bash(value)} >{file_path}"
+                yield f"export {variable.name}={file_path}"
+                file_count += 1
+
+            case VariableType.TEXT:
+                yield f"export {variable.name}={_quote_for_bash(value)}"
+
+    if file_count > 0:
+        yield f"unset -v {BASH_FILES_FOLDER_VARIABLE_NAME}"
+
+
+def write_variables(variables: Iterable[Variable], target: ExportTarget, config: dict[str, str], file: TextIO) -> None:
+    """
+    Write the same as export_variables() into the file, while the variables are consumed.
+
+    For kubectl, all the variables are kept until they are split into the manifests, so that none of
+    them is larger than the limit of Kubernetes (or the max_size of the config).
+    """
+    with span("write_variables", target=target.value):
+        _write_variables(variables, target, config, file)
+
+
+def _write_variables(variables: Iterable[Variable], target: ExportTarget, config: dict[str, str], file: TextIO) -> None:
     match target:
         case ExportTarget.KUBECTL:
-            variables_for_secret: list[Variable] = []
-            variables_for_configmap: list[Variable] = []
-            for variable in variables:
-                if variable.type != VariableType.TEXT:
-                    logger.warning(f"Variable {variable.name!r} has type {variable.type!r} which is not supported for kubectl export. Using variable as is.")
-
-                if variable.visibility == VariableVisibility.SECRET:
-                    variables_for_secret.append(variable)
-                else:
-                    variables_for_configmap.append(variable)
-
-            configmap_name = config.get("configmap_name") or config.get("name") or "variables"
-            configmap = {
-                "apiVersion": "v1",
-                "kind": "ConfigMap",
-                "metadata": {
-                    "name": configmap_name
-                },
-                "data": {
-                    variable.name: variable.value
-                    for variable in variables_for_configmap
-                },
-            }
-
-            secret_name = config.get("secret_name") or config.get("name") or "variables"
-            secret = {
-                "apiVersion": "v1",
-                "kind": "Secret",
-                "metadata": {
-                    "name": secret_name
-                },
-                "data": {
-                    variable.name: b64encode(variable.value.encode("utf-8")).decode("utf-8")
-                    for variable in variables_for_secret
-                },
-            }
-
-            buffer = StringIO()
-            for manifest_obj in [configmap, secret]:
-                print("---", file=buffer)
-                print(yaml.dump(manifest_obj, default_flow_style=False, sort_keys=False), file=buffer)
-
-            return buffer.getvalue()
-        
+            _write_manifests(variables, config, file)
+
         case ExportTarget.BASH:
-            lines = []
-            for variable in variables:
-                value = b64encode(variable.value.encode("utf-8")).decode("utf-8")
-                match variable.type:
-                    case VariableType.FILE:
-                        line = dedent("""\
-                            export {variable_name}="$( 
-                            declare file_path
-                            file_path="$( mktemp )"
-                            base64 --decode <<<'{value}' >"${{file_path}}"
-                            echo "${{file_path}}"
-                        )"
-                        """).format(
-                            variable_name=variable.name,
-                            value=value,
-                        )
-                    
-                    case VariableType.TEXT:
-                        line = f'export {variable.name}="$( base64 --decode <<<\'{value}\' )"'
-                
-
-                lines.append(line)
-
-            return "\n".join(lines)
-        
+            lines: Iterable[str]
+            match BashExportMode(config.get("mode") or BashExportMode.BASE64):
+                case BashExportMode.BASE64:
+                    lines = map(_bash_line, variables)
+
+                case BashExportMode.BUILTINS:
+                    lines = _yield_builtins_bash_lines(variables)
+
+            for index, line in enumerate(lines):
+                file.write(("\n" if index > 0 else "") + line)
+
+        case ExportTarget.ENV_FILE:
+            quoting = EnvFileQuoting(config.get("quoting") or EnvFileQuoting.DOCKER)
+            for index, variable in enumerate(variables):
+                file.write(("\n" if index > 0 else "") + _env_file_line(variable, quoting))
+
         case _:
             raise NotImplementedError(f"Export target {target} is not implemented yet.")
 
 
+def export_variables(variables: Variables, target: ExportTarget, config: dict[str, str]) -> str:
+    buffer = StringIO()
+    write_variables(variables, target, config, buffer)
+    return buffer.getvalue()
+
+
+
+@dataclass
+class ExecutionFiles():
+    # Where the file variables have been written, for the process which runs the command
+    fds: list[int] = field(default_factory=list)
+    temp_file_paths: list[Path] = field(default_factory=list)
+    paths_by_content: dict[VariableValue, str] = field(default_factory=dict)
+    paths_by_name: dict[VariableName, str] = field(default_factory=dict)
+
+
+def _write_file_variable(variable_value: VariableValue, file_storage: FileStorage, execution_files: ExecutionFiles, exit_stack: ExitStack) -> str:
+    match file_storage:
+        case FileStorage.MEMORY:
+            # The variables with the same content share the same (sealed) file
+            if (path := execution_files.paths_by_content.get(variable_value)) is None:
+                fd = exit_stack.enter_context(create_memory_file(variable_value))
+                execution_files.fds.append(fd)
+                path = execution_files.paths_by_content[variable_value] = str(get_memory_file_path(fd))
+            return path
+
+        case FileStorage.DISK:
+            temp_file_path = exit_stack.enter_context(create_temp_file(variable_value))
+            execution_files.temp_file_paths.append(temp_file_path)
+            return str(temp_file_path)
+
+
+def prepare_execution(command: Command, variables: Variables, exit_stack: ExitStack, *, file_storage: FileStorage = FileStorage.DISK) -> tuple[Command, dict[str, str], ExecutionFiles]:
+    """
+    Give the command and the environment to run it with, and the files which it should be given.
+    """
+    if file_storage == FileStorage.MEMORY and not is_memory_file_supported():
+        logger.warning("The in-memory files are not supported on this platform. Writing them to the disk instead.")
+        file_storage = FileStorage.DISK
 
-def execute_with_variables(command: Command, variables: Variables, **kwargs: Any) -> CompletedProcess:
     variable_values_by_name: dict[str, str] = {}
-    exit_stack = ExitStack()
-    try:
+    execution_files = ExecutionFiles()
+    with span("write_files", file_storage=file_storage.value) as args:
         for variable in variables:
             if variable.visibility == VariableVisibility.SECRET and variable.value.startswith(ENCRYPTION_PREFIX):
                 logger.warning(f"Variable {variable.name!r} is still encrypted. It should be decrypted before execution.")
                 continue
 
-            variable_name = variable.name if variable.prefix is None else f"{variable.prefix}_{variable.name}"
+            variable_name = variable.prefixed_name
             match variable.type:
                 case VariableType.FILE:
-                    temp_file_path = exit_stack.enter_context(create_temp_file(variable.value))
-                    logger.debug("Writing variable {variable_name!r} to temporary file {temp_file_path}", variable_name=variable_name, temp_file_path=temp_file_path)
-                    variable_values_by_name[variable_name] = str(temp_file_path)
+                    file_path_str = _write_file_variable(variable.value, file_storage, execution_files, exit_stack)
+                    logger.debug("Writing variable {variable_name!r} to file {file_path}", variable_name=variable_name, file_path=file_path_str)
+                    variable_values_by_name[variable_name] = file_path_str
+                    execution_files.paths_by_name[variable_name] = file_path_str
 
                 case VariableType.TEXT:
                     variable_values_by_name[variable_name] = variable.value
+        args["count"] = len(execution_files.fds) + len(execution_files.temp_file_paths)
 
-        
+    with span("interpolate_command", count=len(command)):
         command, variable_values_by_name = _interpolate_command(command, variable_values_by_name)
 
-        logger.debug(f"{variable_values_by_name=}")
+    logger.debug(f"{variable_values_by_name=}")
 
 
-        env = {
-            **environ,
-            **variable_values_by_name,
-        }
+    env = {
+        **environ,
+        **variable_values_by_name,
+    }
+    return command, env, execution_files
 
-        return run(
-            command,
-            env=env,
-            check=True,
-            **kwargs,
-        )
-    finally:
-        exit_stack.close()
+
+def execute_with_variables(command: Command, variables: Variables, *, file_storage: FileStorage = FileStorage.DISK, **kwargs: Any) -> CompletedProcess:
+    """
+    Run the command with the variables in its environment.
+
+    The file variables are written to temporary files on the disk or, with FileStorage.MEMORY, to
+    in-memory files (memfd) which the command inherits and reads through /dev/fd.
+    """
+    with ExitStack() as exit_stack:
+        command, env, execution_files = prepare_execution(command, variables, exit_stack, file_storage=file_storage)
+        with span("run_command", command=command[0]):
+            return run(
+                command,
+                env=env,
+                check=True,
+                pass_fds=(*kwargs.pop("pass_fds", ()), *execution_files.fds),
+                **kwargs,
+            )
+
+
+# Removes the files once the process (which has been replaced by the command) is gone
+CLEANUP_SCRIPT = 'while kill -0 "${0}" 2>/dev/null; do sleep 1; done; rm -f -- "${@}"'
+
+
+def replace_with_variables(command: Command, variables: Variables, *, file_storage: FileStorage = FileStorage.MEMORY) -> NoReturn:
+    """
+    Replace the current process by the command (execve), with the variables in its environment.
+
+    Nothing stays resident: the in-memory files are inherited by the command and go away with it. The
+    files written to the disk (if the in-memory ones are not supported, or with FileStorage.DISK) are
+    removed by a small shell which waits for the command to exit.
+    """
+    # Never closed, as the files have to outlive this process image
+    exit_stack = ExitStack()
+    command, env, execution_files = prepare_execution(command, variables, exit_stack, file_storage=file_storage)
+    for fd in execution_files.fds:
+        os.set_inheritable(fd, True)
+
+    if execution_files.temp_file_paths:
+        Popen(["sh", "-c", CLEANUP_SCRIPT, str(os.getpid()), *map(str, execution_files.temp_file_paths)], stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+
+    logger.debug("Replacing the process by {command}", command=command)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execvpe(command[0], command, env)
+
+
+def _stop_process(process: "Popen[bytes]") -> None:
+    if process.poll() is not None:
+        return
+
+    process.terminate()
+    try:
+        process.wait(timeout=STOP_TIMEOUT)
+    except TimeoutExpired:
+        logger.warning("The command did not stop after {timeout} seconds, killing it", timeout=STOP_TIMEOUT)
+        process.kill()
+        process.wait()
+
+
+def _without_file_values(variables: Variables) -> list[Variable]:
+    return [variable.with_value("") if variable.type == VariableType.FILE else variable for variable in variables]
+
+
+def watch_and_execute_with_variables(
+    command: Command,
+    load_variables: Callable[[], Variables],
+    file_paths: Iterable[Path],
+    *,
+    file_storage: FileStorage = FileStorage.DISK,
+    reload_signal: signal.Signals | None = None,
+) -> int:
+    """
+    Run the command with the variables given by load_variables(), which is called again each time one
+    of the files changes, and give the exit code of the command once it exits by itself.
+
+    The command is only restarted when the variables actually changed. With a reload signal, if only
+    the content of file variables written on the disk changed, the files are rewritten in place and the
+    command gets the signal instead.
+    """
+    variables = load_variables()
+    with FileWatcher(file_paths) as watcher, ExitStack() as exit_stack:
+
+        def start() -> tuple["Popen[bytes]", ExecutionFiles]:
+            prepared_command, env, execution_files = prepare_execution(command, variables, exit_stack, file_storage=file_storage)
+            process = Popen(prepared_command, env=env, pass_fds=execution_files.fds)
+            # Stopped before its files are removed
+            exit_stack.callback(_stop_process, process)
+            return process, execution_files
+
+        process, execution_files = start()
+        while (returncode := process.poll()) is None:
+            if not watcher.wait(WATCH_INTERVAL):
+                continue
+
+            try:
+                new_variables = load_variables()
+            except Exception as e:
+                logger.warning("Unable to load the variables, the command keeps the previous ones: {error}", error=e)
+                continue
+
+            if new_variables == variables:
+                logger.debug("The variables did not change")
+                continue
+
+            if reload_signal is not None and not execution_files.fds and _without_file_values(new_variables) == _without_file_values(variables):
+                logger.info("The file variables changed, sending {signal} to the command", signal=reload_signal.name)
+                for variable, new_variable in zip(variables, new_variables):
+                    if variable.value != new_variable.value:
+                        Path(execution_files.paths_by_name[new_variable.prefixed_name]).write_text(new_variable.value, encoding="utf-8")
+                variables = new_variables
+                process.send_signal(reload_signal)
+                continue
+
+            logger.info("The variables changed, restarting the command")
+            variables = new_variables
+            exit_stack.close()
+            process, execution_files = start()
+
+        return returncode
 
 
 def set_variable(
@@ -343,7 +1340,7 @@ def set_variable(
             type=type if type is not None else existing.type,
         )
         # Replace the existing variable
-        return Variables([new_variable if v.name == name else v for v in variables])
+        return variables.with_variable(new_variable)
     else:
         # Create new variable with defaults
         new_variable = Variable(
@@ -353,25 +1350,111 @@ def set_variable(
             type=type if type is not None else VariableType.TEXT,
         )
         # Append to list
-        return Variables(list(variables) + [new_variable])
-    
+        return variables.with_variable(new_variable)
+
+
+def set_variables(variables: Variables, assignments: Iterable[VariableAssignment]) -> Variables:
+    """
+    Same as calling set_variable() for each assignment, but the variables are only copied once.
+    """
+    variables = Variables(variables)
+    for assignment in assignments:
+        existing = variables.by_name(assignment.name)
+        variables.put(Variable(
+            name=assignment.name,
+            value=assignment.value,
+            visibility=assignment.visibility or (existing.visibility if existing is not None else VariableVisibility.PLAIN),
+            type=assignment.type or (existing.type if existing is not None else VariableType.TEXT),
+        ))
+    return variables
+
+
+def parse_assignments(lines: Iterable[str], format: AssignmentFormat, *, visibility: VariableVisibility | None = None, type: VariableType | None = None) -> Generator[VariableAssignment, None, None]:
+    """
+    Parse NAME=VALUE lines (the value is taken as it is) or JSON Lines, skipping the blank lines and
+    (for NAME=VALUE) the comments. The visibility and the type apply when a line does not give its own.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            continue
+
+        match format:
+            case AssignmentFormat.ENV:
+                if line.lstrip().startswith("#"):
+                    continue
+
+                name, separator, value = line.partition("=")
+                if not separator or not name.strip():
+                    raise ValueError(f"Line {line_number} is not NAME=VALUE")
+                yield VariableAssignment(name.strip(), value, visibility, type)
+
+            case AssignmentFormat.JSONL:
+                try:
+                    obj = json.loads(line)
+                    if not isinstance(obj["name"], str) or not isinstance(obj["value"], str):
+                        raise TypeError("the name and the value should be strings")
+                    assignment = VariableAssignment(
+                        name=obj["name"],
+                        value=obj["value"],
+                        visibility=VariableVisibility(obj["visibility"]) if "visibility" in obj else visibility,
+                        type=VariableType(obj["type"]) if "type" in obj else type,
+                    )
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"Line {line_number} is not a valid assignment: {e}") from e
+                yield assignment
+
+
+# What a Jinja template needs to contain to be anything else than plain text
+TEMPLATE_MARKERS = ("{{", "{%", "{#")
+
+
+# How many compiled templates are kept around for the next commands
+TEMPLATE_CACHE_SIZE = 256
+
+
+def _has_template_markers(arg: Argument) -> bool:
+    return any(marker in arg for marker in TEMPLATE_MARKERS)
+
+
+@lru_cache(maxsize=1)
+def _get_environment() -> "Environment":
+    from jinja2 import Environment
+
+    return Environment()
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _compile_template(arg: Argument) -> tuple["Template", frozenset[VariableName]]:
+    # The template and the variables it uses, for each distinct argument
+    from jinja2.meta import find_undeclared_variables
+
+    environment = _get_environment()
+    ast = environment.parse(arg)
+    code_type = environment.compile(ast, name="<command>", filename="<command>")
+    template = environment.template_class.from_code(environment, code_type, environment.globals)
+    return template, frozenset(find_undeclared_variables(ast))
+
 
 def _interpolate_command(command: Command, variable_values_by_name: dict[str, str]) -> tuple[Command, dict[str, str]]:
-    environment = Environment()
-    asts = [environment.parse(arg) for arg in command]
-    code_types = [environment.compile(ast, name="<command>", filename="<command>") for ast in asts]
-    templates = [environment.template_class.from_code(environment, code_type, environment.globals) for code_type in code_types]
-    variable_names_going_to_be_used = [
+    # Most commands have nothing to interpolate, and then Jinja is not even imported
+    if not any(_has_template_markers(arg) for arg in command):
+        return command, variable_values_by_name
+
+    # Only the arguments which are templates are compiled (once per process, thanks to the cache)
+    compiled_templates = [_compile_template(arg) if _has_template_markers(arg) else None for arg in command]
+    variable_names_going_to_be_used = {
         variable_name
-        for ast in asts
-        for variable_name in find_undeclared_variables(ast)
-    ]
+        for compiled_template in compiled_templates
+        if compiled_template is not None
+        for variable_name in compiled_template[1]
+    }
 
     logger.debug("The variables that are going to be used are: {variable_names}", variable_names=list(variable_names_going_to_be_used))
 
     command = [
-        template.render(**variable_values_by_name)
-        for template in templates
+        compiled_template[0].render(**variable_values_by_name) if compiled_template is not None else arg
+        for arg, compiled_template in zip(command, compiled_templates)
     ]
 
     variable_values_by_name = {
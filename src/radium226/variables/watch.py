@@ -0,0 +1,140 @@
+from pathlib import Path
+from typing import Iterable, Self, TYPE_CHECKING
+from types import TracebackType
+from loguru import logger
+import os
+import select
+import struct
+import sys
+import time
+
+if TYPE_CHECKING:
+    import ctypes
+
+
+# The changes of a folder which can mean that one of its files changed: most editors write a new
+# file and move it over the old one instead of writing into it
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+# struct inotify_event, without the name which follows it
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+
+# How long the changes are gathered once one has been seen, so that an editor which writes a file in
+# several steps only counts once
+DEBOUNCE_DELAY = 0.1
+
+
+
+class FileWatcher():
+    """
+    Tells when some files change, with inotify on Linux (on their folders, so that the files can be
+    replaced or created) and by comparing their stat() elsewhere.
+    """
+
+    file_paths: list[Path]
+
+    def __init__(self, file_paths: Iterable[Path]) -> None:
+        self.file_paths = [file_path.absolute() for file_path in file_paths]
+        self._fd: int | None = None
+        self._names_by_wd: dict[int, set[str]] = {}
+        self._stats = self._stat_files()
+
+        if (libc := _load_libc()) is None:
+            logger.debug("inotify is not available, polling the files instead")
+            return
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logger.debug("Unable to use inotify, polling the files instead")
+            return
+
+        self._fd = fd
+        for folder_path in dict.fromkeys(file_path.parent for file_path in self.file_paths):
+            wd = libc.inotify_add_watch(fd, os.fsencode(folder_path), WATCH_MASK)
+            if wd < 0:
+                self.close()
+                raise OSError(f"Unable to watch {folder_path}")
+            self._names_by_wd[wd] = {file_path.name for file_path in self.file_paths if file_path.parent == folder_path}
+
+    def _stat_files(self) -> list[tuple[int, int, int] | None]:
+        stats: list[tuple[int, int, int] | None] = []
+        for file_path in self.file_paths:
+            try:
+                stat_result = file_path.stat()
+                stats.append((stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns))
+            except FileNotFoundError:
+                stats.append(None)
+        return stats
+
+    def _read_events(self, timeout: float) -> bool:
+        assert self._fd is not None
+        changed = False
+        readable_fds, _, _ = select.select([self._fd], [], [], timeout)
+        while readable_fds:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(buffer):
+                wd, _, _, name_size = INOTIFY_EVENT_HEADER.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT_HEADER.size
+                name = buffer[offset:offset + name_size].rstrip(b"\0").decode(sys.getfilesystemencoding(), "surrogateescape")
+                offset += name_size
+                changed = changed or name in self._names_by_wd.get(wd, set())
+            readable_fds, _, _ = select.select([self._fd], [], [], 0)
+        return changed
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait (up to timeout seconds) for one of the files to change, and tell if it did.
+        """
+        if self._fd is None:
+            time.sleep(timeout)
+            stats = self._stat_files()
+            changed, self._stats = stats != self._stats, stats
+            return changed
+
+        if not self._read_events(timeout):
+            return False
+
+        while self._read_events(DEBOUNCE_DELAY):
+            pass
+        return True
+
+    def close(self) -> None:
+        if (fd := self._fd) is not None:
+            self._fd = None
+            os.close(fd)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None) -> None:
+        self.close()
+
+
+
+def _load_libc() -> "ctypes.CDLL | None":
+    if not sys.platform.startswith("linux"):
+        return None
+
+    import ctypes
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        return None
+
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
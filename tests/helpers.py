@@ -0,0 +1,29 @@
+class CountingBackend():
+    """
+    Same as the dummy backend, but keeps the calls it gets and the values it decrypts.
+    """
+
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+        self.decrypted_values: list[bytes] = []
+
+    def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        self.calls.append("encrypt_value")
+        return decrypted_value
+
+    def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        self.calls.append("decrypt_value")
+        self.decrypted_values.append(encrypted_value)
+        return encrypted_value
+
+
+class CountingBatchBackend(CountingBackend):
+
+    def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
+        self.calls.append("encrypt_values")
+        return list(decrypted_values)
+
+    def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
+        self.calls.append("decrypt_values")
+        self.decrypted_values.extend(encrypted_values)
+        return list(encrypted_values)
@@ -1,11 +1,64 @@
 import pytest
 from pytest import FixtureRequest
 from typing import Generator
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 from pathlib import Path
 
 from radium226.variables import Backend
+from radium226.variables.spi import encrypt_values, decrypt_values
 from radium226.variables.backends import dummy
+from radium226.variables.backends import agent
+from radium226.variables.backends import sops
 from radium226.variables.backends import age
+from radium226.variables.backends.age import native as age_native
+from radium226.variables.backends.age import session as age_session
+from radium226.variables.backends.age import format as age_format
+from radium226.variables import load_variables, decrypt_variables
+
+
+# Stands in for sops: the leaves of the document are "encrypted" with the key given by --age and their
+# path (which has to be the same when they are decrypted), and each run is logged to $SOPS_LOG
+SOPS_SCRIPT = """
+import json, os, sys
+arguments = sys.argv[1:]
+if log_file_path := os.getenv("SOPS_LOG"):
+    with open(log_file_path, "a") as log_file:
+        log_file.write(json.dumps(arguments) + "\\n")
+document = json.load(open(arguments[-1]))
+values = document["values"]
+if "--encrypt" in arguments:
+    assert "sops" not in document, "already encrypted"
+    key = arguments[arguments.index("--age") + 1]
+    values = {name: f"ENC[{key}:values:{name}:{value}]" for name, value in values.items()}
+    document = {"values": values, "sops": {"age": [{"recipient": key}], "mac": str(sorted(values.items()))}}
+else:
+    if "--ignore-mac" not in arguments and document["sops"]["mac"] != str(sorted(values.items())):
+        sys.exit("MAC mismatch")
+    key = document["sops"]["age"][0]["recipient"]
+    decrypted_values = {}
+    for name, value in values.items():
+        prefix = f"ENC[{key}:values:{name}:"
+        if not value.startswith(prefix):
+            sys.exit(f"Unable to decrypt {name}")
+        decrypted_values[name] = value[len(prefix):-1]
+    document = {"values": decrypted_values}
+json.dump(document, sys.stdout)
+"""
+
+
+def create_sops_executable(folder_path: Path) -> Path:
+    executable_file_path = folder_path / "sops"
+    executable_file_path.write_text(f"#!{sys.executable}\n{SOPS_SCRIPT}")
+    executable_file_path.chmod(0o755)
+    return executable_file_path
 
 
 @pytest.fixture
@@ -25,10 +78,43 @@ def backend(request: FixtureRequest) -> Generator[Backend, None, None]:
             })) as backend:
                 yield backend
         
+        case "age-native-keypair":
+            key_pair_file_path = Path(__file__).parent / "samples" / "age.key"
+
+            with age_native.create_backend(age_native.parse_config({
+                "key_pair": str(key_pair_file_path)}
+            )) as backend:
+                yield backend
+
+        case "age-native-passphrase":
+            with age_native.create_backend(age_native.parse_config({
+                "passphrase": "my_secret_passphrase"
+            })) as backend:
+                yield backend
+
         case "dummy":
             with dummy.create_backend(dummy.parse_config({})) as backend:
                 yield backend
+
+        case "agent":
+            with tempfile.TemporaryDirectory() as temp_folder_path_str:
+                socket_path = Path(temp_folder_path_str) / "agent.sock"
+                with dummy.create_backend(dummy.parse_config({})) as agent_backend, agent.create_server(agent_backend, socket_path) as server:
+                    thread = threading.Thread(target=server.serve_forever)
+                    thread.start()
+                    try:
+                        with agent.create_backend(agent.parse_config({"socket": str(socket_path)})) as backend:
+                            yield backend
+                    finally:
+                        server.shutdown()
+                        thread.join()
         
+        case "sops":
+            with tempfile.TemporaryDirectory() as temp_folder_path_str:
+                executable_file_path = create_sops_executable(Path(temp_folder_path_str))
+                with sops.create_backend(sops.parse_config({"executable": str(executable_file_path), "age": "age1recipient"})) as backend:
+                    yield backend
+
         case _:
             raise ValueError(f"Unknown backend type: {request.param}")
 
@@ -38,10 +124,236 @@ def backend(request: FixtureRequest) -> Generator[Backend, None, None]:
     [
         "age-keypair", 
         "age-passphrase", 
+        "age-native-keypair",
+        "age-native-passphrase",
         "dummy",
+        "agent",
+        "sops",
     ], 
     indirect=True,
 )
 def test_backend(backend: Backend) -> None:
     value = "test_value"
-    assert backend.decrypt_value(backend.encrypt_value(value.encode())) == value.encode("utf-8")
\ No newline at end of file
+    assert backend.decrypt_value(backend.encrypt_value(value.encode())) == value.encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "backend", 
+    [
+        "age-keypair", 
+        "age-passphrase", 
+        "age-native-keypair",
+        "age-native-passphrase",
+        "dummy",
+        "agent",
+        "sops",
+    ], 
+    indirect=True,
+)
+def test_backend_batch(backend: Backend) -> None:
+    values = [f"test_value_{index}".encode("utf-8") for index in range(3)]
+    assert decrypt_values(backend, encrypt_values(backend, values)) == values
+
+
+
+@pytest.mark.parametrize(
+    "backend, encrypted_file_name",
+    [
+        ("age-native-keypair", "encrypted-age-keypair.yaml"),
+        ("age-native-passphrase", "encrypted-age-passphrase.yaml"),
+        ("age-passphrase", "encrypted-age-passphrase.yaml"),
+    ],
+    indirect=["backend"],
+)
+def test_native_backend_reads_age_files(backend: Backend, encrypted_file_name: str) -> None:
+    """Test that the native backend decrypts values encrypted by age itself."""
+    samples_folder_path = Path(__file__).parent / "samples"
+    encrypted_variables = load_variables(samples_folder_path / encrypted_file_name)
+    decrypted_variables = load_variables(samples_folder_path / "decrypted.yaml")
+    assert decrypt_variables(backend, encrypted_variables) == decrypted_variables
+
+
+
+def test_passphrase_session_derives_key_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a passphrase backend runs scrypt once for all the values it encrypts and decrypts."""
+    derivations: list[bytes] = []
+    derive_scrypt_key = age_session.derive_scrypt_key
+
+    def counting_derive_scrypt_key(passphrase: str, salt: bytes, work_factor: int) -> bytes:
+        derivations.append(salt)
+        return derive_scrypt_key(passphrase, salt, work_factor)
+
+    monkeypatch.setattr(age_session, "derive_scrypt_key", counting_derive_scrypt_key)
+
+    values = [f"test_value_{index}".encode("utf-8") for index in range(50)]
+    with age.create_backend(age.parse_config({"passphrase": "my_secret_passphrase"})) as backend:
+        encrypted_values = encrypt_values(backend, values, jobs=4)
+        assert decrypt_values(backend, encrypted_values, jobs=4) == values
+
+    assert len(derivations) == 1
+    assert len(set(encrypted_values)) == len(values)
+
+
+
+def test_passphrase_session_draws_payload_key_per_value() -> None:
+    """Test that the values of a passphrase session share their header, but not their payload key, and that the header changes with the session."""
+    decrypted_value = b"same value"
+    with age.create_backend(age.parse_config({"passphrase": "my_secret_passphrase"})) as backend:
+        encrypted_values = encrypt_values(backend, [decrypted_value, decrypted_value])
+        assert decrypt_values(backend, encrypted_values) == [decrypted_value, decrypted_value]
+
+    session = age_session.PassphraseSession("my_secret_passphrase")
+    [(first_header, first_payload), (second_header, second_payload)] = [age_format.parse_header(encrypted_value) for encrypted_value in encrypted_values]
+    assert first_header == second_header
+    file_key = session._unwrap(first_header.stanzas)
+    payload_keys = {age_format._hkdf(file_key, payload[:age_format.NONCE_SIZE], b"payload") for payload in [first_payload, second_payload]}
+    assert len(payload_keys) == 2
+
+    with age.create_backend(age.parse_config({"passphrase": "my_secret_passphrase"})) as backend:
+        [other_encrypted_value] = encrypt_values(backend, [decrypted_value])
+    assert age_format.parse_header(other_encrypted_value)[0] != first_header
+    assert session.decrypt_value(other_encrypted_value) == decrypted_value
+
+
+@pytest.mark.parametrize("key", ["age1notbech32", "AGE1Mixed", "age1qyqszqgpqyqszqgpqyqszqgpqyqszqgpqyqszqgpqyqszqgpqyqs0000000"])
+def test_malformed_age_keys_are_age_errors(key: str) -> None:
+    """Test that the keys which are not even bech32 are reported like the other invalid keys."""
+    with pytest.raises(age_format.AgeError, match="Invalid age public key"):
+        age_format.parse_public_key(key)
+    with pytest.raises(age_format.AgeError, match="Invalid age private key"):
+        age_format.parse_private_key(key.upper().replace("AGE1", "AGE-SECRET-KEY-1"))
+
+
+@pytest.mark.parametrize("work_factor", [21, 22])
+def test_scrypt_key_derivation_takes_large_work_factors(monkeypatch: pytest.MonkeyPatch, work_factor: int) -> None:
+    """Test that the work factors that age accepts when decrypting are handed to scrypt (and that its failures are AgeErrors)."""
+    parameters: list[int] = []
+    Scrypt = age_format.Scrypt
+
+    def cheap_scrypt(salt: bytes, length: int, n: int, r: int, p: int) -> age_format.Scrypt:
+        # The real parameters are checked, but the key is derived with a much smaller cost
+        Scrypt(salt=salt, length=length, n=n, r=r, p=p)
+        parameters.append(n)
+        return Scrypt(salt=salt, length=length, n=2, r=r, p=p)
+
+    monkeypatch.setattr(age_format, "Scrypt", cheap_scrypt)
+    salt = age_format.generate_scrypt_salt()
+    assert len(age_format.derive_scrypt_key("my_secret_passphrase", salt, work_factor)) == 32
+    assert parameters == [1 << work_factor]
+
+    monkeypatch.setattr(age_format, "Scrypt", Scrypt)
+    with pytest.raises(age_format.AgeError, match="work factor 0"):
+        age_format.derive_scrypt_key("my_secret_passphrase", salt, 0)
+
+
+def test_agent_reports_errors() -> None:
+    """Test that the errors of the backend of the agent are raised by the agent backend, and that the connection survives them."""
+
+    class FailingDummy(dummy.Dummy):
+
+        def decrypt_value(self, encrypted_value: bytes) -> bytes:
+            if encrypted_value == b"invalid":
+                raise Exception("Invalid value")
+            return encrypted_value
+
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        socket_path = Path(temp_folder_path_str) / "agent.sock"
+        with agent.create_server(FailingDummy(), socket_path) as server:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                with agent.create_backend(agent.parse_config({"socket": str(socket_path)})) as backend:
+                    with pytest.raises(Exception, match="Invalid value"):
+                        backend.decrypt_values([b"valid", b"invalid"])
+                    assert backend.decrypt_values([b"valid"]) == [b"valid"]
+                assert socket_path.stat().st_mode & 0o077 == 0
+            finally:
+                server.shutdown()
+                thread.join()
+        assert not socket_path.exists()
+
+    with agent.create_backend(agent.Config(socket_path=Path("/nonexistent/agent.sock"))) as backend:
+        with pytest.raises(Exception, match="No agent is listening"):
+            backend.decrypt_value(b"value")
+
+
+
+def test_async_age_backend() -> None:
+    key_pair_file_path = Path(__file__).parent / "samples" / "age.key"
+    config = age.parse_config({"key_pair": str(key_pair_file_path)})
+
+    async def encrypt_and_decrypt(value: bytes) -> bytes:
+        async with age.create_async_backend(config) as backend:
+            return await backend.decrypt_value(await backend.encrypt_value(value))
+
+    assert asyncio.run(encrypt_and_decrypt(b"test_value")) == b"test_value"
+
+
+
+def test_sops_backend_spawns_once_per_batch(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the sops backend hands all the values of a batch to a single sops process, both ways."""
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        temp_folder_path = Path(temp_folder_path_str)
+        log_file_path = temp_folder_path / "sops.log"
+        monkeypatch.setenv("SOPS_LOG", str(log_file_path))
+        config = sops.parse_config({"executable": str(create_sops_executable(temp_folder_path)), "age": "age1recipient", "config": ".sops.yaml"})
+
+        def read_runs() -> list[list[str]]:
+            runs = [json.loads(line) for line in log_file_path.read_text().splitlines()]
+            log_file_path.unlink()
+            return runs
+
+        first_values = [f"value_{index}".encode("utf-8") for index in range(20)]
+        second_values = [b"\x00binary\xff", b"other"]
+        with sops.create_backend(config) as backend:
+            first_encrypted_values = encrypt_values(backend, first_values)
+            second_encrypted_values = encrypt_values(backend, second_values)
+            assert read_runs() == [
+                ["--config", ".sops.yaml", "--encrypt", "--age", "age1recipient", "--input-type", "json", "--output-type", "json", "/dev/stdin"],
+            ] * 2
+
+            # The values of both batches, mixed: one process for each batch
+            encrypted_values = [second_encrypted_values[1], *first_encrypted_values, second_encrypted_values[0], first_encrypted_values[0]]
+            assert decrypt_values(backend, encrypted_values) == [second_values[1], *first_values, second_values[0], first_values[0]]
+            assert [run[:4] for run in read_runs()] == [["--config", ".sops.yaml", "--decrypt", "--ignore-mac"]] * 2
+
+            # Each value is bound to its place in the document of its batch
+            document = json.loads(first_encrypted_values[0])
+            document["values"] = {"1": document["values"]["0"]}
+            with pytest.raises(Exception):
+                backend.decrypt_value(json.dumps(document).encode("utf-8"))
+
+        # The creation rules of sops are matched against the path given with -c filename=...
+        read_runs()
+        with sops.create_backend(sops.parse_config({"executable": config.executable, "age": "age1recipient", "filename": "secrets.yaml"})) as backend:
+            assert decrypt_values(backend, encrypt_values(backend, first_values)) == first_values
+            assert [run[:3] for run in read_runs()] == [["--filename-override", "secrets.yaml", "--encrypt"], ["--filename-override", "secrets.yaml", "--decrypt"]]
+
+        with sops.create_backend(sops.parse_config({"executable": os.devnull})) as backend:
+            with pytest.raises(Exception):
+                backend.encrypt_value(b"value")
+
+
+
+def test_agent_command_detaches_for_eval() -> None:
+    """Test that `eval "$( variables agent )"` returns once the agent listens, and that the agent can then be used and stopped."""
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        socket_path = Path(temp_folder_path_str) / "agent.sock"
+        script = f'eval "$( {sys.executable} -c "from radium226.variables import app; app()" -b dummy agent -a {socket_path} )" && echo "$VARIABLES_AGENT_SOCKET $VARIABLES_AGENT_PID"'
+        process = subprocess.run(["sh", "-c", script], capture_output=True, text=True, timeout=30)
+        assert process.returncode == 0, process.stderr
+        socket_path_str, pid_str = process.stdout.split()
+        assert socket_path_str == str(socket_path)
+
+        pid = int(pid_str)
+        try:
+            with agent.create_backend(agent.parse_config({"socket": socket_path_str})) as backend:
+                assert backend.decrypt_value(b"value") == b"value"
+        finally:
+            os.kill(pid, signal.SIGTERM)
+
+        # The agent removes its socket when it stops
+        deadline = time.monotonic() + 10
+        while socket_path.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not socket_path.exists()
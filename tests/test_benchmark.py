@@ -0,0 +1,24 @@
+from pathlib import Path
+import subprocess
+import tempfile
+import json
+import sys
+
+
+BENCHMARK_FILE_PATH = Path(__file__).parent.parent / "benchmarks" / "benchmark.py"
+
+
+def test_benchmark_runs_on_a_small_corpus() -> None:
+    """Test that the whole benchmark suite still runs (once, on a tiny corpus) and reports every export target."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report_file_path = Path(tmpdir) / "report.json"
+        process = subprocess.run(
+            [sys.executable, str(BENCHMARK_FILE_PATH), "run", "-n", "10", "-r", "1", "--age-max-size", "10", "-o", str(report_file_path)],
+            capture_output=True,
+            text=True,
+        )
+
+        assert process.returncode == 0, f"Benchmark failed: {process.stderr}"
+        results = json.loads(report_file_path.read_text())["results"]
+        assert {"export_variables[target=bash,n=10]", "export_variables[target=env_file,n=10]", "export_variables[target=kubectl,n=10]"} <= set(results)
+        assert "decrypt_variables[backend=age-native,n=10]" in results
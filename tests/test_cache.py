@@ -0,0 +1,117 @@
+from pathlib import Path
+from click.testing import CliRunner
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+import time
+
+from radium226.variables import app
+from radium226.variables.cache import Cache, CachingBackend, create_identity
+from radium226.variables.files import read_or_create_key
+from radium226.variables.backends.dummy import Config
+
+from helpers import CountingBatchBackend
+
+
+def test_caching_backend_decrypts_each_ciphertext_once() -> None:
+    """Test that identical ciphertexts are only handed once to the backend within a process."""
+    dummy = CountingBatchBackend()
+    backend = CachingBackend(dummy, create_identity("dummy", Config()))
+
+    assert backend.decrypt_values([b"a", b"b", b"a"]) == [b"a", b"b", b"a"]
+    assert backend.decrypt_values([b"b", b"c"]) == [b"b", b"c"]
+    assert dummy.decrypted_values == [b"a", b"b", b"c"]
+
+
+
+def test_cache_is_shared_across_backends() -> None:
+    """Test that a value decrypted by one process is read back from the cache by the next one."""
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        cache_folder_path = Path(temp_folder_path_str) / "cache"
+        identity = create_identity("dummy", Config())
+
+        CachingBackend(CountingBatchBackend(), identity, Cache(cache_folder_path)).decrypt_values([b"a", b"b"])
+
+        dummy = CountingBatchBackend()
+        assert CachingBackend(dummy, identity, Cache(cache_folder_path)).decrypt_values([b"a", b"b"]) == [b"a", b"b"]
+        assert dummy.decrypted_values == []
+
+        # Another identity never reads the values decrypted with the first one
+        dummy = CountingBatchBackend()
+        CachingBackend(dummy, create_identity("other", Config()), Cache(cache_folder_path)).decrypt_values([b"a"])
+        assert dummy.decrypted_values == [b"a"]
+
+        for entry_file_path in (cache_folder_path / "entries").iterdir():
+            assert entry_file_path.stat().st_mode & 0o077 == 0
+
+
+
+def test_session_key_is_read_whole_by_concurrent_runs() -> None:
+    """Test that the runs which create the key at the same time all end up with the same whole key."""
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        temp_folder_path = Path(temp_folder_path_str)
+        for index in range(20):
+            key_file_path = temp_folder_path / f"session{index}.key"
+            barrier = threading.Barrier(8)
+
+            def read_key() -> bytes:
+                barrier.wait()
+                return read_or_create_key(key_file_path, 32)
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                keys = list(executor.map(lambda _: read_key(), range(8)))
+            assert len(set(keys)) == 1
+            assert len(keys[0]) == 32
+            assert key_file_path.stat().st_mode & 0o077 == 0
+
+        # Nothing is left aside
+        assert len(list(temp_folder_path.iterdir())) == 20
+
+
+
+def test_cache_ttl_and_eviction() -> None:
+    """Test that expired entries are ignored and that the least recently used ones are evicted first."""
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        cache_folder_path = Path(temp_folder_path_str) / "cache"
+        identity = create_identity("dummy", Config())
+
+        cache = Cache(cache_folder_path, ttl=0.2)
+        cache.put(identity, b"encrypted", b"decrypted")
+        assert cache.get(identity, b"encrypted") == b"decrypted"
+        time.sleep(0.3)
+        assert cache.get(identity, b"encrypted") is None
+
+        cache = Cache(cache_folder_path, max_size=0)
+        cache.put(identity, b"old", b"x" * 100)
+        entry_size = cache.stats().size
+        cache.max_size = 2 * entry_size
+        cache.put(identity, b"new", b"x" * 100)
+        # Reading the oldest entry makes it the most recently used one
+        time.sleep(0.01)
+        assert cache.get(identity, b"old") is not None
+        cache.put(identity, b"newest", b"x" * 100)
+        assert cache.evict() == 1
+        assert cache.get(identity, b"new") is None
+        assert cache.get(identity, b"old") is not None
+        assert cache.get(identity, b"newest") is not None
+
+
+
+def test_cache_commands() -> None:
+    """Test the cache subcommands, which need no key."""
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        runtime_folder_path = Path(temp_folder_path_str)
+        variables_file_path = runtime_folder_path / "variables.yaml"
+        variables_file_path.write_text("---\nvariables:\n- name: A\n  value: encrypted:YQ==\n  visibility: secret\n  type: text\n")
+
+        runner = CliRunner(env={"XDG_RUNTIME_DIR": str(runtime_folder_path)})
+        result = runner.invoke(app, ["-b", "dummy", "--cache", "export", "-t", "bash", str(variables_file_path)])
+        assert result.exit_code == 0, result.output
+
+        result = runner.invoke(app, ["cache", "stats"])
+        assert result.exit_code == 0, result.output
+        assert "entries: 1" in result.output
+
+        result = runner.invoke(app, ["cache", "clear"])
+        assert result.exit_code == 0, result.output
+        assert "Removed 1 entries" in result.output
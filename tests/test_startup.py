@@ -0,0 +1,73 @@
+import pytest
+from pathlib import Path
+import subprocess
+import tempfile
+import json
+import sys
+import os
+
+
+# Runs `variables -b dummy exec -v <file> -- true` and reports what had to be imported for it
+SCRIPT = """
+import sys
+import json
+import time
+
+started_at = time.perf_counter()
+from radium226.variables import app
+app(["-b", "dummy", "exec", "-v", sys.argv[1], "--", "true"], standalone_mode=False)
+print(json.dumps({"duration": time.perf_counter() - started_at, "modules": sorted(sys.modules)}))
+"""
+
+
+# Generous, as it is only there to catch an import of something heavy
+IMPORT_TIME_BUDGET = 2.0
+
+
+HEAVY_MODULES = [
+    "jinja2",
+    "cryptography",
+    "importlib.metadata",
+    "radium226.variables.aio",
+    "radium226.variables.backends.age",
+]
+
+
+
+def test_exec_imports_only_what_it_needs() -> None:
+    """Test that `exec` neither scans the entry points (once the registry is cached) nor imports jinja2 or the other backends."""
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        temp_folder_path = Path(temp_folder_path_str)
+        file_path = temp_folder_path / "variables.yaml"
+        file_path.write_text("---\nvariables:\n- name: FOO\n  value: foo\n  visibility: plain\n  type: text\n")
+
+        env = {**os.environ, "XDG_CACHE_HOME": str(temp_folder_path / "cache")}
+        for _ in range(2):
+            process = subprocess.run([sys.executable, "-c", SCRIPT, str(file_path)], env=env, capture_output=True, text=True, check=True)
+
+        report = json.loads(process.stdout.splitlines()[-1])
+        assert report["duration"] < IMPORT_TIME_BUDGET
+        assert [module for module in HEAVY_MODULES if module in report["modules"]] == []
+        assert (temp_folder_path / "cache" / "radium226-variables" / "backends.json").exists()
+
+
+def test_registry_fingerprint_ignores_the_folders_without_distributions(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that only the folders holding distribution metadata are fingerprinted, so that editing the current folder keeps the registry."""
+    from radium226.variables.spi import _compute_fingerprint
+
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        work_folder_path = Path(temp_folder_path_str) / "work"
+        work_folder_path.mkdir()
+        site_folder_path = Path(temp_folder_path_str) / "site-packages"
+        site_folder_path.mkdir()
+        (site_folder_path / "foo-1.0.dist-info").mkdir()
+        monkeypatch.setattr(sys, "path", [str(work_folder_path), str(site_folder_path)])
+
+        fingerprint = _compute_fingerprint()
+        assert [path_str for path_str, _ in fingerprint] == [str(site_folder_path)]
+
+        (work_folder_path / "variables.yaml").write_text("---\nvariables: []\n")
+        assert _compute_fingerprint() == fingerprint
+
+        (work_folder_path / "bar-1.0.dist-info").mkdir()
+        assert [path_str for path_str, _ in _compute_fingerprint()] == [str(work_folder_path), str(site_folder_path)]
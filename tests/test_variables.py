@@ -2,7 +2,19 @@ import pytest
 from pathlib import Path
 from loguru import logger
 from click.testing import CliRunner
+from textwrap import dedent
+from io import StringIO
 import tempfile
+import threading
+from typing import Any, cast
+import shutil
+import subprocess
+import sys
+import os
+import time
+import asyncio
+import yaml
+import json
 
 from radium226.variables import (
     Variables,
@@ -17,11 +29,27 @@ from radium226.variables import (
     merge_variables,
     app,
     dump_variables,
+    update_variables_file,
+    iter_variables,
+    iter_decrypted_variables,
+    write_variables,
+    export_variables,
+    ExportTarget,
+    VariablesNotStreamableError,
+    BashExportMode,
+    KubectlExportFormat,
+    FileStorage,
     Backend,
+    aload_variables,
+    aencrypt_variables,
+    adecrypt_variables,
+    aexecute_with_variables,
 )
 
 from radium226.variables.backends.dummy import Dummy
 
+from helpers import CountingBackend, CountingBatchBackend
+
 
 @pytest.fixture
 def decrypted_variables() -> Variables:
@@ -62,6 +90,62 @@ def test_encrypt_and_decrypt(backend: Backend, decrypted_variables: Variables) -
             assert decrypted_variable is not None
             assert variable.value == decrypted_variable.value
 
+def test_encrypt_and_decrypt_in_one_batch(decrypted_variables: Variables) -> None:
+    """Test that a batch backend is called once for the whole set of variables."""
+    backend = CountingBatchBackend()
+    variables = decrypt_variables(backend, encrypt_variables(backend, decrypted_variables))
+
+    assert backend.calls == ["encrypt_values", "decrypt_values"]
+    assert variables == decrypted_variables
+
+
+def test_encrypt_and_decrypt_falls_back_to_one_value_at_a_time(decrypted_variables: Variables) -> None:
+    """Test that a backend without batch methods is called once per secret variable."""
+    backend = CountingBackend()
+    variables = decrypt_variables(backend, encrypt_variables(backend, decrypted_variables))
+
+    secret_count = sum(1 for variable in decrypted_variables if variable.visibility == VariableVisibility.SECRET)
+    assert backend.calls == ["encrypt_value"] * secret_count + ["decrypt_value"] * secret_count
+    assert variables == decrypted_variables
+
+
+class FailingBackend():
+
+    def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        return decrypted_value
+
+    def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        if encrypted_value.startswith(b"fail"):
+            # The first failure in file order is the slowest one
+            time.sleep(0.2 if encrypted_value == b"fail-1" else 0.0)
+            raise ValueError(encrypted_value.decode("utf-8"))
+        return encrypted_value
+
+
+def test_decrypt_variables_with_jobs_keeps_order() -> None:
+    """Test that concurrent decryption gives the variables back in file order."""
+    variables = Variables([
+        Variable(name=f"VAR_{index}", value=f"value_{index}", visibility=VariableVisibility.SECRET, type=VariableType.TEXT)
+        for index in range(50)
+    ])
+    backend = Dummy()
+    encrypted_variables = encrypt_variables(backend, variables, jobs=4)
+
+    assert decrypt_variables(backend, encrypted_variables, jobs=4) == variables
+    assert decrypt_variables(CountingBackend(), encrypted_variables, jobs=7) == variables
+
+
+def test_decrypt_variables_with_jobs_raises_first_error_in_file_order() -> None:
+    """Test that errors are reported in file order, whatever the order the jobs fail in."""
+    variables = encrypt_variables(Dummy(), Variables([
+        Variable(name=f"VAR_{index}", value=value, visibility=VariableVisibility.SECRET, type=VariableType.TEXT)
+        for index, value in enumerate(["ok", "fail-1", "ok", "ok", "fail-2", "ok"])
+    ]))
+
+    with pytest.raises(ValueError, match="fail-1"):
+        decrypt_variables(FailingBackend(), variables, jobs=3)
+
+
 def test_execute_with(decrypted_variables: Variables) -> None:
     process = execute_with_variables(
         variables=decrypted_variables,
@@ -95,6 +179,117 @@ def test_execute_with_interpolated_command(decrypted_variables: Variables) -> No
     assert "WIN!" in stdout
 
 
+def test_interpolate_command_compiles_each_template_once() -> None:
+    """Test that only the arguments with a template are compiled, and only the first time they are seen."""
+    from radium226.variables.variables import _interpolate_command, _compile_template
+
+    _compile_template.cache_clear()
+    for _ in range(3):
+        command, variable_values_by_name = _interpolate_command(["cat", "{{ CONFIG }}", "plain\n"], {"CONFIG": "/tmp/config", "FOO": "foo"})
+        assert command == ["cat", "/tmp/config", "plain\n"]
+        assert variable_values_by_name == {"FOO": "foo"}
+
+    cache_info = _compile_template.cache_info()
+    assert (cache_info.misses, cache_info.hits) == (1, 2)
+
+
+def test_execute_with_in_memory_files() -> None:
+    """Test that in-memory files are readable by the command, shared when identical, and never written to the disk."""
+    variables = Variables([
+        Variable(name="CERT", value="certificate", visibility=VariableVisibility.SECRET, type=VariableType.FILE),
+        Variable(name="SAME_CERT", value="certificate", visibility=VariableVisibility.SECRET, type=VariableType.FILE),
+        Variable(name="KEY", value="key", visibility=VariableVisibility.SECRET, type=VariableType.FILE),
+    ])
+    process = execute_with_variables(
+        variables=variables,
+        command=["python", "-c", "import os; print(*(os.environ[name] for name in ['CERT', 'SAME_CERT', 'KEY'])); print(*(open(os.environ[name]).read() for name in ['CERT', 'SAME_CERT', 'KEY']))"],
+        file_storage=FileStorage.MEMORY,
+        capture_output=True,
+        text=True,
+    )
+
+    [paths_line, contents_line] = process.stdout.splitlines()
+    [cert_path, same_cert_path, key_path] = paths_line.split()
+    assert cert_path == same_cert_path != key_path
+    assert cert_path.startswith("/dev/fd/")
+    assert contents_line == "certificate certificate key"
+
+
+# Prints its PID, then replaces itself by a shell which prints its own PID and the variables
+REPLACE_SCRIPT = """
+import os
+from radium226.variables import Variables, Variable, VariableVisibility, VariableType, replace_with_variables
+print(os.getpid(), flush=True)
+replace_with_variables(["sh", "-c", "echo $$ $FOO; cat $CONFIG"], Variables([
+    Variable(name="FOO", value="foo", visibility=VariableVisibility.PLAIN),
+    Variable(name="CONFIG", value="settings", visibility=VariableVisibility.SECRET, type=VariableType.FILE),
+]))
+"""
+
+
+def test_replace_with_variables() -> None:
+    """Test that the command takes the place of the process and still reads the in-memory files."""
+    process = subprocess.run([sys.executable, "-c", REPLACE_SCRIPT], capture_output=True, text=True, check=True)
+
+    [python_pid, shell_line, config_content] = process.stdout.splitlines()
+    assert shell_line == f"{python_pid} foo"
+    assert config_content == "settings"
+
+
+class AsyncDummy():
+
+    def __init__(self) -> None:
+        self.concurrent_calls = 0
+        self.max_concurrent_calls = 0
+
+    async def encrypt_value(self, decrypted_value: bytes) -> bytes:
+        return decrypted_value
+
+    async def decrypt_value(self, encrypted_value: bytes) -> bytes:
+        self.concurrent_calls += 1
+        self.max_concurrent_calls = max(self.max_concurrent_calls, self.concurrent_calls)
+        await asyncio.sleep(0.01)
+        self.concurrent_calls -= 1
+        return encrypted_value
+
+
+def test_async_encrypt_and_decrypt_with_sync_backend(backend: Backend) -> None:
+    """Test that sync backends are adapted to the async API."""
+    async def encrypt_and_decrypt() -> tuple[Variables, Variables]:
+        decrypted_variables = await aload_variables(Path(__file__).parent / "samples" / "decrypted.yaml")
+        encrypted_variables = await aencrypt_variables(backend, decrypted_variables)
+        return decrypted_variables, await adecrypt_variables(backend, encrypted_variables)
+
+    decrypted_variables, variables = asyncio.run(encrypt_and_decrypt())
+    assert variables == decrypted_variables
+
+
+def test_async_decrypt_with_async_backend_is_bounded() -> None:
+    """Test that an async backend resolves many values concurrently, within the limit."""
+    variables = Variables([
+        Variable(name=f"VAR_{index}", value=f"value_{index}", visibility=VariableVisibility.SECRET, type=VariableType.TEXT)
+        for index in range(200)
+    ])
+    backend = AsyncDummy()
+    encrypted_variables = asyncio.run(aencrypt_variables(backend, variables))
+    decrypted_variables = asyncio.run(adecrypt_variables(backend, encrypted_variables, limit=50))
+
+    assert decrypted_variables == variables
+    assert backend.max_concurrent_calls == 50
+
+
+def test_async_execute_with(decrypted_variables: Variables) -> None:
+    process = asyncio.run(aexecute_with_variables(
+        command=["python", "-c", "import os; print(os.getenv('FOO')); print('{{ CONFIG }}')"],
+        variables=decrypted_variables,
+        capture_output=True,
+    ))
+
+    stdout = process.stdout.decode("utf-8")
+    assert "foo" in stdout
+    assert "/tmp" in stdout
+
+
 def test_set_variable_creates_new_with_defaults() -> None:
     """Test creating a new variable with default visibility (plain) and type (text)."""
     variables = Variables([
@@ -472,4 +667,797 @@ def test_load_variables_custom_override_suffix() -> None:
         result = load_variables(base_file, no_override=False, override_suffix="dev")
 
         assert len(result) == 1
-        assert result.by_name("FOO").value == "dev_foo"  # type: ignore
\ No newline at end of file
+        assert result.by_name("FOO").value == "dev_foo"  # type: ignore
+
+
+def test_dump_variables_is_identical_to_yaml_dump() -> None:
+    """Test that dump_variables gives exactly what yaml.dump gives, whether libyaml is used or not."""
+    values = [
+        "plain",
+        "encrypted:" + "QUJD" * 40,
+        "yes",
+        "42",
+        " leading space",
+        "a: b # c",
+        "word " * 30,
+        "first line\nsecond line \n",
+        "tab\tand é and \x01 " + "word " * 20,
+        "😀",
+    ]
+    variables = Variables([
+        Variable(name=f"VAR_{index}", value=value, visibility=VariableVisibility.SECRET, type=VariableType.TEXT)
+        for index, value in enumerate(values)
+    ])
+    for subset in [variables[:4], variables]:
+        obj = {
+            "variables": [
+                {"name": variable.name, "value": variable.value, "visibility": variable.visibility.value, "type": variable.type.value}
+                for variable in subset
+            ]
+        }
+        assert dump_variables(Variables(subset)) == "---\n" + yaml.dump(obj, Dumper=yaml.Dumper)
+        assert load_variables(dump_variables(Variables(subset))) == subset
+
+
+def test_load_variables_outside_of_the_fast_path() -> None:
+    """Test that documents which do not fit the schema exactly are still loaded like yaml.safe_load does."""
+    text = dedent("""\
+        other: [1, {a: b}]
+        variables:
+        - &foo {name: FOO, value: foo}
+        - {name: BAR, value: !!str 1, visibility: secret}
+        - *foo
+    """)
+    assert load_variables(text) == Variables([
+        Variable(name="FOO", value="foo", visibility=VariableVisibility.PLAIN, type=VariableType.TEXT),
+        Variable(name="BAR", value="1", visibility=VariableVisibility.SECRET, type=VariableType.TEXT),
+        Variable(name="FOO", value="foo", visibility=VariableVisibility.PLAIN, type=VariableType.TEXT),
+    ])
+
+    text = dedent("""\
+        variables:
+        - name: PORT
+          value: 8080
+    """)
+    [variable] = load_variables(text)
+    assert variable.value == yaml.safe_load(text)["variables"][0]["value"]
+
+
+
+def test_variables_index_follows_changes() -> None:
+    """Test that by_name stays right whatever changes the list, and finds the first variable with a name."""
+    foo = Variable(name="FOO", value="foo", visibility=VariableVisibility.PLAIN)
+    bar = Variable(name="BAR", value="bar", visibility=VariableVisibility.PLAIN)
+    other_foo = foo.with_value("other_foo")
+
+    variables = Variables([foo, bar, other_foo])
+    assert variables.by_name("FOO") == foo
+    assert variables.index_by_name("BAR") == 1
+
+    del variables[0]
+    assert variables.by_name("FOO") == other_foo
+
+    variables.append(foo)
+    assert variables.by_name("FOO") == other_foo
+
+    variables.insert(0, foo.with_value("first_foo"))
+    assert variables.by_name("FOO") is not None and variables.by_name("FOO").value == "first_foo"  # type: ignore
+
+    variables.clear()
+    assert variables.by_name("FOO") is None
+
+    baz = Variable(name="BAZ", value="baz", visibility=VariableVisibility.PLAIN)
+    variables += [baz]
+    assert variables.by_name("BAZ") == baz
+
+
+def test_variables_put_and_with_variable() -> None:
+    """Test that put updates in place and that with_variable leaves the original variables untouched."""
+    foo = Variable(name="FOO", value="foo", visibility=VariableVisibility.PLAIN)
+    bar = Variable(name="BAR", value="bar", visibility=VariableVisibility.PLAIN)
+    variables = Variables([foo, bar])
+
+    updated_variables = variables.with_variable(foo.with_value("updated"))
+    assert variables == [foo, bar]
+    assert updated_variables == [foo.with_value("updated"), bar]
+
+    variables.put(bar.with_value("updated"))
+    variables.put(Variable(name="BAZ", value="baz", visibility=VariableVisibility.PLAIN))
+    assert [variable.value for variable in variables] == ["foo", "updated", "baz"]
+    assert variables.with_prefix("APP").to_dict() == {"APP_FOO": "foo", "APP_BAR": "updated", "APP_BAZ": "baz"}
+
+
+class RandomizingBackend(CountingBatchBackend):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.encrypted_value_count = 0
+
+    def encrypt_values(self, decrypted_values: list[bytes]) -> list[bytes]:
+        # Like age, every encryption gives a fresh ciphertext
+        super().encrypt_values(decrypted_values)
+        self.encrypted_value_count += len(decrypted_values)
+        return [f"{self.encrypted_value_count}:".encode("utf-8") + decrypted_value for decrypted_value in decrypted_values]
+
+    def decrypt_values(self, encrypted_values: list[bytes]) -> list[bytes]:
+        super().decrypt_values(encrypted_values)
+        return [encrypted_value.split(b":", 1)[1] for encrypted_value in encrypted_values]
+
+
+def test_incremental_encrypt_reuses_unchanged_ciphertexts() -> None:
+    """Test that decrypt, edit then encrypt only re-encrypts the edited secret and only rewrites its line."""
+    from radium226.variables.fingerprints import Fingerprints
+
+    with tempfile.TemporaryDirectory() as temp_folder_path_str:
+        temp_folder_path = Path(temp_folder_path_str)
+        file_path = temp_folder_path / "variables.yaml"
+        backend = RandomizingBackend()
+        identity = b"randomizing"
+        dump_variables(encrypt_variables(backend, Variables([
+            Variable(name="PLAIN", value="plain", visibility=VariableVisibility.PLAIN),
+            Variable(name="KEPT", value="kept", visibility=VariableVisibility.SECRET),
+            Variable(name="EDITED", value="before", visibility=VariableVisibility.SECRET),
+        ])), file_path)
+        file_path.write_text("# Some comment\n" + file_path.read_text())
+        encrypted_text = file_path.read_text()
+
+        fingerprints = Fingerprints(file_path, identity, temp_folder_path / "runtime")
+        assert update_variables_file(file_path, decrypt_variables(backend, load_variables(file_path), fingerprints=fingerprints))
+        fingerprints.save()
+        assert file_path.read_text().startswith("# Some comment\n")
+
+        file_path.write_text(file_path.read_text().replace("value: before", "value: 'after: it changed'"))
+        backend.calls.clear()
+        fingerprints = Fingerprints(file_path, identity, temp_folder_path / "runtime")
+        assert update_variables_file(file_path, encrypt_variables(backend, load_variables(file_path), fingerprints=fingerprints))
+        fingerprints.save()
+        assert backend.encrypted_value_count == 3
+
+        changed_lines = [(before, after) for before, after in zip(encrypted_text.splitlines(), file_path.read_text().splitlines()) if before != after]
+        assert len(changed_lines) == 1
+        variables = decrypt_variables(backend, load_variables(file_path))
+        assert [variable.value for variable in variables] == ["plain", "kept", "after: it changed"]
+
+        # Nothing to encrypt nor to write anymore
+        modified_at = file_path.stat().st_mtime_ns
+        fingerprints = Fingerprints(file_path, identity, temp_folder_path / "runtime")
+        assert not update_variables_file(file_path, encrypt_variables(backend, load_variables(file_path), fingerprints=fingerprints))
+        assert file_path.stat().st_mtime_ns == modified_at
+
+
+def test_iter_variables_streams_like_load_variables() -> None:
+    """Test that the streaming pipeline gives the same variables and output as the one which loads everything."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        file_path = tmpdir_path / "variables.yaml"
+        file_path.write_text(dedent("""\
+            ---
+            variables:
+            - {name: FOO, value: foo, visibility: plain}
+            - name: BAR
+              value: bar
+              visibility: secret
+            - name: EMPTY
+              value: ''
+        """))
+        dump_variables(Variables([
+            Variable(name="FOO", value="override_foo", visibility=VariableVisibility.PLAIN),
+        ]), tmpdir_path / "variables.local.yaml")
+
+        backend = Dummy()
+        variables = encrypt_variables(backend, load_variables(file_path, no_override=True))
+        dump_variables(variables, file_path)
+
+        assert list(iter_variables(file_path)) == load_variables(file_path)
+        assert list(iter_variables(file_path, no_override=True)) == load_variables(file_path, no_override=True)
+
+        # Like with the loader, a value can be something else than a string
+        port_file_path = tmpdir_path / "port.yaml"
+        port_file_path.write_text("variables:\n- name: PORT\n  value: 8080\n")
+        assert [variable.value for variable in iter_variables(port_file_path)] == [variable.value for variable in load_variables(port_file_path)] == [8080]
+
+        decrypted_variables = iter_decrypted_variables(backend, iter_variables(file_path), batch_size=1)
+        for target in ExportTarget:
+            buffer = StringIO()
+            write_variables(iter_decrypted_variables(backend, iter_variables(file_path), batch_size=1), target, {}, buffer)
+            assert buffer.getvalue() == export_variables(decrypt_variables(backend, load_variables(file_path)), target, {})
+        assert list(decrypted_variables) == decrypt_variables(backend, load_variables(file_path))
+
+
+def test_cli_export_falls_back_when_the_file_cannot_be_streamed() -> None:
+    """Test that export still reads the documents which only the loader reads (anchors, aliases and merge keys), without writing anything first."""
+    runner = CliRunner()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "variables.yaml"
+        file_path.write_text(dedent("""\
+            ---
+            variables:
+            - &foo
+              name: FOO
+              value: foo
+              visibility: plain
+              type: text
+            - <<: *foo
+              name: BAR
+            - name: BAZ
+              value: baz
+              visibility: plain
+            - name: QUX
+              value: &qux qux
+              visibility: plain
+            - name: QUUX
+              value: *qux
+              visibility: plain
+        """))
+        # FOO is read before the merge key, so streaming fails after it
+        streamed_names: list[str] = []
+        with pytest.raises(VariablesNotStreamableError):
+            for variable in iter_variables(file_path):
+                streamed_names.append(variable.name)
+        assert streamed_names == ["FOO"]
+
+        variables = load_variables(file_path)
+        assert variables.to_dict() == {"FOO": "foo", "BAR": "foo", "BAZ": "baz", "QUX": "qux", "QUUX": "qux"}
+
+        output_file_path = Path(tmpdir) / "output"
+        output_file_path.write_text("OLD\n")
+        for target in [ExportTarget.ENV_FILE, ExportTarget.KUBECTL]:
+            result = runner.invoke(app, ["-b", "dummy", "export", "-t", target.value, "-c", "name=app", str(file_path)])
+            assert result.exit_code == 0, f"Command failed: {result.output}"
+            assert result.output == export_variables(variables, target, {"name": "app"}) + "\n"
+
+            result = runner.invoke(app, ["-b", "dummy", "export", "-t", target.value, "-c", "name=app", "-o", str(output_file_path), str(file_path)])
+            assert result.exit_code == 0, f"Command failed: {result.output}"
+            assert output_file_path.read_text() == export_variables(variables, target, {"name": "app"}) + "\n"
+
+
+def test_cli_export_parses_a_streamable_file_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that export reads the files which it streams in a single pass."""
+    parse = yaml.parse
+    parsed_file_names: list[str] = []
+
+    def counting_parse(stream: Any, Loader: Any) -> Any:
+        parsed_file_names.append(Path(stream.name).name)
+        return parse(stream, Loader=Loader)
+
+    monkeypatch.setattr(yaml, "parse", counting_parse)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "variables.yaml"
+        dump_variables(encrypt_variables(Dummy(), Variables([
+            Variable(name="FOO", value="foo", visibility=VariableVisibility.SECRET),
+            Variable(name="BAR", value="bar", visibility=VariableVisibility.PLAIN),
+        ])), file_path)
+
+        result = CliRunner().invoke(app, ["-b", "dummy", "export", "-t", "env_file", str(file_path)])
+        assert result.exit_code == 0, f"Command failed: {result.output}"
+        assert result.output == "FOO=foo\nBAR=bar\n"
+        assert parsed_file_names == ["variables.yaml"]
+
+
+def test_cli_exec_with_several_files_keeps_last_wins_order() -> None:
+    """Test that the files, loaded at the same time, still override each other in the order of the options."""
+    runner = CliRunner()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        file_paths = []
+        for index in range(8):
+            file_path = tmpdir_path / f"file{index}.yaml"
+            dump_variables(encrypt_variables(Dummy(), Variables([
+                Variable(name="FOO", value=f"foo{index}", visibility=VariableVisibility.SECRET),
+                Variable(name=f"BAR{index}", value=f"bar{index}", visibility=VariableVisibility.PLAIN),
+            ])), file_path)
+            file_paths.append(file_path)
+        output_file_path = tmpdir_path / "output"
+
+        for auto_prefixes_options, names, expected_output in [
+            ([], ["FOO", "APP_FOO", "BAR7"], "foo7 foo0 bar7"),
+            (["-a"], ["FILE3_FOO", "APP_FOO", "FILE7_BAR7"], "foo3 foo0 bar7"),
+        ]:
+            result = runner.invoke(app, [
+                "-b", "dummy",
+                "exec",
+                *[argument for file_path in file_paths for argument in ["-v", str(file_path)]],
+                "-v", f"APP={file_paths[0]}",
+                *auto_prefixes_options,
+                "--",
+                "python", "-c", f"import os; open({str(output_file_path)!r}, 'w').write(' '.join(os.environ[name] for name in {names!r}))",
+            ])
+
+            assert result.exit_code == 0, f"Command failed: {result.output}"
+            assert output_file_path.read_text() == expected_output
+
+
+@pytest.mark.parametrize("jobs_options, expected_peak", [(["--jobs", "2"], 2), ([], 8)])
+def test_cli_exec_with_several_files_keeps_jobs_as_global_limit(monkeypatch: pytest.MonkeyPatch, jobs_options: list[str], expected_peak: int) -> None:
+    """Test that the backend calls of all the files given to exec are never more than --jobs at once, and one per file without it."""
+    runner = CliRunner()
+
+    lock = threading.Lock()
+    call_counts = {"current": 0, "peak": 0}
+    decrypt_values = Dummy.decrypt_values
+
+    def slow_decrypt_values(self: Dummy, encrypted_values: list[bytes]) -> list[bytes]:
+        with lock:
+            call_counts["current"] += 1
+            call_counts["peak"] = max(call_counts["peak"], call_counts["current"])
+        time.sleep(0.05)
+        with lock:
+            call_counts["current"] -= 1
+        return decrypt_values(self, encrypted_values)
+
+    monkeypatch.setattr(Dummy, "decrypt_values", slow_decrypt_values)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        file_paths = []
+        for index in range(8):
+            file_path = tmpdir_path / f"file{index}.yaml"
+            dump_variables(encrypt_variables(Dummy(), Variables([
+                Variable(name=f"FOO{index}_{value_index}", value=f"foo{value_index}", visibility=VariableVisibility.SECRET)
+                for value_index in range(4)
+            ])), file_path)
+            file_paths.append(file_path)
+
+        result = runner.invoke(app, [
+            "-b", "dummy",
+            "exec",
+            *jobs_options,
+            *[argument for file_path in file_paths for argument in ["-v", str(file_path)]],
+            "--",
+            "true",
+        ])
+
+        assert result.exit_code == 0, f"Command failed: {result.output}"
+        assert 1 < call_counts["peak"] <= expected_peak
+
+
+def test_cli_trace_records_phases_and_backend_calls() -> None:
+    """Test that --trace writes the phases and the backend calls in the Chrome trace event format."""
+    runner = CliRunner()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        file_path = tmpdir_path / "variables.yaml"
+        dump_variables(encrypt_variables(Dummy(), Variables([
+            Variable(name="FOO", value="foo", visibility=VariableVisibility.SECRET),
+            Variable(name="BAR", value="bar", visibility=VariableVisibility.PLAIN),
+        ])), file_path)
+        trace_file_path = tmpdir_path / "trace.json"
+
+        result = runner.invoke(app, ["--trace", str(trace_file_path), "-b", "dummy", "exec", "-v", str(file_path), "--", "true"])
+
+        assert result.exit_code == 0, f"Command failed: {result.output}"
+        trace = json.loads(trace_file_path.read_text())
+        events_by_name = {event["name"]: event for event in trace["traceEvents"] if event["ph"] == "X"}
+        assert {"create_backend", "parse_variables", "decrypt_values", "write_files", "run_command", "command"} <= set(events_by_name)
+        assert events_by_name["decrypt_values"]["args"]["count"] == 1
+        assert events_by_name["decrypt_values"]["args"]["bytes_out"] == len("foo")
+        assert events_by_name["run_command"]["args"]["subprocesses"] == 1
+        assert events_by_name["command"]["dur"] >= events_by_name["run_command"]["dur"]
+
+
+def test_export_env_file_quotes_only_what_it_has_to() -> None:
+    """Test that the dotenv env file keeps the simple values bare, and quotes (and escapes) the other ones."""
+    variables = Variables([
+        Variable(name="URL", value="postgres://localhost:5432/db", visibility=VariableVisibility.PLAIN),
+        Variable(name="EMPTY", value="", visibility=VariableVisibility.PLAIN),
+        Variable(name="SENTENCE", value="Hello, $USER # not a comment", visibility=VariableVisibility.SECRET),
+        Variable(name="QUOTES", value="it's \"quoted\" \\ and\nmultiline", visibility=VariableVisibility.SECRET),
+    ])
+
+    assert export_variables(variables, ExportTarget.ENV_FILE, {"quoting": "dotenv"}) == "\n".join([
+        "URL=postgres://localhost:5432/db",
+        "EMPTY=",
+        "SENTENCE='Hello, $USER # not a comment'",
+        'QUOTES="it\'s \\"quoted\\" \\\\ and\\nmultiline"',
+    ])
+
+
+def test_export_env_file_for_docker_keeps_values_raw() -> None:
+    """Test that the default env file is read back as it was by the parser of `docker run --env-file`, and that line breaks are refused."""
+    variables = Variables([
+        Variable(name="URL", value="postgres://localhost:5432/db", visibility=VariableVisibility.PLAIN),
+        Variable(name="EMPTY", value="", visibility=VariableVisibility.PLAIN),
+        Variable(name="SENTENCE", value="Hello, $USER # not a comment", visibility=VariableVisibility.SECRET),
+        Variable(name="QUOTES", value="it's \"quoted\" \\ = ", visibility=VariableVisibility.SECRET),
+    ])
+
+    # Like docker: one variable per line, whose value is whatever follows the first =
+    lines = export_variables(variables, ExportTarget.ENV_FILE, {}).split("\n")
+    assert [tuple(line.split("=", 1)) for line in lines] == [(variable.name, variable.value) for variable in variables]
+    assert export_variables(variables, ExportTarget.ENV_FILE, {"quoting": "docker"}) == "\n".join(lines)
+
+    multiline_variables = variables.with_variable(Variable(name="CERT", value="line\nline", visibility=VariableVisibility.SECRET))
+    with pytest.raises(ValueError, match="CERT"):
+        export_variables(multiline_variables, ExportTarget.ENV_FILE, {})
+
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "variables.yaml"
+        dump_variables(multiline_variables, file_path)
+        result = runner.invoke(app, ["-b", "dummy", "export", "-t", "env_file", str(file_path)])
+        assert result.exit_code != 0
+        assert "line break" in result.output
+        # Nothing but the error, which the runner prints to stdout
+        assert result.stdout.startswith("Export failed")
+
+        # The files are left as they were when the export fails
+        output_file_path = Path(tmpdir) / "output.env"
+        other_output_file_path = Path(tmpdir) / "other.env"
+        output_file_path.write_text("OLD\n")
+        result = runner.invoke(app, ["-b", "dummy", "export", "-t", "env_file", "-o", str(output_file_path), "--to", f"env_file:{other_output_file_path}", str(file_path)])
+        assert result.exit_code != 0
+        assert output_file_path.read_text() == "OLD\n"
+        assert sorted(path.name for path in Path(tmpdir).iterdir()) == ["output.env", "variables.yaml"]
+
+        result = runner.invoke(app, ["-b", "dummy", "export", "-t", "env_file", "-c", "quoting=dotenv", "-o", str(output_file_path), str(file_path)])
+        assert result.exit_code == 0, f"Command failed: {result.output}"
+        assert "CERT=\"line\\nline\"" in output_file_path.read_text()
+
+
+def test_cli_export_to_output_and_fd() -> None:
+    """Test that export writes to --output (here a FIFO) and --output-fd instead of stdout."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        file_path = tmpdir_path / "variables.yaml"
+        dump_variables(encrypt_variables(Dummy(), Variables([
+            Variable(name="FOO", value="foo", visibility=VariableVisibility.SECRET),
+            Variable(name="BAR", value="bar baz", visibility=VariableVisibility.PLAIN),
+        ])), file_path)
+        fifo_path = tmpdir_path / "fifo"
+        os.mkfifo(fifo_path)
+
+        reader = subprocess.Popen(["cat", str(fifo_path)], stdout=subprocess.PIPE, text=True)
+        result = subprocess.run(
+            [sys.executable, "-c", "from radium226.variables import app; app()", "-b", "dummy", "export", "-t", "env_file", "-o", str(fifo_path), str(file_path)],
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout == ""
+        assert reader.communicate()[0] == "FOO=foo\nBAR=bar baz\n"
+
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(read_fd) as read_file:
+            result = subprocess.run(
+                [sys.executable, "-c", "from radium226.variables import app; app()", "-b", "dummy", "export", "-t", "env_file", "--output-fd", str(write_fd), str(file_path)],
+                capture_output=True,
+                text=True,
+                pass_fds=[write_fd],
+            )
+            os.close(write_fd)
+            assert result.returncode == 0, result.stderr
+            assert read_file.read() == "FOO=foo\nBAR=bar baz\n"
+
+
+def test_export_bash_with_builtins_only() -> None:
+    """Test that the bash export in the builtins mode gives the same values, with no other command than one mktemp."""
+    variables = Variables([
+        Variable(name="PLAIN", value="plain", visibility=VariableVisibility.PLAIN),
+        Variable(name="QUOTED", value="it's $HOME `whoami` \\ \"quoted\"", visibility=VariableVisibility.SECRET),
+        Variable(name="MULTILINE", value="line\n\tindented\x01 it's\\", visibility=VariableVisibility.SECRET),
+        Variable(name="EMPTY", value="", visibility=VariableVisibility.PLAIN),
+        Variable(name="CERT", value="-----BEGIN-----\nabc'\n-----END-----\n", visibility=VariableVisibility.SECRET, type=VariableType.FILE),
+        Variable(name="KEY", value="key", visibility=VariableVisibility.SECRET, type=VariableType.FILE),
+    ])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        script_file_path = tmpdir_path / "variables.sh"
+        script_file_path.write_text(export_variables(variables, ExportTarget.BASH, {"mode": BashExportMode.BUILTINS}))
+        assert script_file_path.read_text().count("$(") == 1
+
+        # Any other command than mktemp would not be found
+        bin_folder_path = tmpdir_path / "bin"
+        bin_folder_path.mkdir()
+        (bin_folder_path / "mktemp").symlink_to(shutil.which("mktemp") or "/usr/bin/mktemp")
+        output = subprocess.check_output(
+            [shutil.which("bash") or "bash", "-e", "-c", f'source {script_file_path}; printf "%s\\0" "$PLAIN" "$QUOTED" "$MULTILINE" "$EMPTY" "$( <"$CERT" )" "$( <"$KEY" )"'],
+            env={"PATH": str(bin_folder_path)},
+            text=True,
+        )
+
+    # $( < ... ) drops the trailing line breaks
+    assert output.split("\0")[:-1] == [variable.value.rstrip("\n") for variable in variables]
+
+
+def test_export_kubectl_shards_large_manifests() -> None:
+    """Test that the kubectl export splits the manifests which are too large, and that the variables keep their shard."""
+    variables = Variables([
+        Variable(name=f"FILE_{index}", value="x" * 100, visibility=VariableVisibility.SECRET if index % 2 else VariableVisibility.PLAIN)
+        for index in range(20)
+    ])
+
+    def export_manifests(variables: Variables, max_size: int) -> list[dict[str, Any]]:
+        output = export_variables(variables, ExportTarget.KUBECTL, {"name": "app", "namespace": "ns", "max_size": str(max_size), "format": KubectlExportFormat.JSON})
+        manifest_list = cast(dict[str, Any], json.loads(output))
+        assert manifest_list["kind"] == "List"
+        return cast(list[dict[str, Any]], manifest_list["items"])
+
+    # Everything fits, so nothing changes
+    manifests = export_manifests(variables, 10_000)
+    assert [(manifest["kind"], manifest["metadata"]) for manifest in manifests] == [
+        ("ConfigMap", {"name": "app", "namespace": "ns"}),
+        ("Secret", {"name": "app", "namespace": "ns"}),
+    ]
+
+    manifests = export_manifests(variables, 400)
+    assert {manifest["metadata"]["name"] for manifest in manifests} >= {"app-0", "app-1"}
+    assert all(sum(len(key) + len(value) for key, value in manifest["data"].items()) <= 400 for manifest in manifests)
+    shards_by_name = {key: (manifest["kind"], manifest["metadata"]["name"]) for manifest in manifests for key in manifest["data"]}
+    assert len(shards_by_name) == len(variables)
+
+    # A new variable does not move the other ones (as long as the number of shards stays the same)
+    more_manifests = export_manifests(variables.with_variable(Variable(name="NEW", value="new", visibility=VariableVisibility.PLAIN)), 400)
+    more_shards_by_name = {key: (manifest["kind"], manifest["metadata"]["name"]) for manifest in more_manifests for key in manifest["data"]}
+    assert len(more_manifests) == len(manifests)
+    assert {name: more_shards_by_name[name] for name in shards_by_name} == shards_by_name
+
+    with pytest.raises(ValueError, match="too large"):
+        export_manifests(variables, 50)
+
+
+def test_cli_export_to_several_targets_decrypts_once() -> None:
+    """Test that --to writes several targets and configs from a single decryption."""
+    runner = CliRunner()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        file_path = tmpdir_path / "variables.yaml"
+        variables = Variables([
+            Variable(name="FOO", value="foo", visibility=VariableVisibility.SECRET),
+            Variable(name="BAR", value="bar", visibility=VariableVisibility.PLAIN),
+        ])
+        dump_variables(encrypt_variables(Dummy(), variables), file_path)
+        trace_file_path = tmpdir_path / "trace.json"
+
+        result = runner.invoke(app, [
+            "--trace", str(trace_file_path),
+            "-b", "dummy",
+            "export",
+            "-t", "env_file",
+            "--to", f"kubectl,name=a,namespace=a:{tmpdir_path / 'a.yaml'}",
+            "--to", f"kubectl,name=b,format=json:{tmpdir_path / 'b.json'}",
+            str(file_path),
+        ])
+
+        assert result.exit_code == 0, f"Command failed: {result.output}"
+        assert result.output == export_variables(variables, ExportTarget.ENV_FILE, {}) + "\n"
+        assert (tmpdir_path / "a.yaml").read_text() == export_variables(variables, ExportTarget.KUBECTL, {"name": "a", "namespace": "a"}) + "\n"
+        assert (tmpdir_path / "b.json").read_text() == export_variables(variables, ExportTarget.KUBECTL, {"name": "b", "format": "json"}) + "\n"
+
+        trace = json.loads(trace_file_path.read_text())
+        assert [event["args"]["backend"] for event in trace["traceEvents"] if event["name"] == "decrypt_values"] == ["Dummy", "CachingBackend"]
+
+
+# Appends its PID and its variables to a file when it starts, and the content of CERT on SIGHUP
+WATCHED_SCRIPT = """
+import os, signal, sys, time
+output_file_path = sys.argv[1]
+def write(line):
+    with open(output_file_path, "a") as output_file:
+        output_file.write(line + "\\n")
+signal.signal(signal.SIGHUP, lambda signal_number, frame: write(f"{os.getpid()} hup {open(os.environ['CERT']).read()}"))
+write(f"{os.getpid()} start {os.environ['FOO']} {open(os.environ['CERT']).read()}")
+while True:
+    time.sleep(0.1)
+"""
+
+
+def test_cli_exec_watch_restarts_or_signals_only_when_needed() -> None:
+    """Test that exec --watch restarts the command when a variable changes, signals it when only a file changes, and decrypts only what changed."""
+    backend = Dummy()
+
+    def wait_for_lines(output_file_path: Path, line_count: int) -> list[str]:
+        for _ in range(100):
+            lines = output_file_path.read_text().splitlines() if output_file_path.exists() else []
+            if len(lines) >= line_count:
+                return lines
+            time.sleep(0.1)
+        raise AssertionError(f"Expected {line_count} lines, got {lines}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        file_path = tmpdir_path / "variables.yaml"
+        output_file_path = tmpdir_path / "output"
+        trace_file_path = tmpdir_path / "trace.json"
+
+        def write_variables_file(foo: str, cert: str) -> None:
+            dump_variables(encrypt_variables(backend, Variables([
+                Variable(name="FOO", value=foo, visibility=VariableVisibility.SECRET),
+                Variable(name="CERT", value=cert, visibility=VariableVisibility.SECRET, type=VariableType.FILE),
+            ])), file_path)
+
+        write_variables_file("foo", "cert")
+        process = subprocess.Popen(
+            [
+                sys.executable, "-c", "from radium226.variables import app; app()",
+                "--trace", str(trace_file_path),
+                "-b", "dummy",
+                "exec", "--watch", "--reload-signal", "hup", "-v", str(file_path),
+                "--", sys.executable, "-c", WATCHED_SCRIPT, str(output_file_path),
+            ],
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            [start_line] = wait_for_lines(output_file_path, 1)
+            pid, _, _, _ = start_line.split()
+            assert start_line == f"{pid} start foo cert"
+
+            # Nothing changed, so nothing happens
+            file_path.write_text(file_path.read_text())
+            time.sleep(1)
+            assert len(wait_for_lines(output_file_path, 1)) == 1
+
+            write_variables_file("bar", "cert")
+            new_start_line = wait_for_lines(output_file_path, 2)[1]
+            new_pid, _, _, _ = new_start_line.split()
+            assert new_pid != pid
+            assert new_start_line == f"{new_pid} start bar cert"
+
+            write_variables_file("bar", "new_cert")
+            assert wait_for_lines(output_file_path, 3)[2] == f"{new_pid} hup new_cert"
+        finally:
+            process.terminate()
+            assert process.wait(timeout=15) == 0
+
+        # The running command has been stopped along with the watcher
+        with pytest.raises(ProcessLookupError):
+            os.kill(int(new_pid), 0)
+
+        trace = json.loads(trace_file_path.read_text())
+        assert sum(event["args"]["count"] for event in trace["traceEvents"] if event["name"] == "decrypt_values" and event["args"]["backend"] == "Dummy") == 4
+
+
+def test_cli_set_command_with_many_variables() -> None:
+    """Test that set takes several pairs and lines from stdin, encrypts the secrets in one batch and writes the file once."""
+    runner = CliRunner()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        variables_file = tmpdir_path / "variables.yaml"
+        dump_variables(Variables([
+            Variable(name="EXISTING", value="old", visibility=VariableVisibility.SECRET),
+            Variable(name="KEPT", value="kept", visibility=VariableVisibility.PLAIN),
+        ]), variables_file)
+        variables_file.chmod(0o640)
+        trace_file_path = tmpdir_path / "trace.json"
+
+        for assignment_format, stdin in [
+            ("env", "# A comment\nFROM_ENV=a=b c\n\nEXISTING=new\n"),
+            ("jsonl", '{"name": "FROM_ENV", "value": "a=b c"}\n{"name": "EXISTING", "value": "new"}\n{"name": "CERT", "value": "line\\nline", "type": "file", "visibility": "plain"}\n'),
+        ]:
+            result = runner.invoke(app, [
+                "--trace", str(trace_file_path),
+                "-b", "dummy",
+                "set",
+                "-v", str(variables_file),
+                "--visibility", "secret",
+                "--stdin", assignment_format,
+                "PAIR_1", "one",
+                "PAIR_2", "two",
+            ], input=stdin)
+            assert result.exit_code == 0, f"Command failed: {result.output}"
+
+            variables = load_variables(variables_file)
+            assert variables.names() >= {"EXISTING", "KEPT", "PAIR_1", "PAIR_2", "FROM_ENV"}
+            assert variables.by_name("KEPT") == Variable(name="KEPT", value="kept", visibility=VariableVisibility.PLAIN)
+            decrypted_values_by_name = decrypt_variables(Dummy(), variables).to_dict()
+            assert {name: decrypted_values_by_name[name] for name in ["EXISTING", "KEPT", "PAIR_1", "PAIR_2", "FROM_ENV"]} == {
+                "EXISTING": "new",
+                "KEPT": "kept",
+                "PAIR_1": "one",
+                "PAIR_2": "two",
+                "FROM_ENV": "a=b c",
+            }
+            assert variables_file.stat().st_mode & 0o777 == 0o640
+
+            trace = json.loads(trace_file_path.read_text())
+            assert [event["args"]["count"] for event in trace["traceEvents"] if event["name"] == "encrypt_values" and event["args"]["backend"] == "Dummy"] == [4]
+
+        assert variables.by_name("CERT") == Variable(name="CERT", value="line\nline", visibility=VariableVisibility.PLAIN, type=VariableType.FILE)
+
+        result = runner.invoke(app, ["-b", "dummy", "set", "-v", str(variables_file), "ONLY_NAME"])
+        assert result.exit_code != 0
+
+
+def test_envelope_encryption_unwraps_one_data_key_per_file() -> None:
+    """Test that the envelope encrypted values only need their data key from the backend, along with the per-value ones."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "variables.yaml"
+        variables = Variables([
+            *(Variable(name=f"SECRET_{index}", value=f"secret {index}", visibility=VariableVisibility.SECRET) for index in range(10)),
+            Variable(name="PLAIN", value="plain", visibility=VariableVisibility.PLAIN),
+        ])
+        encrypted_variables = encrypt_variables(Dummy(), variables, envelope=True)
+        [data_key_id] = encrypted_variables.data_keys
+        assert all(variable.value.startswith(f"encrypted:envelope:{data_key_id}:") for variable in encrypted_variables if variable.visibility == VariableVisibility.SECRET)
+        dump_variables(encrypted_variables, file_path)
+
+        # The override file keeps the current format, with its own key
+        override_variables = encrypt_variables(Dummy(), Variables([
+            Variable(name="SECRET_0", value="overridden", visibility=VariableVisibility.SECRET),
+        ]))
+        dump_variables(override_variables, Path(tmpdir) / "variables.local.yaml")
+
+        loaded_variables = load_variables(file_path)
+        assert loaded_variables.data_keys == encrypted_variables.data_keys
+        backend = CountingBatchBackend()
+        decrypted_values_by_name = decrypt_variables(backend, loaded_variables.with_prefix("APP")).to_dict()
+        assert decrypted_values_by_name == {"APP_SECRET_0": "overridden", **{f"APP_SECRET_{index}": f"secret {index}" for index in range(1, 10)}, "APP_PLAIN": "plain"}
+        assert backend.decrypted_values == [b"overridden", loaded_variables.data_keys[data_key_id]]
+
+        # The same when streamed, even one variable at a time
+        backend = CountingBatchBackend()
+        data_keys: dict[str, bytes] = {}
+        streamed_variables = Variables(iter_decrypted_variables(backend, iter_variables(file_path, data_keys=data_keys), batch_size=1, data_keys=data_keys))
+        assert streamed_variables.with_prefix("APP").to_dict() == decrypted_values_by_name
+        assert sorted(backend.decrypted_values) == sorted([b"overridden", loaded_variables.data_keys[data_key_id]])
+
+        # New secrets get the same data key, which the backend only unwraps
+        backend = CountingBatchBackend()
+        variables = encrypt_variables(backend, loaded_variables.with_variable(Variable(name="NEW", value="new", visibility=VariableVisibility.SECRET)))
+        assert variables.data_keys == loaded_variables.data_keys
+        new_variable = variables.by_name("NEW")
+        assert new_variable is not None
+        assert new_variable.value.startswith(f"encrypted:envelope:{data_key_id}:")
+        assert backend.decrypted_values == [loaded_variables.data_keys[data_key_id]]
+        assert load_variables(dump_variables(variables)).data_keys == variables.data_keys
+
+        # The name is authenticated along with the value
+        first_variable, second_variable = loaded_variables.by_name("SECRET_1"), loaded_variables.by_name("SECRET_2")
+        assert first_variable is not None and second_variable is not None
+        swapped_variables = Variables([first_variable.with_value(second_variable.value)], loaded_variables.data_keys)
+        with pytest.raises(ValueError):
+            decrypt_variables(Dummy(), swapped_variables)
+
+        # Without the data keys of the file
+        with pytest.raises(ValueError):
+            decrypt_variables(Dummy(), Variables(list(loaded_variables)))
+
+        assert asyncio.run(adecrypt_variables(Dummy(), loaded_variables)).to_dict() == decrypt_variables(Dummy(), loaded_variables).to_dict()
+
+
+def test_cli_envelope_encryption_round_trip_and_migrate() -> None:
+    """Test that encrypt --envelope, decrypt, export and migrate keep the envelope format with a single backend call per file."""
+    runner = CliRunner()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir_path = Path(tmpdir)
+        file_path = tmpdir_path / "variables.yaml"
+        variables = Variables([Variable(name=f"SECRET_{index}", value=f"secret {index}", visibility=VariableVisibility.SECRET) for index in range(100)])
+        dump_variables(variables, file_path)
+        trace_file_path = tmpdir_path / "trace.json"
+
+        result = runner.invoke(app, ["-b", "dummy", "encrypt", "--envelope", str(file_path)])
+        assert result.exit_code == 0, f"Command failed: {result.output}"
+        [data_key_id] = load_variables(file_path).data_keys
+
+        result = runner.invoke(app, ["--trace", str(trace_file_path), "-b", "dummy", "export", "-t", "env_file", str(file_path)])
+        assert result.exit_code == 0, f"Command failed: {result.output}"
+        assert result.output == export_variables(variables, ExportTarget.ENV_FILE, {}) + "\n"
+        trace = json.loads(trace_file_path.read_text())
+        assert [event["args"]["count"] for event in trace["traceEvents"] if event["name"] == "decrypt_values"] == [1]
+
+        # The decrypted file keeps the data key, which is used again
+        for command in ["decrypt", "encrypt"]:
+            result = runner.invoke(app, ["-b", "dummy", command, str(file_path)])
+            assert result.exit_code == 0, f"Command failed: {result.output}"
+            assert list(load_variables(file_path).data_keys) == [data_key_id]
+        assert decrypt_variables(Dummy(), load_variables(file_path)) == variables
+
+        result = runner.invoke(app, ["-b", "dummy", "migrate", "-t", "dummy", str(file_path)])
+        assert result.exit_code == 0, f"Command failed: {result.output}"
+        migrated_variables = load_variables(file_path)
+        assert len(migrated_variables.data_keys) == 1 and data_key_id not in migrated_variables.data_keys
+        assert decrypt_variables(Dummy(), migrated_variables) == variables
+
+        result = runner.invoke(app, ["-b", "dummy", "migrate", "-t", "dummy", "--no-envelope", str(file_path)])
+        assert result.exit_code == 0, f"Command failed: {result.output}"
+        migrated_variables = load_variables(file_path)
+        assert not migrated_variables.data_keys
+        assert not any(variable.value.startswith("encrypted:envelope:") for variable in migrated_variables)
+        assert decrypt_variables(Dummy(), migrated_variables) == variables